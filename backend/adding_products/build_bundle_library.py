@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Script to precompute the bundle library for common profiles.
+
+Layer 2 results for requests without flavor/texture preferences depend only on
+the profile (age group, activity, weight, duration, dietary and allergen
+filters), so they are computed here and served by /recommend without running
+vector search or the optimizer (see app/core/bundle_library.py).
+
+1. Load the live catalog generation and its product views
+2. Generate macro targets once per (age group, activity, weight, duration)
+3. Reuse cells whose targets, candidate products and settings are unchanged (unless --full)
+4. Run the optimizer for the remaining cells in a process pool
+5. Atomically write BUNDLE_LIBRARY_PATH; API workers reload it on the next lookup
+
+Run it again after every catalog rebuild: a library built for another catalog
+generation is ignored.
+
+Usage:
+    python build_bundle_library.py [--full] [--workers 8] [--weights 50 60 70] [--durations 30 60 90]
+"""
+
+import sys
+import os
+import time
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.bundle_library import (
+    BUNDLE_LIBRARY_PATH, LIBRARY_ACTIVITIES, REPRESENTATIVE_AGES, BundleLibrary, build_bundle_library, enumerate_cells
+)
+from app.core.macro_targeting_local import MacroTargetingServiceLocal
+from app.db.catalog_index import get_catalog_generation
+from app.db.session import SessionLocal
+
+DEFAULT_WEIGHTS_KG = [50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100]
+DEFAULT_DURATIONS_MIN = [30, 45, 60, 75, 90, 105, 120]
+DEFAULT_DIETARY = ["", "vegan", "vegetarian", "gluten-free"]
+DEFAULT_ALLERGENS = ["", "milk", "peanuts", "tree nuts", "soy"]
+
+def _filter_options(values):
+    """'' means no filter; 'a,b' is a combination of filters."""
+    return [tuple(v.strip() for v in value.split(",") if v.strip()) for value in values]
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute Layer 2 bundles for common profiles")
+    parser.add_argument("--full", action="store_true", help="Recompute every cell instead of reusing unchanged ones")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Optimizer processes")
+    parser.add_argument("--output", default=str(BUNDLE_LIBRARY_PATH), help="Library file to write")
+    parser.add_argument("--age-groups", nargs="+", default=list(REPRESENTATIVE_AGES), help="Age groups to cover")
+    parser.add_argument("--activities", nargs="+", default=list(LIBRARY_ACTIVITIES), help="Activities to cover")
+    parser.add_argument("--weights", nargs="+", type=float, default=DEFAULT_WEIGHTS_KG, help="Body weights (kg)")
+    parser.add_argument("--durations", nargs="+", type=float, default=DEFAULT_DURATIONS_MIN, help="Exercise durations (minutes)")
+    parser.add_argument("--dietary", nargs="+", default=DEFAULT_DIETARY, help="Dietary filter combinations ('' = none, 'a,b' = both)")
+    parser.add_argument("--allergens", nargs="+", default=DEFAULT_ALLERGENS, help="Allergen filter combinations ('' = none, 'a,b' = both)")
+    parser.add_argument("--calorie-caps", nargs="+", type=float, default=[], help="Calorie caps to cover in addition to no cap")
+    args = parser.parse_args()
+
+    cells = enumerate_cells(
+        args.age_groups, args.activities, args.weights, args.durations,
+        _filter_options(args.dietary), _filter_options(args.allergens),
+        [None] + args.calorie_caps
+    )
+    print(f"Building bundle library for {len(cells)} profile cells with {args.workers} workers...")
+
+    previous = None if args.full else BundleLibrary.load(args.output)
+
+    db = SessionLocal()
+    try:
+        catalog = get_catalog_generation()
+        snapshot = catalog.snapshot(db)
+        service = MacroTargetingServiceLocal()
+
+        started = time.perf_counter()
+        library, stats = build_bundle_library(
+            catalog, snapshot, service, cells, workers=args.workers, previous=previous
+        )
+        library.save(args.output)
+
+        print(f"Computed {stats['computed']} cells, reused {stats['reused']}, "
+              f"{stats['empty']} without a valid bundle ({time.perf_counter() - started:.1f}s)")
+        print(f"Bundle library for catalog generation {catalog.generation} written to {args.output}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,71 @@
 #!/usr/bin/env python3
+"""
+Import products from a feed into the database, then update the product index.
+
+Feeds are streamed (see app/db/product_import.py):
+- the template format of products_input_template.txt
+- CSV with a header row of product column names (.csv)
+- JSON Lines, one product object per line (.jsonl / .ndjson)
+
+Products are upserted by name in chunks: new names are inserted, existing
+ones updated (--skip-existing leaves them untouched). Invalid products are
+reported and skipped. When anything changed, an incremental catalog
+generation is built and published, re-embedding only new or edited
+products; running workers swap it in through the catalog watcher.
+
+Usage:
+    python import_products.py products_input.txt [--format csv] [--chunk-size 1000] [--skip-existing] [--no-index]
+"""
 
 import sys
+import os
+import argparse
+import time
 from pathlib import Path
-import re
-from app.db.session import SessionLocal
-from app.db.models import Product
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-# Field order as per JSON schema
-FIELD_ORDER = [
-    "name", "brand", "description", "serving_size", "calories", "protein", "carbs", "fat", "fiber", "sugar", "electrolytes_mg", "flavor", "texture", "form", "price_usd", "categories", "dietary_flags", "timing_suitability", "tags", "allergens", "diet", "link", "image_url", "source", "verified"
-]
+from app.db.session import SessionLocal
+from app.db.product_import import IMPORT_CHUNK_SIZE, ImportStats, detect_format, import_products, read_products
 
-LIST_FIELDS = {"categories", "dietary_flags", "timing_suitability", "tags", "allergens", "diet"}
-FLOAT_FIELDS = {"calories", "protein", "carbs", "fat", "fiber", "sugar", "electrolytes_mg", "price_usd"}
-BOOL_FIELDS = {"verified"}
+def main():
+    parser = argparse.ArgumentParser(description="Import products into the database")
+    parser.add_argument("input", help="Product feed (template, .csv or .jsonl)")
+    parser.add_argument("--format", choices=["template", "csv", "jsonl"], help="Feed format (default: from the extension)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="Products per upsert statement and commit")
+    parser.add_argument("--skip-existing", action="store_true", help="Leave products whose name already exists untouched")
+    parser.add_argument("--no-index", action="store_true", help="Do not update the product index after importing")
+    args = parser.parse_args()
 
-def parse_product(lines):
-    product = {}
-    for i, field in enumerate(FIELD_ORDER):
-        if i >= len(lines):
-            value = "N"
-        else:
-            value = lines[i].strip()
-        if value == "N":
-            if field in FLOAT_FIELDS:
-                product[field] = 0.0
-            elif field in BOOL_FIELDS:
-                product[field] = False
-            else:
-                product[field] = None
-        elif field in LIST_FIELDS:
-            product[field] = [v.strip() for v in value.split(",") if v.strip()] if value else []
-        elif field in FLOAT_FIELDS:
-            try:
-                product[field] = float(value)
-            except ValueError:
-                product[field] = 0.0
-        elif field in BOOL_FIELDS:
-            product[field] = value.lower() == "t"
-        else:
-            product[field] = value
-    return product
+    input_path = Path(args.input)
+    feed_format = args.format or detect_format(input_path)
+    stats = ImportStats()
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python add_products_to_db.py products_input.txt")
-        sys.exit(1)
-    
-    input_path = sys.argv[1]
-    with open(input_path, "r") as f:
-        content = f.read()
-    
-    # Split products by "PRODUCT <number>" markers
-    product_blocks = re.split(r"# PRODUCT \d+", content)
-    
-    # Filter out empty blocks and the first block (before any PRODUCT marker)
-    raw_products = []
-    for block in product_blocks[1:]:  # Skip the first block (before any PRODUCT marker)
-        if block.strip():
-            # Filter out comment lines (lines starting with #) and empty lines
-            lines = [line.strip() for line in block.splitlines() 
-                    if line.strip() and not line.strip().startswith('#')]
-            if lines:  # Only add if there are non-comment, non-empty lines
-                raw_products.append(lines)
-    
-    products = []
-    for lines in raw_products:
-        product = parse_product(lines)
-        products.append(product)
-    
-    # Add products to database
     db = SessionLocal()
     try:
-        added_count = 0
-        for product_data in products:
-            # Check if product already exists
-            existing = db.query(Product).filter(Product.name == product_data['name']).first()
-            if existing:
-                print(f"Product '{product_data['name']}' already exists, skipping...")
-                continue
-            
-            # Create new product
-            product = Product(**product_data)
-            db.add(product)
-            added_count += 1
-            print(f"Added: {product_data['name']}")
-        
-        db.commit()
-        print(f"\nSuccessfully added {added_count} new products to the database.")
-        
+        start = time.perf_counter()
+        with open(input_path, "r", newline="") as f:
+            import_products(db, read_products(f, feed_format, stats), chunk_size=args.chunk_size,
+                            skip_existing=args.skip_existing, stats=stats)
+        elapsed = time.perf_counter() - start
+
+        for error in stats.errors:
+            print(f"Skipped invalid product ({error})")
+        print(f"\nRead {stats.read} products in {elapsed:.1f}s ({stats.read / max(elapsed, 1e-9) * 60:.0f}/min): "
+              f"{stats.inserted} added, {stats.updated} updated, {stats.skipped} skipped, {stats.invalid} invalid.")
+
+        if stats.changed and not args.no_index:
+            # Imported here: the index build loads the embedding model and Chroma
+            from app.db.catalog_index import build_generation, publish_generation
+            print("Updating the product index (new or edited products only)...")
+            publish_generation(build_generation(db, incremental=True))
+            print("Product index updated; rerun build_bundle_library.py to refresh the bundle library.")
+
     except Exception as e:
-        print(f"Error adding products: {e}")
+        print(f"Error importing products: {e}")
         db.rollback()
         raise
     finally:
         db.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Script to convert stored product embeddings from JSON text to float32 BLOBs.
+
+Product.embedding used to be a JSON column holding the vector as a list of
+floats (~8 KB of text per product). It is now an EmbeddingVector column
+(see app/db/types.py) that stores packed float32 bytes. Old rows are still
+readable, but this rewrites them once so nothing parses JSON again.
+
+Usage:
+    python migrate_embeddings_to_binary.py [--batch-size 500] [--dry-run]
+"""
+
+import sys
+import os
+import json
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from sqlalchemy import text
+
+from app.db.session import engine
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON product embeddings to float32 BLOBs")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows converted per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many rows would change")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        pending = conn.execute(text(
+            "SELECT COUNT(*) FROM products WHERE embedding IS NOT NULL AND typeof(embedding) = 'text'"
+        )).scalar()
+    print(f"{pending} products still store embeddings as JSON")
+    if args.dry_run or not pending:
+        return
+
+    converted = 0
+    bytes_before = bytes_after = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, embedding FROM products "
+                "WHERE embedding IS NOT NULL AND typeof(embedding) = 'text' "
+                "ORDER BY id LIMIT :limit"
+            ), {"limit": args.batch_size}).fetchall()
+            if not rows:
+                break
+            updates = []
+            for product_id, raw in rows:
+                blob = np.asarray(json.loads(raw), dtype="<f4").tobytes()
+                bytes_before += len(raw)
+                bytes_after += len(blob)
+                updates.append({"id": product_id, "embedding": blob})
+            conn.execute(text("UPDATE products SET embedding = :embedding WHERE id = :id"), updates)
+        converted += len(rows)
+        print(f"Converted {converted}/{pending} products")
+
+    print(f"Converted {converted} embeddings ({bytes_before / 1024:.0f} KB -> {bytes_after / 1024:.0f} KB)")
+    print("Run VACUUM on the database to reclaim the freed pages.")
+
+if __name__ == "__main__":
+    main()
@@ -2,36 +2,50 @@
 """
 Script to rebuild the product vector store from the database.
 
-This script will:
-1. Load all products from the database
-2. Generate embeddings for each product
-3. Store them in the Chroma vector store
-4. Update the database with embedding information
+This script builds a new catalog generation (see app/db/catalog_index.py):
+1. Copy the live generation's vectors into a side directory (unless --full)
+2. Stream products from the database in chunks
+3. Skip products whose embedding text is unchanged (unless --full)
+4. Generate embeddings for new or edited products in batches
+5. Bulk-upsert them into the Chroma vector store
+6. Write the nutrient matrix and hard-filter indexes, then validate
+7. Atomically publish the generation; running workers swap it in
 
 Usage:
-    python rebuild_product_vectorstore.py
+    python rebuild_product_vectorstore.py [--full] [--chunk-size 256] [--batch-size 64]
 """
 
 import sys
 import os
+import argparse
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app.db.session import SessionLocal
-from app.db.vector_store import get_product_vector_store
-from app.db.models import Product
+from app.db.catalog_index import build_generation, publish_generation
 
 def main():
+    parser = argparse.ArgumentParser(description="Rebuild the product vector store")
+    parser.add_argument("--full", action="store_true", help="Drop the index and re-embed every product")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Products loaded and committed per chunk")
+    parser.add_argument("--batch-size", type=int, default=64, help="Encoder batch size")
+    args = parser.parse_args()
+
     print("Starting product vector store rebuild...")
     
     # Get database session
     db = SessionLocal()
     
     try:
-        # Get vector store
-        vector_store = get_product_vector_store()
+        # Build and validate the new generation next to the live one
+        path = build_generation(
+            db,
+            incremental=not args.full,
+            chunk_size=args.chunk_size,
+            batch_size=args.batch_size
+        )
         
-        # Rebuild from database
-        vector_store.rebuild_from_database(db)
+        # Flip the CURRENT pointer; workers pick it up via the catalog watcher
+        publish_generation(path)
         
         print("Product vector store rebuild completed successfully!")
         
@@ -0,0 +1,67 @@
+from fastapi import APIRouter, BackgroundTasks, Header, HTTPException
+from typing import Optional
+from datetime import datetime, timezone
+import hmac
+import os
+import threading
+
+from app.db.catalog_index import get_catalog_generation, refresh_catalog
+from app.db.session import SessionLocal
+
+router = APIRouter()
+
+_refresh_lock = threading.Lock()
+_refresh_status = {"state": "idle", "started_at": None, "finished_at": None, "generation": None, "error": None}
+
+def _require_admin(token: Optional[str]):
+    """Admin endpoints are disabled unless ADMIN_TOKEN is set, and require it as X-Admin-Token."""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    # Constant-time comparison, so response timing does not reveal the token
+    if token is None or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def _run_refresh(incremental: bool):
+    db = SessionLocal()
+    try:
+        generation = refresh_catalog(db, incremental=incremental)
+        _refresh_status.update(state="idle", generation=generation.generation, error=None)
+    except Exception as e:
+        db.rollback()
+        _refresh_status.update(state="failed", error=str(e))
+        print(f"Catalog refresh failed: {e}")
+    finally:
+        db.close()
+        _refresh_status["finished_at"] = datetime.now(timezone.utc).isoformat()
+        _refresh_lock.release()
+
+@router.post("/catalog/refresh", status_code=202)
+async def refresh_catalog_index(
+    background_tasks: BackgroundTasks,
+    full: bool = False,
+    x_admin_token: Optional[str] = Header(default=None)
+):
+    """
+    Build a new catalog generation in the background and swap it in.
+
+    The live generation keeps serving requests until the new one is validated,
+    published and warmed. Other workers pick it up through the catalog watcher.
+    """
+    _require_admin(x_admin_token)
+    if not _refresh_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A catalog refresh is already running")
+    _refresh_status.update(state="building", started_at=datetime.now(timezone.utc).isoformat(), finished_at=None, error=None)
+    background_tasks.add_task(_run_refresh, not full)
+    return _refresh_status
+
+@router.get("/catalog")
+async def catalog_status(x_admin_token: Optional[str] = Header(default=None)):
+    """Report the live catalog generation and the state of the last refresh."""
+    _require_admin(x_admin_token)
+    generation = get_catalog_generation()
+    return {
+        "generation": generation.generation,
+        "product_count": generation.product_count,
+        "refresh": _refresh_status
+    }
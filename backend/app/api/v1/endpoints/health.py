@@ -1,7 +1,35 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.core import metrics
+from app.core.admission import get_admission_stats
+from app.core.layer2_parallel import get_layer2_pool_stats
+from app.core.result_cache import get_recommendation_cache
+from app.core.singleflight import get_single_flight_stats
+from app.core.startup import get_startup
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def readiness_check():
+    """200 once models and indexes are loaded and warmed up, 503 before; with the startup report."""
+    startup = get_startup()
+    status = "ready" if startup.ready else "failed" if startup.report.failed else "starting"
+    return JSONResponse({"status": status, "startup": startup.report.as_dict()},
+                        status_code=200 if startup.ready else 503)
+
+@router.get("/metrics")
+async def get_metrics():
+    """Per-process counters: request coalescing, result cache, Layer 2 pool and admission control."""
+    cache = get_recommendation_cache()
+    return {
+        "single_flight": get_single_flight_stats(),
+        "result_cache": vars(cache.stats) | {"entries": len(cache)} if cache is not None else None,
+        "layer2_pool": get_layer2_pool_stats(),
+        "admission": get_admission_stats(),
+        "counters": metrics.get_counters()
+    }
@@ -1,12 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from pydantic import BaseModel
 
 from app.schemas.macro_target import MacroTargetRequest, MacroTargetResponse, MacroTargetWithUserInput
-from app.core.macro_targeting_local import MacroTargetingServiceLocal
 from app.db.models import UserInput, MacroTarget
-from app.db.session import get_db
+from app.db.async_session import get_async_db, get_async_read_db, get_async_sessionmaker, save_rows_async
+from app.core.nlp import normalize_text
+from app.core.singleflight import get_single_flight
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter()
 
@@ -16,6 +19,8 @@ class NaturalLanguageRequest(BaseModel):
 
 def get_macro_targeting_service():
     """Dependency to get macro targeting service"""
+    # Imported here: langchain and chromadb load when these endpoints first run, not with app.main
+    from app.core.macro_targeting_local import MacroTargetingServiceLocal
     openai_api_key = os.getenv("OPENAI_API_KEY")
     return MacroTargetingServiceLocal(
         rag_store_path="./data/rag_store", 
@@ -25,8 +30,7 @@ def get_macro_targeting_service():
 @router.post("/natural", response_model=MacroTargetWithUserInput)
 async def get_macro_targets_from_natural_language(
     request: NaturalLanguageRequest,
-    db: Session = Depends(get_db),
-    service: MacroTargetingServiceLocal = Depends(get_macro_targeting_service)
+    service = Depends(get_macro_targeting_service)
 ):
     """
     Get macro targets from natural language query using LLM field extraction.
@@ -39,50 +43,59 @@ async def get_macro_targets_from_natural_language(
     to be gluten-free. Keep it under 400 calories"
     """
     try:
-        # Use the enhanced service to extract fields and generate macro targets
-        user_input, macro_target = service.generate_macro_targets_from_query(request.user_query, db)
-        
-        # Convert to response models
-        user_input_response = MacroTargetRequest(
-            user_query=user_input.user_query,
-            age=user_input.age,
-            weight_kg=user_input.weight_kg,
-            sex=user_input.sex,
-            exercise_type=user_input.exercise_type,
-            exercise_duration_minutes=user_input.exercise_duration_minutes,
-            exercise_intensity=user_input.exercise_intensity,
-            timing=user_input.timing
-        )
-        
-        macro_target_response = MacroTargetResponse(
-            target_calories=macro_target.target_calories,
-            target_protein=macro_target.target_protein,
-            target_carbs=macro_target.target_carbs,
-            target_fat=macro_target.target_fat,
-            target_electrolytes=macro_target.target_electrolytes,
-            pre_workout_macros=macro_target.pre_workout_macros,
-            during_workout_macros=macro_target.during_workout_macros,
-            post_workout_macros=macro_target.post_workout_macros,
-            reasoning=macro_target.reasoning,
-            rag_context=macro_target.rag_context,
-            confidence_score=macro_target.confidence_score,
-            created_at=macro_target.created_at
-        )
-        
-        return MacroTargetWithUserInput(
-            user_input=user_input_response,
-            macro_targets=macro_target_response
+        # Identical queries in flight at the same time share one extraction + RAG run
+        return await get_single_flight("macro-targets-natural").do(
+            normalize_text(request.user_query),
+            lambda: _macro_targets_from_natural_language(request.user_query, service)
         )
         
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error generating macro targets from natural language: {str(e)}")
 
+async def _macro_targets_from_natural_language(user_query: str, service) -> MacroTargetWithUserInput:
+    # Use the enhanced service to extract fields and generate macro targets (off the event loop)
+    user_input, macro_target = await run_in_threadpool(service.generate_macro_targets_from_query, user_query, None)
+    # Own session: the shared computation outlives the request that started it
+    async with get_async_sessionmaker()() as db:
+        await save_rows_async(db, user_input, macro_target)
+    
+    # Convert to response models
+    user_input_response = MacroTargetRequest(
+        user_query=user_input.user_query,
+        age=user_input.age,
+        weight_kg=user_input.weight_kg,
+        sex=user_input.sex,
+        exercise_type=user_input.exercise_type,
+        exercise_duration_minutes=user_input.exercise_duration_minutes,
+        exercise_intensity=user_input.exercise_intensity,
+        timing=user_input.timing
+    )
+    
+    macro_target_response = MacroTargetResponse(
+        target_calories=macro_target.target_calories,
+        target_protein=macro_target.target_protein,
+        target_carbs=macro_target.target_carbs,
+        target_fat=macro_target.target_fat,
+        target_electrolytes=macro_target.target_electrolytes,
+        pre_workout_macros=macro_target.pre_workout_macros,
+        during_workout_macros=macro_target.during_workout_macros,
+        post_workout_macros=macro_target.post_workout_macros,
+        reasoning=macro_target.reasoning,
+        rag_context=macro_target.rag_context,
+        confidence_score=macro_target.confidence_score,
+        created_at=macro_target.created_at
+    )
+    
+    return MacroTargetWithUserInput(
+        user_input=user_input_response,
+        macro_targets=macro_target_response
+    )
+
 @router.post("/", response_model=MacroTargetResponse)
 async def get_macro_targets(
     request: MacroTargetRequest,
-    db: Session = Depends(get_db),
-    service: MacroTargetingServiceLocal = Depends(get_macro_targeting_service)
+    db: AsyncSession = Depends(get_async_db),
+    service = Depends(get_macro_targeting_service)
 ):
     """
     Get macro targets based on user input using RAG pipeline.
@@ -103,12 +116,12 @@ async def get_macro_targets(
             exercise_intensity=request.exercise_intensity,
             timing=request.timing
         )
-        db.add(user_input)
-        db.commit()
-        db.refresh(user_input)
         
-        # Generate macro targets
-        macro_target = service.create_or_update_macro_targets(user_input, db)
+        # Generate macro targets off the event loop, then save both in one transaction
+        # (a new user input has no earlier targets to update)
+        macro_target = await run_in_threadpool(service.generate_macro_targets, user_input)
+        macro_target.user_input = user_input
+        await save_rows_async(db, user_input, macro_target)
         
         # Convert to response model
         response = MacroTargetResponse(
@@ -129,18 +142,19 @@ async def get_macro_targets(
         return response
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error generating macro targets: {str(e)}")
 
 @router.get("/history/{user_input_id}", response_model=MacroTargetResponse)
 async def get_macro_target_history(
     user_input_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Get macro targets for a specific user input from history.
     """
-    macro_target = db.query(MacroTarget).filter(MacroTarget.user_input_id == user_input_id).first()
+    result = await db.execute(select(MacroTarget).filter(MacroTarget.user_input_id == user_input_id).limit(1))
+    macro_target = result.scalars().first()
     
     if not macro_target:
         raise HTTPException(status_code=404, detail="Macro targets not found")
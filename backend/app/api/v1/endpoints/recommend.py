@@ -1,13 +1,14 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from app.schemas.recommendation import RecommendationRequest, RecommendationResponse, EnhancedRecommendationResponse
-from app.core.recommendation import get_recommendations
-from app.db.session import get_db
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.schemas.recommendation import RecommendationRequest, RecommendationResponse, EnhancedRecommendationResponse, BundleSwapRequest, BundleSwapResponse
+from app.core.deadline import RECOMMEND_DEADLINE_SECONDS, Deadline
+from app.core.recommendation import get_recommendations, swap_bundle_products
+from app.db.async_session import get_async_db
 
 router = APIRouter()
 
 @router.post("/", response_model=EnhancedRecommendationResponse)
-async def recommend(request: RecommendationRequest, db: Session = Depends(get_db)):
+async def recommend(request: RecommendationRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Get snack recommendations based on user context and preferences.
 
@@ -17,6 +18,36 @@ async def recommend(request: RecommendationRequest, db: Session = Depends(get_db
     3. Simulates vector search for relevant products.
     4. Applies hard filters for strict constraints (dietary, ingredients).
     
+    Set num_alternatives to also receive alternative bundles from the same
+    optimization; max_alternative_overlap bounds the share of snacks any two
+    bundles have in common.
+
+    Each request has RECOMMEND_DEADLINE_SECONDS, counted from its arrival;
+    stages that would run past it take a cheaper path, which the reasoning
+    mentions. While the server is saturated, admission control (see
+    app.core.admission) answers with the degraded path or 503.
+    """
+    waited = getattr(http_request.state, "admission_wait_seconds", 0.0)
+    deadline = Deadline.after(RECOMMEND_DEADLINE_SECONDS - waited)
+    degraded = getattr(http_request.state, "admission_degraded", False)
+    recommendations = await get_recommendations(request, db, deadline, degraded=degraded)
+    return recommendations 
+
+@router.post("/swap", response_model=BundleSwapResponse)
+async def swap(request: BundleSwapRequest):
+    """
+    Replace snacks of a recommended bundle without re-running the whole pipeline.
+
+    Uses the bundle_session_token of a /recommend response: excluded products
+    are replaced by re-optimizing the bundle around the pinned ones, using the
+    candidates and macro targets of the original request.
     """
-    recommendations = await get_recommendations(request, db)
-    return recommendations 
\ No newline at end of file
+    try:
+        response = await swap_bundle_products(request)
+    except KeyError as e:
+        raise HTTPException(status_code=422, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if response is None:
+        raise HTTPException(status_code=404, detail="Bundle session expired; request a new recommendation")
+    return response
@@ -1,4 +1,4 @@
-from app.api.v1.endpoints import recommend, macro_target, health
+from app.api.v1.endpoints import recommend, macro_target, health, admin
 
 from fastapi import APIRouter
 
@@ -6,4 +6,5 @@ api_router = APIRouter()
 
 api_router.include_router(health.router, tags=["health"])
 api_router.include_router(recommend.router, prefix="/recommend", tags=["recommendations"])
-api_router.include_router(macro_target.router, prefix="/macro-targets", tags=["macro-targets"]) 
\ No newline at end of file
+api_router.include_router(macro_target.router, prefix="/macro-targets", tags=["macro-targets"])
+api_router.include_router(admin.router, prefix="/admin", tags=["admin"])
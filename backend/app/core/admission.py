@@ -0,0 +1,199 @@
+"""
+Admission control for the CPU-heavy recommendation endpoint.
+
+A worker process runs at most ADMISSION_MAX_IN_FLIGHT full pipeline runs at a
+time. Further requests wait in a queue of at most ADMISSION_MAX_QUEUE for up to
+ADMISSION_QUEUE_TIMEOUT_SECONDS. A request that finds the queue full, or waits
+too long, is overloaded and, depending on ADMISSION_OVERLOAD:
+
+- "degrade": served by the cheap path of get_recommendations() (cached or
+  precomputed bundles, else rule-based extraction and a greedy bundle), at most
+  ADMISSION_MAX_DEGRADED at a time
+- "reject" (or degraded path full): answered with 503 and Retry-After
+
+Only POST requests to ADMISSION_PATHS are admitted; everything else passes
+through. The middleware records the decision in the request state
+("admission_degraded", "admission_wait_seconds") for the endpoint.
+Counted in app.core.metrics as admission.admitted / queued / degraded / rejected.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from dotenv import load_dotenv
+from starlette.responses import JSONResponse
+
+from app.core import metrics
+
+load_dotenv()
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(os.cpu_count() or 1)))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+ADMISSION_OVERLOAD = os.getenv("ADMISSION_OVERLOAD", "degrade").lower()  # degrade | reject
+ADMISSION_MAX_DEGRADED = int(os.getenv("ADMISSION_MAX_DEGRADED", "32"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "5"))
+ADMISSION_PATHS = [p.strip().rstrip("/") for p in os.getenv("ADMISSION_PATHS", "/api/v1/recommend/").split(",") if p.strip()]
+
+# Admission decisions
+ADMITTED = "admitted"
+DEGRADED = "degraded"
+REJECTED = "rejected"
+
+
+class AdmissionController:
+    """Bounded slots for full pipeline runs with a bounded FIFO wait queue."""
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float,
+                 overload: str = "degrade", max_degraded: int = 0):
+        """
+        Args:
+            max_in_flight: Full pipeline runs at a time
+            max_queue: Requests that may wait for a slot
+            queue_timeout: Seconds a request waits for a slot before it is overloaded
+            overload: "degrade" or "reject" for overloaded requests
+            max_degraded: Degraded requests at a time (beyond that they are rejected)
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.overload = overload
+        self.max_degraded = max_degraded
+        self.in_flight = 0
+        self.degraded_in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> str:
+        """
+        Admit a request: ADMITTED (holds a slot), DEGRADED (holds a degraded
+        slot) or REJECTED. Release what was granted with release(decision).
+        """
+        if await self._acquire_slot():
+            metrics.increment("admission.admitted")
+            return ADMITTED
+        if self.overload == "degrade" and self.degraded_in_flight < self.max_degraded:
+            self.degraded_in_flight += 1
+            metrics.increment("admission.degraded")
+            return DEGRADED
+        metrics.increment("admission.rejected")
+        return REJECTED
+
+    def release(self, decision: str):
+        if decision == DEGRADED:
+            self.degraded_in_flight -= 1
+        elif decision == ADMITTED:
+            # Hand the slot to the longest waiting request, if any
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+            self.in_flight -= 1
+
+    async def _acquire_slot(self) -> bool:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.increment("admission.queued")
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._abandon(waiter)
+        except BaseException:
+            if self._abandon(waiter):
+                self.release(ADMITTED)  # cancelled just as the slot was handed over
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> bool:
+        """Leave the queue; True if the slot was handed over meanwhile."""
+        if waiter.done() and not waiter.cancelled():
+            return True
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        return False
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "degraded_in_flight": self.degraded_in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "overload": self.overload,
+            "max_degraded": self.max_degraded,
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware running admitted paths through an AdmissionController."""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None, paths=None,
+                 retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        self.app = app
+        self.controller = controller or get_admission_controller()
+        self.paths = [p.rstrip("/") for p in (ADMISSION_PATHS if paths is None else paths)]
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"].rstrip("/") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.time()
+        decision = await self.controller.acquire()
+        if decision == REJECTED:
+            response = JSONResponse(
+                {"detail": "Server is busy; retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+        state["admission_degraded"] = decision == DEGRADED
+        state["admission_wait_seconds"] = time.time() - arrived
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(decision)
+
+
+# Global instance
+_controller = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Get or create the process-wide admission controller."""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            ADMISSION_MAX_IN_FLIGHT,
+            ADMISSION_MAX_QUEUE,
+            ADMISSION_QUEUE_TIMEOUT_SECONDS,
+            overload=ADMISSION_OVERLOAD,
+            max_degraded=ADMISSION_MAX_DEGRADED
+        )
+    return _controller
+
+
+def get_admission_stats() -> Optional[Dict[str, object]]:
+    """Current load and limits, for GET /metrics (None when admission control is off)."""
+    return get_admission_controller().stats() if ADMISSION_CONTROL else None
@@ -0,0 +1,446 @@
+"""
+Precomputed bundle library for common profiles.
+
+Most /recommend traffic falls into a small number of profiles: an age group,
+cardio or strength, a body weight and exercise duration in a typical range and
+a handful of dietary/allergen filters. For those requests the Layer 2 search
+does not depend on the query text, so the near-optimal bundles can be computed
+offline (adding_products/build_bundle_library.py) and served without running
+vector search or the optimizer.
+
+A profile cell is keyed by:
+
+- age group and activity, as the macro targeting service classifies them
+- weight_kg rounded to BUNDLE_LIBRARY_WEIGHT_STEP_KG (default 5 kg)
+- exercise_duration_minutes rounded to BUNDLE_LIBRARY_DURATION_STEP_MIN (default 15)
+- the sorted dietary requirements and allergen restrictions
+- the calorie cap, floored to BUNDLE_LIBRARY_CALORIE_STEP (so a bundle never exceeds it)
+
+The library file records the fingerprint of the catalog generation it was built
+from and is ignored when it does not match the live one. Stored bundles are
+re-scored against the request's exact macro targets and filtered by the
+optimizer's score threshold before one is picked, so rounding the profile does
+not change which bundles qualify.
+Set BUNDLE_LIBRARY_ENABLED=false to disable lookups.
+"""
+
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from app.core import metrics
+from app.core.layer2_macro_optimization import (
+    PIPELINE_OPTIMIZER_SETTINGS, CombinationResult, MacroOptimizer, MacroTargets, optimize_macro_combination,
+    pick_from_candidates
+)
+from app.core.result_cache import quantize
+from app.db.models import UserInput
+
+load_dotenv()
+
+BUNDLE_LIBRARY_ENABLED = os.getenv("BUNDLE_LIBRARY_ENABLED", "true").lower() == "true"
+BUNDLE_LIBRARY_PATH = Path(os.getenv("BUNDLE_LIBRARY_PATH", "./data/bundle_library.json.gz"))
+BUNDLE_LIBRARY_WEIGHT_STEP_KG = float(os.getenv("BUNDLE_LIBRARY_WEIGHT_STEP_KG", "5"))
+BUNDLE_LIBRARY_DURATION_STEP_MIN = float(os.getenv("BUNDLE_LIBRARY_DURATION_STEP_MIN", "15"))
+BUNDLE_LIBRARY_CALORIE_STEP = float(os.getenv("BUNDLE_LIBRARY_CALORIE_STEP", "50"))
+
+LIBRARY_FORMAT_VERSION = 1
+
+# Defaults the macro targeting service applies when a field is missing
+DEFAULT_AGE = 21
+DEFAULT_WEIGHT_KG = 70.0
+DEFAULT_EXERCISE_TYPE = "cardio"
+DEFAULT_DURATION_MINUTES = 60
+
+# Age used to generate macro targets for each age group offline
+REPRESENTATIVE_AGES = {"6-11": 9, "12-18": 15, "19-59": 30}
+
+LIBRARY_ACTIVITIES = ("cardio", "strength")
+
+
+@dataclass(frozen=True)
+class ProfileCell:
+    """One precomputed profile of the bundle library."""
+    age_group: str
+    activity: str
+    weight_kg: float
+    duration_minutes: float
+    dietary_requirements: Tuple[str, ...] = ()
+    allergen_restrictions: Tuple[str, ...] = ()
+    calorie_cap: Optional[float] = None
+
+    @property
+    def key(self) -> str:
+        cap = "-" if self.calorie_cap is None else f"{self.calorie_cap:g}"
+        return "|".join([
+            self.age_group,
+            self.activity,
+            f"{self.weight_kg:g}",
+            f"{self.duration_minutes:g}",
+            ",".join(self.dietary_requirements),
+            ",".join(self.allergen_restrictions),
+            cap,
+        ])
+
+
+def _filter_tuple(values: Optional[Sequence[str]]) -> Tuple[str, ...]:
+    return tuple(sorted({v.strip().lower() for v in values or [] if v and v.strip()}))
+
+
+def floor_calorie_cap(calorie_cap: Optional[float], step: float = BUNDLE_LIBRARY_CALORIE_STEP) -> Optional[float]:
+    """Round a calorie cap down to a multiple of step (None stays None)."""
+    if calorie_cap is None or step <= 0:
+        return calorie_cap
+    return math.floor(calorie_cap / step) * step
+
+
+def profile_cell(service, user_input, hard_filters: Optional[Dict[str, Any]] = None,
+                 calorie_cap: Optional[float] = None) -> Optional[ProfileCell]:
+    """
+    Map a request onto its library cell.
+
+    Args:
+        service: Macro targeting service (provides the age group/activity mapping)
+        user_input: UserInput (or any object with the same fields)
+        hard_filters: Hard filters of the request
+        calorie_cap: Calorie cap of the request, if any
+
+    Returns:
+        The ProfileCell, or None when the activity is not covered by the library
+    """
+    hard_filters = hard_filters or {}
+    activity = service._get_exercise_type(user_input.exercise_type or DEFAULT_EXERCISE_TYPE)
+    if activity not in LIBRARY_ACTIVITIES:
+        return None
+    return ProfileCell(
+        age_group=service._get_age_group_from_age(user_input.age or DEFAULT_AGE),
+        activity=activity,
+        weight_kg=quantize(user_input.weight_kg or DEFAULT_WEIGHT_KG, BUNDLE_LIBRARY_WEIGHT_STEP_KG),
+        duration_minutes=quantize(user_input.exercise_duration_minutes or DEFAULT_DURATION_MINUTES,
+                                  BUNDLE_LIBRARY_DURATION_STEP_MIN),
+        dietary_requirements=_filter_tuple(hard_filters.get("dietary_requirements")),
+        allergen_restrictions=_filter_tuple(hard_filters.get("allergen_restrictions")),
+        calorie_cap=floor_calorie_cap(calorie_cap),
+    )
+
+
+class BundleLibrary:
+    """Precomputed bundles per profile cell, as stored in BUNDLE_LIBRARY_PATH."""
+
+    def __init__(self, catalog_fingerprint: str, cells: Dict[str, Dict[str, Any]],
+                 generation: Optional[str] = None, settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            catalog_fingerprint: CatalogGeneration.fingerprint the bundles were built from
+            cells: {cell key: {'inputs_hash', 'macro_targets', 'bundles'}}
+            generation: Name of the catalog generation (informational)
+            settings: Optimizer settings the bundles were built with
+        """
+        self.catalog_fingerprint = catalog_fingerprint
+        self.cells = cells
+        self.generation = generation
+        self.settings = dict(settings or PIPELINE_OPTIMIZER_SETTINGS)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def get(self, cell: ProfileCell) -> Optional[Dict[str, Any]]:
+        return self.cells.get(cell.key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": LIBRARY_FORMAT_VERSION,
+            "generation": self.generation,
+            "catalog_fingerprint": self.catalog_fingerprint,
+            "settings": self.settings,
+            "cells": self.cells,
+        }
+
+    def save(self, path: Path = BUNDLE_LIBRARY_PATH):
+        """Write the library atomically (gzip-compressed JSON)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path = BUNDLE_LIBRARY_PATH) -> Optional["BundleLibrary"]:
+        """Read a library file (None if it is missing or has an unknown format)."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != LIBRARY_FORMAT_VERSION:
+            print(f"Ignoring bundle library {path}: unsupported version {data.get('version')}")
+            return None
+        return cls(data["catalog_fingerprint"], data.get("cells", {}),
+                   generation=data.get("generation"), settings=data.get("settings"))
+
+
+def cell_inputs_hash(cell: ProfileCell, targets: MacroTargets, products: Sequence, settings: Dict[str, Any]) -> str:
+    """Hash of everything a cell's bundles depend on (used to skip unchanged cells on rebuild)."""
+    payload = {
+        "cell": cell.key,
+        "targets": [round(targets.target_protein_g, 4), round(targets.target_carbs_g, 4),
+                    round(targets.target_fat_g, 4), round(targets.target_electrolytes_mg, 4)],
+        "products": [[p.id, p.protein, p.carbs, p.fat, p.electrolytes_mg, p.calories] for p in products],
+        "settings": settings,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _targets_from_macro_target(macro_target) -> MacroTargets:
+    return MacroTargets(
+        target_protein_g=macro_target.target_protein or 0.0,
+        target_carbs_g=macro_target.target_carbs or 0.0,
+        target_fat_g=macro_target.target_fat or 0.0,
+        target_electrolytes_mg=macro_target.target_electrolytes or 0.0,
+    )
+
+
+
+def enumerate_cells(age_groups: Sequence[str], activities: Sequence[str], weights_kg: Sequence[float],
+                    durations_minutes: Sequence[float], dietary_options: Sequence[Sequence[str]],
+                    allergen_options: Sequence[Sequence[str]],
+                    calorie_caps: Sequence[Optional[float]] = (None,)) -> List[ProfileCell]:
+    """All combinations of the given profile dimensions, snapped to the lookup buckets."""
+    cells = {}
+    for age_group in age_groups:
+        for activity in activities:
+            for weight in weights_kg:
+                for duration in durations_minutes:
+                    for dietary in dietary_options:
+                        for allergens in allergen_options:
+                            for cap in calorie_caps:
+                                cell = ProfileCell(
+                                    age_group=age_group,
+                                    activity=activity,
+                                    weight_kg=quantize(weight, BUNDLE_LIBRARY_WEIGHT_STEP_KG),
+                                    duration_minutes=quantize(duration, BUNDLE_LIBRARY_DURATION_STEP_MIN),
+                                    dietary_requirements=_filter_tuple(dietary),
+                                    allergen_restrictions=_filter_tuple(allergens),
+                                    calorie_cap=floor_calorie_cap(cap),
+                                )
+                                cells[cell.key] = cell
+    return list(cells.values())
+
+
+def representative_user_input(cell: ProfileCell):
+    """UserInput the macro targets of a cell are generated from."""
+    return UserInput(
+        user_query=f"{cell.duration_minutes:g} minutes of {cell.activity}",
+        age=REPRESENTATIVE_AGES.get(cell.age_group, DEFAULT_AGE),
+        weight_kg=cell.weight_kg,
+        exercise_type=cell.activity,
+        exercise_duration_minutes=int(cell.duration_minutes),
+    )
+
+
+# Product views of the worker process (set by _init_worker)
+_worker_products = {}
+
+
+def _init_worker(views):
+    global _worker_products
+    _worker_products = {view.id: view for view in views}
+
+
+def _optimize_cell(task) -> Tuple[str, List[Dict[str, Any]]]:
+    """Run Layer 2 for one cell in a worker process."""
+    key, product_ids, targets, calorie_cap, settings = task
+    products = [_worker_products[pid] for pid in product_ids]
+    # Cells already run in parallel; each search stays in its worker
+    result = optimize_macro_combination(products, MacroTargets(**targets), calorie_cap=calorie_cap,
+                                        parallelism=1, **settings)
+    if result is None or not result.products:
+        return key, []
+    candidates = result.top_candidates or [{
+        "combination": result.products,
+        "score": result.score,
+        "target_match": result.target_match_percentage,
+        "totals": {
+            "protein": result.total_protein,
+            "carbs": result.total_carbs,
+            "fat": result.total_fat,
+            "electrolytes": result.total_electrolytes,
+            "calories": result.total_calories,
+        },
+    }]
+    bundles = [{
+        "ids": [p.id for p in candidate["combination"]],
+        "score": round(candidate["score"], 6),
+        "target_match": round(candidate["target_match"], 3),
+        "totals": {macro: round(value, 3) for macro, value in candidate["totals"].items()},
+    } for candidate in candidates]
+    return key, bundles
+
+
+def build_bundle_library(catalog, snapshot, service, cells: Sequence[ProfileCell], workers: int = 1,
+                         previous: Optional[BundleLibrary] = None,
+                         settings: Optional[Dict[str, Any]] = None) -> Tuple[BundleLibrary, Dict[str, int]]:
+    """
+    Precompute bundles for every cell.
+
+    Macro targets are generated once per (age group, activity, weight, duration)
+    in this process; the Layer 2 searches run in a process pool whose workers
+    receive the product views once. Cells whose inputs hash matches the previous
+    library (same targets, candidate products and settings) are copied instead
+    of recomputed.
+
+    Args:
+        catalog: CatalogGeneration to build for
+        snapshot: CatalogSnapshot of that generation
+        service: Macro targeting service
+        cells: Profile cells to compute
+        workers: Worker processes (1 runs everything in this process)
+        previous: Library of an earlier run, reused for unchanged cells
+        settings: Optimizer settings (default: the pipeline's)
+
+    Returns:
+        (library, stats) where stats counts computed/reused/empty cells
+    """
+    settings = dict(settings or PIPELINE_OPTIMIZER_SETTINGS)
+    targets_by_profile: Dict[Tuple, MacroTargets] = {}
+    cells_out: Dict[str, Dict[str, Any]] = {}
+    tasks = []
+    stats = {"computed": 0, "reused": 0, "empty": 0}
+
+    for cell in cells:
+        profile = (cell.age_group, cell.activity, cell.weight_kg, cell.duration_minutes)
+        if profile not in targets_by_profile:
+            macro_target = service.generate_macro_targets(representative_user_input(cell))
+            targets_by_profile[profile] = _targets_from_macro_target(macro_target)
+        targets = targets_by_profile[profile]
+
+        product_ids = sorted(catalog.ids_matching(cell.dietary_requirements, cell.allergen_restrictions))
+        products = snapshot.get_many(product_ids)
+        inputs_hash = cell_inputs_hash(cell, targets, products, settings)
+        entry = {"inputs_hash": inputs_hash, "macro_targets": vars(targets).copy(), "bundles": []}
+        cells_out[cell.key] = entry
+
+        old = previous.cells.get(cell.key) if previous is not None else None
+        if old is not None and old.get("inputs_hash") == inputs_hash:
+            entry["bundles"] = old.get("bundles", [])
+            stats["reused"] += 1
+        else:
+            tasks.append((cell.key, [p.id for p in products], vars(targets).copy(), cell.calorie_cap, settings))
+
+    if tasks:
+        if workers <= 1:
+            _init_worker(snapshot.views)
+            results = map(_optimize_cell, tasks)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(snapshot.views,))
+            chunksize = max(1, len(tasks) // (workers * 4))
+            results = executor.map(_optimize_cell, tasks, chunksize=chunksize)
+        try:
+            for key, bundles in results:
+                cells_out[key]["bundles"] = bundles
+                stats["computed"] += 1
+                if not bundles:
+                    stats["empty"] += 1
+        finally:
+            if workers > 1:
+                executor.shutdown()
+
+    library = BundleLibrary(catalog.fingerprint, cells_out, generation=catalog.generation, settings=settings)
+    return library, stats
+
+# Global instance, reloaded when the file changes
+_library = None
+_library_mtime = None
+_library_lock = threading.Lock()
+
+
+def get_bundle_library(path: Optional[Path] = None) -> Optional[BundleLibrary]:
+    """Get the bundle library, re-reading the file when the offline job replaces it."""
+    global _library, _library_mtime
+    path = path or BUNDLE_LIBRARY_PATH
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if mtime != _library_mtime:
+        with _library_lock:
+            if mtime != _library_mtime:
+                try:
+                    _library = BundleLibrary.load(path)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Could not load bundle library {path}: {e}")
+                    _library = None
+                _library_mtime = mtime
+    return _library
+
+
+def lookup_precomputed_bundles(catalog, snapshot, service, user_input, hard_filters: Optional[Dict[str, Any]],
+                               calorie_cap: Optional[float], macro_target=None,
+                               rng: Optional[random.Random] = None) -> Optional[CombinationResult]:
+    """
+    Serve Layer 2 from the bundle library when the request's profile was precomputed.
+
+    Args:
+        catalog: Live CatalogGeneration of the request
+        snapshot: CatalogSnapshot of that generation
+        service: Macro targeting service
+        user_input: UserInput of the request
+        hard_filters: Hard filters of the request
+        calorie_cap: Calorie cap of the request, if any
+        macro_target: Exact macro targets of the request; stored bundles are re-scored against them
+        rng: Random generator of the request (None = the global one)
+
+    Returns:
+        A CombinationResult (algorithm_used='bundle_library'), or None to fall back to the full pipeline
+    """
+    if not BUNDLE_LIBRARY_ENABLED:
+        return None
+    library = get_bundle_library()
+    if library is None or library.catalog_fingerprint != catalog.fingerprint:
+        return None
+
+    cell = profile_cell(service, user_input, hard_filters, calorie_cap)
+    entry = library.get(cell) if cell is not None else None
+    if not entry or not entry.get("bundles"):
+        metrics.increment("bundle_library.misses")
+        return None
+
+    settings = library.settings
+    optimizer = MacroOptimizer(min_snacks=settings["min_snacks"], max_snacks=settings["max_snacks"])
+    targets = _targets_from_macro_target(macro_target) if macro_target is not None else MacroTargets(**entry["macro_targets"])
+
+    candidates = []
+    for bundle in entry["bundles"]:
+        products = snapshot.get_many(bundle["ids"])
+        if len(products) != len(bundle["ids"]):
+            continue
+        score, totals = optimizer.calculate_combination_score(products, targets)
+        if calorie_cap is not None and totals["calories"] > calorie_cap:
+            continue
+        candidates.append({
+            "combination": products,
+            "score": score,
+            "totals": totals,
+            "target_match": optimizer._calculate_target_match_percentage(totals, targets),
+        })
+    if not candidates:
+        metrics.increment("bundle_library.misses")
+        return None
+
+    metrics.increment("bundle_library.hits")
+    candidates.sort(key=lambda c: c["score"])
+    # Like the optimizer: pick among bundles within the threshold, else serve the best one
+    within = [c for c in candidates if c["score"] <= settings["score_threshold"]]
+    candidates = within or candidates[:1]
+    return pick_from_candidates(candidates, "bundle_library", rng)
@@ -0,0 +1,136 @@
+"""
+Bundle sessions: re-optimize a recommended bundle without the full pipeline.
+
+Every /recommend response that went through Layer 2 carries a
+bundle_session_token. The session keeps what the pipeline computed before
+Layer 2 (the candidate products with their nutrient values, the macro targets,
+the calorie cap and, for timing-aware requests, the targets of each workout
+timing slot), so POST /recommend/swap can replace rejected snacks by
+re-running only the Layer 2 search:
+
+- pinned products stay in the bundle and only the free slots are searched,
+  scored together with the pinned products
+- excluded products leave the candidate set for the rest of the session, so
+  repeated swaps never bring a rejected snack back
+- the n-th swap draws from a generator seeded with the response's seed and n,
+  so replaying the same swaps gives the same bundles (concurrent swaps on one
+  token take turns updating the session, so each gets its own n)
+
+Sessions live in process memory for BUNDLE_SESSION_TTL_SECONDS and are
+dropped when the catalog generation changes. Set BUNDLE_SESSIONS_ENABLED=false
+to stop issuing tokens.
+"""
+
+import os
+import random
+import secrets
+import threading
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from app.core import metrics
+from app.core.layer2_macro_optimization import CombinationResult, MacroTargets, optimize_macro_combination
+from app.core.result_cache import TTLCache
+from app.db.product_view import ProductView
+
+load_dotenv()
+
+BUNDLE_SESSIONS_ENABLED = os.getenv("BUNDLE_SESSIONS_ENABLED", "true").lower() == "true"
+BUNDLE_SESSION_TTL_SECONDS = float(os.getenv("BUNDLE_SESSION_TTL_SECONDS", "1800"))
+BUNDLE_SESSION_MAX_ENTRIES = int(os.getenv("BUNDLE_SESSION_MAX_ENTRIES", "4096"))
+
+
+@dataclass
+class BundleSession:
+    """Layer 2 inputs of one recommendation."""
+    generation: str
+    candidates: List[ProductView]
+    targets: MacroTargets
+    calorie_cap: Optional[float]
+    settings: Dict[str, Any]  # optimize_macro_combination() settings of the request
+    excluded: Set[int] = field(default_factory=set)
+    seed: Optional[int] = None  # Seed of the recommendation (None = unseeded swaps)
+    swaps: int = 0
+    # Guards excluded and swaps (swaps run in the threadpool); every session gets its own
+    lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def products_by_id(self) -> Dict[int, ProductView]:
+        return {p.id: p for p in self.candidates}
+
+
+def reoptimize_bundle(session: BundleSession,
+                      product_ids: Iterable[int],
+                      exclude_ids: Iterable[int] = (),
+                      pin_ids: Optional[Iterable[int]] = None) -> Optional[CombinationResult]:
+    """
+    Re-solve a bundle with some products excluded and others kept.
+
+    Args:
+        session: Session of the original recommendation (its exclusions are extended)
+        product_ids: Products of the bundle being changed
+        exclude_ids: Products to remove from the bundle and from later swaps
+        pin_ids: Products that must stay (default: every product of the bundle not excluded)
+
+    Returns:
+        The new bundle (pinned products first), or None when no bundle fits
+
+    Raises:
+        KeyError: If an id is not one of the session's candidates
+    """
+    by_id = session.products_by_id()
+    product_ids, exclude_ids = list(product_ids), set(exclude_ids)
+    pin_ids = [pid for pid in product_ids if pid not in exclude_ids] if pin_ids is None else list(pin_ids)
+    unknown = [pid for pid in [*product_ids, *exclude_ids, *pin_ids] if pid not in by_id]
+    if unknown:
+        raise KeyError(f"Products not in this bundle session: {sorted(set(unknown))}")
+
+    with session.lock:
+        session.excluded |= exclude_ids
+        pinned = [by_id[pid] for pid in dict.fromkeys(pin_ids) if pid not in session.excluded]
+        pinned_ids = {p.id for p in pinned}
+        candidates = [p for p in session.candidates if p.id not in session.excluded and p.id not in pinned_ids]
+        rng = random.Random(f"{session.seed}:{session.swaps}") if session.seed is not None else None
+        session.swaps += 1
+    metrics.increment("bundle_sessions.swaps")
+    return optimize_macro_combination(
+        products=candidates,
+        macro_targets=session.targets,
+        calorie_cap=session.calorie_cap,
+        pinned=pinned,
+        rng=rng,
+        **session.settings
+    )
+
+
+# Global instance
+_sessions = None
+
+
+def _get_sessions() -> Optional[TTLCache]:
+    global _sessions
+    if not BUNDLE_SESSIONS_ENABLED:
+        return None
+    if _sessions is None:
+        _sessions = TTLCache(max_entries=BUNDLE_SESSION_MAX_ENTRIES, ttl_seconds=BUNDLE_SESSION_TTL_SECONDS)
+    return _sessions
+
+
+def start_bundle_session(template: Optional[BundleSession], seed: Optional[int] = None) -> Optional[str]:
+    """Store a fresh copy of the session (no exclusions or swaps yet) and return its token."""
+    sessions = _get_sessions()
+    if sessions is None or template is None:
+        return None
+    token = secrets.token_urlsafe(16)
+    sessions.put(token, replace(template, excluded=set(), swaps=0, seed=template.seed if seed is None else seed))
+    return token
+
+
+def get_bundle_session(token: str, generation: str) -> Optional[BundleSession]:
+    """The session for a token, or None if it expired or belongs to an older catalog generation."""
+    sessions = _get_sessions()
+    session = sessions.get(token) if sessions is not None else None
+    if session is None or session.generation != generation:
+        return None
+    return session
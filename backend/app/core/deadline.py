@@ -0,0 +1,103 @@
+"""
+Per-request deadlines for the recommendation pipeline.
+
+POST /recommend gives every request RECOMMEND_DEADLINE_SECONDS. The Deadline is
+passed down to every stage, and a stage that cannot afford its normal path
+takes a cheaper one instead of running past it:
+
+- query extraction uses the rule-based extractor when less than
+  DEADLINE_LLM_SECONDS remain, or when the LLM does not answer in time
+- guideline retrieval skips the vector search fallback once the deadline has
+  passed (macro targets then use the rule-based defaults)
+- Layer 1 ranks with the catalog's precomputed embeddings instead of encoding
+  every candidate for the query when less than DEADLINE_EMBEDDING_SECONDS remain
+- the Layer 2 search stops at the deadline and returns the best bundle found
+  so far; it always gets DEADLINE_LAYER2_MIN_SECONDS so a late request still
+  gets a bundle
+
+Every degradation is recorded on the Deadline for the response reasoning and
+counted in the "deadline.degraded.<stage>" metric. The deadline is wall-clock
+time, so Layer 2 worker processes can check it too.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple, TypeVar
+
+from dotenv import load_dotenv
+
+from app.core import metrics
+
+load_dotenv()
+
+RECOMMEND_DEADLINE_SECONDS = float(os.getenv("RECOMMEND_DEADLINE_SECONDS", "20"))
+DEADLINE_LLM_SECONDS = float(os.getenv("DEADLINE_LLM_SECONDS", "4"))
+DEADLINE_EMBEDDING_SECONDS = float(os.getenv("DEADLINE_EMBEDDING_SECONDS", "2"))
+DEADLINE_LAYER2_MIN_SECONDS = float(os.getenv("DEADLINE_LAYER2_MIN_SECONDS", "0.05"))
+
+T = TypeVar("T")
+
+
+@dataclass
+class Deadline:
+    """Point in time (time.time()) by which a request should be answered."""
+    expires_at: float
+    degradations: List[Tuple[str, str]] = field(default_factory=list)  # (stage, what was done instead)
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(expires_at=time.time() + seconds)
+
+    def remaining(self) -> float:
+        """Seconds left (0 once expired)."""
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least `seconds` remain."""
+        return self.remaining() >= seconds
+
+    def stop_time(self, minimum: float = 0.0) -> float:
+        """When a stage that needs at least `minimum` seconds should stop."""
+        return max(self.expires_at, time.time() + minimum)
+
+    def degrade(self, stage: str, description: str):
+        """Record that a stage took its cheaper path (once per stage and description)."""
+        if (stage, description) in self.degradations:
+            return
+        self.degradations.append((stage, description))
+        metrics.increment(f"deadline.degraded.{stage}")
+        print(f"Deadline: {stage} degraded ({description})")
+
+    def reasoning(self) -> List[str]:
+        return [f"Time budget: {description}." for _, description in self.degradations]
+
+
+# Global instance
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="deadline")
+    return _executor
+
+
+def call_before(deadline: Deadline, fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Call fn, waiting for it at most until the deadline.
+
+    A call still running at the deadline is abandoned (it finishes in the
+    background) and TimeoutError is raised.
+    """
+    future = _get_executor().submit(fn, *args, **kwargs)
+    return future.result(timeout=deadline.remaining())
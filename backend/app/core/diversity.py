@@ -0,0 +1,79 @@
+"""
+Maximal Marginal Relevance (MMR) over product embeddings.
+
+Both ranking paths (Chroma vector search and the enhanced embedding ranking)
+reorder their candidates with mmr_rerank(), so mmr_lambda means the same thing
+everywhere:
+
+    score(i) = lambda * relevance(i) - (1 - lambda) * max_{j in selected} sim(i, j)
+
+relevance and sim are cosine similarities of L2-normalized embeddings. With
+lambda = 1.0 the order is plain relevance order; lower values trade relevance
+for diversity. The candidate similarity matrix is computed once and the
+max-similarity-to-selected vector is updated incrementally, so selecting k of
+n candidates costs one (n, d) x (d, n) product plus k vectorized O(n) steps.
+"""
+
+import os
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Lambda shared by the standard and enhanced ranking paths
+DEFAULT_MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row (zero rows are left as zeros)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_rerank(relevance: np.ndarray,
+               embeddings: np.ndarray,
+               lambda_param: float = DEFAULT_MMR_LAMBDA,
+               k: Optional[int] = None) -> List[int]:
+    """
+    Order candidates by Maximal Marginal Relevance.
+
+    Args:
+        relevance: Cosine similarity of each candidate to the query, shape (n,)
+        embeddings: L2-normalized candidate embeddings, shape (n, d)
+        lambda_param: 1.0 = pure relevance, 0.0 = pure diversity
+        k: Number of candidates to select (default: all of them)
+
+    Returns:
+        Candidate indices in selection order
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    k = n if k is None else min(k, n)
+    if k <= 0:
+        return []
+    if lambda_param >= 1.0 or n == 1:
+        return [int(i) for i in np.argsort(-relevance, kind="stable")[:k]]
+
+    similarity = embeddings @ embeddings.T
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected = []
+
+    # The first pick is the most relevant candidate (no redundancy term yet)
+    best = int(np.argmax(relevance))
+    for _ in range(k):
+        selected.append(best)
+        available[best] = False
+        if len(selected) == k:
+            break
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+        scores = lambda_param * relevance - (1.0 - lambda_param) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+    return selected
@@ -1,4 +1,5 @@
 from typing import List
+import hashlib
 from app.db.models import Product as ProductModel
 import numpy as np
 from app.core.global_embeddings import get_embedding_model
@@ -44,6 +45,10 @@ def generate_product_embedding_text(product: ProductModel) -> str:
         parts.append(product.description)
     return ", ".join(parts)
 
+def embedding_text_hash(embedding_text: str) -> str:
+    """Stable content hash of an embedding text, used to skip unchanged products on rebuild."""
+    return hashlib.sha256(embedding_text.encode("utf-8")).hexdigest()
+
 def generate_product_embedding(product: ProductModel) -> List[float]:
     """Use sentence-transformers to convert product data to a vector."""
     model = get_embedding_model()
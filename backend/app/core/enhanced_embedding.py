@@ -5,10 +5,25 @@ This module provides enhanced embedding functions that create a unified vector s
 for matching user queries (with soft preferences and macro targets) to product schemas.
 """
 
-from typing import List, Dict, Any, Optional
+import hashlib
+import os
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
 from app.db.models import Product as ProductModel
+from app.core.diversity import mmr_rerank, normalize_rows
 from app.core.global_embeddings import get_embedding_model
 from app.core.embedding import calculate_cosine_similarity
+from app.db.catalog_index import live_catalog_generation
+
+load_dotenv()
+
+# Normalized enhanced vectors of products the live catalog generation does not
+# store (see enhanced_product_vectors), by key of the embedding text
+ENHANCED_EMBEDDING_CACHE_SIZE = int(os.getenv("ENHANCED_EMBEDDING_CACHE_SIZE", "20000"))
+_product_vectors: Dict[str, np.ndarray] = {}
+_product_vectors_lock = threading.Lock()
 
 def generate_user_query_embedding_text(user_query: str, soft_preferences: dict = None, macro_targets: dict = None) -> str:
     """
@@ -122,6 +137,67 @@ def generate_enhanced_product_embedding(product: ProductModel) -> List[float]:
     embedding = model.encode([embedding_text])
     return embedding.tolist()[0]
 
+def enhanced_vector_key(text: str) -> str:
+    """Key of an enhanced embedding text (sha1 hex), as stored in catalog generations."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def encode_catalog_vectors(products: List[ProductModel],
+                           previous: Optional[Dict[str, np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keys and normalized enhanced vectors of a catalog, stored with its generation.
+
+    Args:
+        products: Products in the generation's row order
+        previous: Vectors by key to reuse (the previous generation's), so only
+            new or edited products are encoded
+
+    Returns:
+        (keys, float32 matrix with one row per product)
+    """
+    texts = [generate_enhanced_product_embedding_text(product) for product in products]
+    keys = [enhanced_vector_key(text) for text in texts]
+    vectors = {key: previous[key] for key in keys if previous and key in previous}
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        print(f"Encoding enhanced vectors of {len(missing)} of {len(products)} products")
+        encoded = normalize_rows(get_embedding_model().encode(list(missing.values())))
+        vectors.update(zip(missing, encoded))
+    if not keys:
+        return np.array([], dtype="<U40"), np.zeros((0, 0), dtype=np.float32)
+    return np.array(keys, dtype="<U40"), np.vstack([vectors[key] for key in keys]).astype(np.float32)
+
+def enhanced_product_vectors(products: List[ProductModel]) -> np.ndarray:
+    """
+    Normalized enhanced embeddings of the products.
+
+    The live catalog generation stores one per product, computed when it was
+    built; only products it does not cover (the legacy store, or a generation
+    built before they were stored) are encoded here, and cached.
+    """
+    keys = [enhanced_vector_key(generate_enhanced_product_embedding_text(product)) for product in products]
+    vectors = _stored_vectors(keys)
+    if len(vectors) < len(keys):
+        with _product_vectors_lock:
+            vectors.update({key: _product_vectors[key] for key in keys if key not in vectors and key in _product_vectors})
+    missing = {key: product for key, product in zip(keys, products) if key not in vectors}
+    if missing:
+        texts = [generate_enhanced_product_embedding_text(product) for product in missing.values()]
+        encoded = normalize_rows(get_embedding_model().encode(texts))
+        vectors.update(zip(missing, encoded))
+        with _product_vectors_lock:
+            if len(_product_vectors) + len(missing) > ENHANCED_EMBEDDING_CACHE_SIZE:
+                _product_vectors.clear()
+            _product_vectors.update(zip(missing, encoded))
+    return np.vstack([vectors[key] for key in keys])
+
+def _stored_vectors(keys: List[str]) -> Dict[str, np.ndarray]:
+    """Vectors of the keys found in the live catalog generation."""
+    generation = live_catalog_generation()
+    if generation is None or generation.enhanced_embeddings is None:
+        return {}
+    rows = generation.enhanced_row_of
+    return {key: generation.enhanced_embeddings[rows[key]] for key in keys if key in rows}
+
 def calculate_similarity_score(user_embedding: List[float], product_embedding: List[float]) -> float:
     """
     Calculate similarity score between user query and product.
@@ -129,7 +205,7 @@ def calculate_similarity_score(user_embedding: List[float], product_embedding: L
     """
     return calculate_cosine_similarity(user_embedding, product_embedding)
 
-def rank_products_by_similarity(user_query: str, products: List[ProductModel], soft_preferences: dict = None, macro_targets: dict = None) -> List[tuple]:
+def rank_products_by_similarity(user_query: str, products: List[ProductModel], soft_preferences: dict = None, macro_targets: dict = None, mmr_lambda: Optional[float] = None, top_k: Optional[int] = None) -> List[tuple]:
     """
     Rank products by similarity to user query embedding.
     
@@ -138,23 +214,25 @@ def rank_products_by_similarity(user_query: str, products: List[ProductModel], s
         products: List of products to rank
         soft_preferences: LLM-extracted soft preferences
         macro_targets: Macro targets from RAG pipeline
+        mmr_lambda: If set, diversify the ranking with MMR (see app.core.diversity)
+        top_k: Number of products to return (default: all)
     
     Returns:
-        List of (product, similarity_score) tuples, sorted by score descending
+        List of (product, similarity_score) tuples, by score descending (or MMR order)
     """
-    # Generate user query embedding
-    user_embedding = generate_user_query_embedding(user_query, soft_preferences, macro_targets)
-    
-    # Rank products
-    product_scores = []
-    for product in products:
-        product_embedding = generate_enhanced_product_embedding(product)
-        similarity = calculate_similarity_score(user_embedding, product_embedding)
-        product_scores.append((product, similarity))
-    
-    # Sort by similarity
-    product_scores.sort(key=lambda x: x[1], reverse=True)
-    return product_scores
+    if not products:
+        return []
+
+    # Only the query is encoded per request; product vectors come from the cache
+    user_embedding = normalize_rows(generate_user_query_embedding(user_query, soft_preferences, macro_targets))[0]
+    product_embeddings = enhanced_product_vectors(products)
+    similarities = product_embeddings @ user_embedding
+
+    if mmr_lambda is not None:
+        order = mmr_rerank(similarities, product_embeddings, lambda_param=mmr_lambda, k=top_k)
+    else:
+        order = np.argsort(-similarities, kind="stable")[:top_k]
+    return [(products[i], float(similarities[i])) for i in order]
 
 def get_top_matching_products(user_query: str, products: List[ProductModel], top_k: int = 10, soft_preferences: dict = None, macro_targets: dict = None) -> List[ProductModel]:
     """
@@ -4,6 +4,7 @@ Global singleton for SentenceTransformer model to ensure only one instance is lo
 from typing import Optional
 import gc
 import weakref
+from app.core.memory_policy import checkpoint, get_memory_policy
 
 class GlobalEmbeddings:
     _instance = None
@@ -26,6 +27,8 @@ class GlobalEmbeddings:
             self._model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
             # Create a weakref to help with garbage collection
             weakref.finalize(self._model, self._cleanup_model)
+            # Model weights are long-lived; keep them out of future collections
+            get_memory_policy().freeze_after_warmup()
         return self._model
     
     def encode_with_optimization(self, texts, **kwargs):
@@ -41,12 +44,8 @@ class GlobalEmbeddings:
             # Encode with memory-efficient settings
             embeddings = self._model.encode(texts, **kwargs)
             
-            # Convert to CPU if needed and clear CUDA cache
-            if hasattr(torch.cuda, 'empty_cache'):
-                torch.cuda.empty_cache()
-            
-            # Force garbage collection
-            gc.collect()
+            # Memory is reclaimed by the amortized policy rather than per call
+            checkpoint()
             
             return embeddings
     
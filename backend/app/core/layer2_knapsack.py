@@ -0,0 +1,277 @@
+"""
+Pseudo-polynomial dynamic programming for Layer 2.
+
+The exhaustive search scores every combination, which stops being feasible
+past ~20 candidates and cannot express several servings of one product. This
+solver treats bundle building as a multi-dimensional knapsack:
+
+- partial bundles are bucketed into cells on a grid over
+  (snack count, calories, protein, carbs, fat, electrolytes), so the number of
+  states is bounded by the grid rather than by C(n, k)
+- within a cell only the ends of the (calories, current score) Pareto front
+  are kept: the lowest-score partial bundle and, under a calorie cap, the
+  lowest-calorie one (LAYER2_DP_BUNDLES_PER_CELL=1 keeps only the former)
+- products are added one at a time, each 1..max_servings times (a limit for
+  every product, or one per product), so every multiset of products is built once
+- a partial bundle is dropped as soon as its score lower bound (the overage
+  penalties, which adding products can only increase) cannot reach the
+  current top-k, the threshold or the best bundle found so far
+
+With a grid fine enough that no two bundles share a cell the search is exact;
+coarser grids trade a little optimality for bounded work. By default a macro
+cell is LAYER2_DP_GRID_FRACTION of its target (so children's and adults'
+targets get the same resolution) and a calorie cell is LAYER2_DP_GRID_CALORIES.
+"""
+
+import heapq
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LAYER2_DP_BUNDLES_PER_CELL = int(os.getenv("LAYER2_DP_BUNDLES_PER_CELL", "2"))
+LAYER2_DP_GRID_FRACTION = float(os.getenv("LAYER2_DP_GRID_FRACTION", "0.2"))
+LAYER2_DP_GRID_CALORIES = float(os.getenv("LAYER2_DP_GRID_CALORIES", "100"))
+
+MACROS = ("protein", "carbs", "fat", "electrolytes")
+
+# Cell size for a macro without a target: every amount shares one cell
+_UNBOUNDED_STEP = 1e12
+
+
+@dataclass(frozen=True)
+class DPGrid:
+    """Cell size per dimension (kcal, g, g, g, mg)."""
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    electrolytes: float
+
+    @classmethod
+    def for_targets(cls, target_values: Dict[str, float],
+                    fraction: float = LAYER2_DP_GRID_FRACTION,
+                    calories: float = LAYER2_DP_GRID_CALORIES) -> "DPGrid":
+        """Macro cells of `fraction` of each target, calorie cells of `calories` kcal."""
+        steps = {
+            macro: target_values[macro] * fraction if target_values[macro] > 0 else _UNBOUNDED_STEP
+            for macro in MACROS
+        }
+        return cls(calories=calories, **steps)
+
+
+def _totals_dict(totals) -> Dict[str, float]:
+    return {
+        'protein': float(totals[0]),
+        'carbs': float(totals[1]),
+        'fat': float(totals[2]),
+        'electrolytes': float(totals[3]),
+        'calories': float(totals[4])
+    }
+
+
+def _score_arrays(totals: np.ndarray, target_values: Dict[str, float], weights: Dict[str, float]):
+    """
+    Vectorized score_totals() for bundles within the snack limit, and its lower bound.
+
+    The lower bound keeps only the penalties no superset of a bundle can avoid
+    (overages and macros without a target), since nutrients are non-negative.
+    """
+    score = np.zeros(len(totals))
+    bound = np.zeros(len(totals))
+    for j, macro in enumerate(MACROS):
+        target = target_values[macro]
+        total = totals[:, j]
+        if target > 0:
+            under = (target - total) / target * weights[macro] * 1.5
+            over = (total - target) / target * weights[macro] * 0.7
+            score += np.where(total < target, under, over)
+            bound += np.where(total < target, 0.0, over)
+        else:
+            penalty = np.where(total > 0, weights[macro] * 0.5, 0.0)
+            score += penalty
+            bound += penalty
+    return score, bound
+
+
+def knapsack_search(rows: List[Tuple[float, ...]],
+                    min_size: int,
+                    max_size: int,
+                    target_values: Dict[str, float],
+                    weights: Dict[str, float],
+                    max_candidates: int,
+                    score_threshold: float,
+                    calorie_cap: Optional[float],
+                    max_servings: Union[int, Sequence[int]] = 1,
+                    grid: Optional[DPGrid] = None,
+                    bundles_per_cell: int = LAYER2_DP_BUNDLES_PER_CELL,
+                    base: Optional[Tuple[float, ...]] = None,
+                    stop_at: Optional[float] = None):
+    """
+    Find the best bundles of at most max_size snacks with the grid DP.
+
+    Args:
+        rows: Nutrient rows of the candidate products (see nutrient_rows())
+        min_size: Smallest bundle size
+        max_size: Largest bundle size
+        target_values: Macro targets keyed like the score totals
+        weights: Macro weights of the optimizer
+        max_candidates: Bundles to return
+        score_threshold: Score a bundle must not exceed to be a candidate
+        calorie_cap: If set, bundles never exceed this many calories
+        max_servings: Servings of one product a bundle may contain, or one limit per row
+        grid: Cell sizes (default DPGrid.for_targets(target_values))
+        bundles_per_cell: 1 keeps the lowest-score partial bundle per cell; 2 also
+            keeps the lowest-calorie one when a calorie cap is set
+        base: Nutrient row added to every bundle (pinned products)
+        stop_at: time.time() after which no further products are added; the
+            bundles of the products added so far are returned
+
+    Returns:
+        (top, best) shaped like search_combinations(): indices may repeat a
+        product once per serving
+    """
+    grid = grid or DPGrid.for_targets(target_values)
+    steps = np.array([grid.protein, grid.carbs, grid.fat, grid.electrolytes, grid.calories], dtype=np.float64)
+    steps[steps <= 0] = 1e-9
+    min_size = max(1, min_size)
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+    servings = serving_limits(max_servings, len(rows))
+    keep_lowest_calories = calorie_cap is not None and bundles_per_cell > 1
+
+    # Live partial bundles (one row each) and the append-only tree of
+    # (parent node, product) they were built from; node 0 is the empty bundle
+    totals = np.zeros((1, 5)) if base is None else np.array([base], dtype=np.float64)
+    counts = np.zeros(1, dtype=np.int64)
+    scores = np.full(1, np.inf)
+    nodes = np.zeros(1, dtype=np.int64)
+    node_parents = [np.array([-1], dtype=np.int64)]
+    node_products = [np.array([-1], dtype=np.int64)]
+    next_node = 1
+
+    # Candidate pool: (score, count, node, totals) arrays, trimmed to the top-k
+    pool_scores = np.empty(0)
+    pool_counts = np.empty(0, dtype=np.int64)
+    pool_nodes = np.empty(0, dtype=np.int64)
+    pool_totals = np.empty((0, 5))
+    kth_score = None
+    best = None  # (score, count, node, totals)
+
+    def limit() -> float:
+        if kth_score is not None:
+            return kth_score
+        if len(pool_scores):
+            return score_threshold
+        return max(score_threshold, best[0]) if best is not None else np.inf
+
+    for i, row in enumerate(rows):
+        if stop_at is not None and time.time() >= stop_at:
+            break
+        added = [(totals, counts, scores, nodes)]
+        step_totals, step_counts, step_nodes = totals, counts, nodes
+        for _ in range(servings[i]):
+            step_totals = step_totals + row
+            step_counts = step_counts + 1
+            step_scores, bound = _score_arrays(step_totals, target_values, weights)
+            keep = (step_counts <= max_size) & (bound <= limit())
+            if calorie_cap is not None:
+                keep &= step_totals[:, 4] <= calorie_cap
+            step_totals, step_counts, step_scores = step_totals[keep], step_counts[keep], step_scores[keep]
+            if not len(step_totals):
+                break
+            node_parents.append(step_nodes[keep])
+            node_products.append(np.full(len(step_totals), i, dtype=np.int64))
+            step_nodes = np.arange(next_node, next_node + len(step_totals), dtype=np.int64)
+            next_node += len(step_totals)
+
+            # Complete bundles: the best one and every one within the limit
+            complete = np.nonzero(step_counts >= min_size)[0]
+            if len(complete):
+                j = complete[np.lexsort((step_counts[complete], step_scores[complete]))[0]]
+                if best is None or (step_scores[j], step_counts[j]) < (best[0], best[1]):
+                    best = (float(step_scores[j]), int(step_counts[j]), int(step_nodes[j]), step_totals[j])
+                take = complete[step_scores[complete] <= min(score_threshold, limit())]
+                if len(take):
+                    pool_scores = np.concatenate([pool_scores, step_scores[take]])
+                    pool_counts = np.concatenate([pool_counts, step_counts[take]])
+                    pool_nodes = np.concatenate([pool_nodes, step_nodes[take]])
+                    pool_totals = np.concatenate([pool_totals, step_totals[take]])
+                    if len(pool_scores) >= 2 * max_candidates:
+                        order = np.lexsort((pool_counts, pool_scores))[:max_candidates]
+                        pool_scores, pool_counts = pool_scores[order], pool_counts[order]
+                        pool_nodes, pool_totals = pool_nodes[order], pool_totals[order]
+                        kth_score = float(pool_scores[-1])
+
+            added.append((step_totals, step_counts, step_scores, step_nodes))
+
+        if len(added) == 1:
+            continue
+
+        # Keep the lowest-score bundle of every cell (and, under a calorie cap,
+        # the lowest-calorie one: the two ends of its (calories, score) front)
+        totals = np.concatenate([a[0] for a in added])
+        counts = np.concatenate([a[1] for a in added])
+        scores = np.concatenate([a[2] for a in added])
+        nodes = np.concatenate([a[3] for a in added])
+        cells = _cell_ids(counts, (totals / steps).astype(np.int64))
+        order = np.argsort(cells)
+        keep = np.zeros(len(cells), dtype=bool)
+        keep[_argmin_per_cell(cells, order, scores)] = True
+        if keep_lowest_calories:
+            keep[_argmin_per_cell(cells, order, totals[:, 4])] = True
+        winners = np.flatnonzero(keep)
+        totals, counts, scores, nodes = totals[winners], counts[winners], scores[winners], nodes[winners]
+
+    parents = np.concatenate(node_parents)
+    products = np.concatenate(node_products)
+
+    def bundle(score, count, node, bundle_totals):
+        indices = []
+        while node > 0:
+            indices.append(int(products[node]))
+            node = parents[node]
+        return (float(score), int(count), tuple(reversed(indices)), _totals_dict(bundle_totals))
+
+    top = heapq.nsmallest(
+        max_candidates,
+        (bundle(*candidate) for candidate in zip(pool_scores, pool_counts, pool_nodes, pool_totals)),
+        key=lambda c: c[:3]
+    )
+    return top, bundle(*best) if best is not None else None
+
+
+def serving_limits(max_servings: Union[int, Sequence[int]], n: int) -> List[int]:
+    """Servings limit of each of n products (at least 1) from one limit or one per product."""
+    if isinstance(max_servings, (int, np.integer)):
+        return [max(1, int(max_servings))] * n
+    return [max(1, int(limit)) for limit in max_servings]
+
+
+def _cell_ids(counts: np.ndarray, bins: np.ndarray) -> np.ndarray:
+    """One integer per (count, bins) cell: mixed-radix packing, or np.unique when that could overflow."""
+    columns = np.column_stack([counts, bins])
+    lows = columns.min(axis=0)
+    spans = columns.max(axis=0) - lows + 1
+    if np.prod(spans.astype(np.float64)) < 2 ** 62:
+        radix = np.cumprod(np.concatenate([[1], spans[:-1]]))
+        return (columns - lows) @ radix
+    _, ids = np.unique(columns, axis=0, return_inverse=True)
+    return ids.ravel()
+
+
+def _argmin_per_cell(cells: np.ndarray, order: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Position of the smallest value in every cell (order: positions sorted by cell)."""
+    sorted_cells = cells[order]
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    minima = np.minimum.reduceat(sorted_values, starts)
+    sizes = np.diff(np.r_[starts, len(order)])
+    hits = np.flatnonzero(sorted_values == np.repeat(minima, sizes))
+    groups = np.searchsorted(starts, hits, side="right")
+    first = np.r_[True, groups[1:] != groups[:-1]]
+    return order[hits[first]]
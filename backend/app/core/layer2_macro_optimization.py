@@ -9,18 +9,51 @@ Algorithm:
 - Dynamic Programming with Randomization - Finds multiple valid combinations and
   randomly selects one to provide variety while maintaining quality.
   Matches protein, carbs, fat, and electrolyte targets.
+- Grid Knapsack DP (layer2_knapsack) - Used when enumerating every combination
+  is too expensive or a product may appear more than once.
+- Pareto DP (layer2_pareto) - Used when price is an objective: finds every
+  bundle no other beats on both score and price and picks one for the budget.
 """
 
+import heapq
 import itertools
 import math
-from typing import List, Dict, Any, Tuple, Optional
-from dataclasses import dataclass
+import os
+import random
+import time
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional, Sequence, Union
+from dataclasses import dataclass, field
 from sqlalchemy.orm import Session
 import numpy as np
+from dotenv import load_dotenv
 
 
 
-from app.db.models import Product, MacroTarget
+from app.core.deadline import DEADLINE_LAYER2_MIN_SECONDS, Deadline
+from app.db.models import MacroTarget
+from app.db.product_view import ProductView
+
+load_dotenv()
+
+# "auto" enumerates every combination while that stays below
+# LAYER2_EXHAUSTIVE_MAX_COMBINATIONS and uses the grid DP beyond (or for servings > 1)
+LAYER2_ALGORITHM = os.getenv("LAYER2_ALGORITHM", "auto").lower()
+LAYER2_EXHAUSTIVE_MAX_COMBINATIONS = int(os.getenv("LAYER2_EXHAUSTIVE_MAX_COMBINATIONS", "50000"))
+LAYER2_MAX_SERVINGS = int(os.getenv("LAYER2_MAX_SERVINGS", "1"))
+
+# Alternative bundles: candidates kept per requested bundle, and the largest
+# share of products two returned bundles may have in common
+LAYER2_ALTERNATIVE_POOL_PER_BUNDLE = int(os.getenv("LAYER2_ALTERNATIVE_POOL_PER_BUNDLE", "10"))
+LAYER2_ALTERNATIVE_MAX_OVERLAP = float(os.getenv("LAYER2_ALTERNATIVE_MAX_OVERLAP", "0.5"))
+
+# Layer 2 settings of the recommendation pipeline (shared with the precomputed bundle library)
+PIPELINE_OPTIMIZER_SETTINGS = {
+    "min_snacks": 1,
+    "max_snacks": 8,
+    "max_candidates": 10,
+    "score_threshold": 1.5,
+}
 
 @dataclass
 class MacroTargets:
@@ -40,7 +73,7 @@ class MacroTargets:
 @dataclass
 class CombinationResult:
     """Result of macro optimization."""
-    products: List[Product]
+    products: List[ProductView]
     total_protein: float
     total_carbs: float
     total_fat: float
@@ -49,6 +82,148 @@ class CombinationResult:
     score: float
     algorithm_used: str
     target_match_percentage: float
+    # Near-optimal combinations the result was drawn from ({'combination',
+    # 'score', 'totals', 'target_match'}); see pick_from_top_candidates()
+    top_candidates: List[Dict[str, Any]] = field(default_factory=list)
+    # Candidate reduction before the search ({'candidates', 'equivalence_classes',
+    # 'duplicates_collapsed', 'over_calorie_cap', 'dominated', 'searched'}); see layer2_reduction
+    pruning: Dict[str, int] = field(default_factory=dict)
+    # Larger set of scored combinations kept for alternative bundles (same shape
+    # as top_candidates); empty unless alternatives were requested
+    candidate_pool: List[Dict[str, Any]] = field(default_factory=list)
+    # Products per timing slot ('pre_workout', 'during_workout', 'post_workout')
+    # when optimized with slot targets; see layer2_timing
+    timing_slots: Dict[str, List[ProductView]] = field(default_factory=dict)
+    # Bundles on the (score, price) Pareto front, cheapest first (top_candidates
+    # shape plus 'price'); empty unless optimized with price as an objective
+    pareto_front: List[Dict[str, Any]] = field(default_factory=list)
+
+def _target_values(targets: MacroTargets) -> Dict[str, float]:
+    return {
+        'protein': targets.target_protein_g,
+        'carbs': targets.target_carbs_g,
+        'fat': targets.target_fat_g,
+        'electrolytes': targets.target_electrolytes_mg
+    }
+
+def score_totals(totals: Dict[str, float],
+                 target_values: Dict[str, float],
+                 weights: Dict[str, float],
+                 max_snacks: int,
+                 count: int) -> float:
+    """Score of a combination from its macro totals (lower is better)."""
+    total_score = 0.0
+    for macro, total in totals.items():
+        if macro == 'calories':
+            continue  # Calories handled separately
+            
+        target = target_values[macro]
+        if target > 0:
+            # Calculate percentage difference with asymmetric penalties
+            if total < target:
+                # Penalize being under target more heavily
+                diff = (target - total) / target
+                weighted_diff = diff * weights[macro] * 1.5
+            else:
+                # Be more lenient when exceeding target (common with 4-10 snacks)
+                diff = (total - target) / target
+                weighted_diff = diff * weights[macro] * 0.7
+            total_score += weighted_diff
+        elif total > 0:
+            # Penalize if we have macros but no target
+            total_score += weights[macro] * 0.5
+    
+    # Only penalize too many snacks (no minimum penalty for exact matching)
+    if count > max_snacks:
+        total_score += (count - max_snacks) * 0.1
+    
+    return total_score
+
+def nutrient_rows(products: List[ProductView]) -> List[Tuple[float, float, float, float, float]]:
+    """(protein, carbs, fat, electrolytes, calories) per product, with missing values as 0."""
+    return [
+        (p.protein or 0, p.carbs or 0, p.fat or 0, p.electrolytes_mg or 0, p.calories or 0)
+        for p in products
+    ]
+
+def pinned_totals(pinned: Optional[List[ProductView]]) -> Optional[Tuple[float, ...]]:
+    """Nutrient row of the pinned products together (None when nothing is pinned)."""
+    if not pinned:
+        return None
+    return tuple(float(sum(column)) for column in zip(*nutrient_rows(pinned)))
+
+def combination_prefixes(n: int, min_size: int, max_size: int) -> List[Tuple[int, int]]:
+    """(size, first index) pairs that together cover every combination, in enumeration order."""
+    return [
+        (size, first)
+        for size in range(max(1, min_size), min(max_size + 1, n + 1))
+        for first in range(n - size + 1)
+    ]
+
+def count_combinations(n: int, min_size: int, max_size: int) -> int:
+    """Number of combinations the exhaustive search scores."""
+    return sum(math.comb(n, size) for size in range(max(1, min_size), min(max_size + 1, n + 1)))
+
+def search_combinations(rows: List[Tuple[float, ...]],
+                        prefixes: List[Tuple[int, int]],
+                        target_values: Dict[str, float],
+                        weights: Dict[str, float],
+                        max_snacks: int,
+                        max_candidates: int,
+                        score_threshold: float,
+                        calorie_cap: Optional[float],
+                        base: Optional[Tuple[float, ...]] = None,
+                        stop_at: Optional[float] = None):
+    """
+    Exhaustively score every combination starting with one of the given prefixes.
+    
+    base is a nutrient row added to every combination (products pinned into
+    the bundle), so scores and the calorie cap apply to the whole bundle.
+    If stop_at (a time.time() value) passes, the search ends early with the
+    combinations scored so far.
+    
+    Combinations are index tuples into rows. Ordering candidates by
+    (score, size, indices) is the same as a stable sort by score of the
+    itertools.combinations enumeration, so merging the results of disjoint
+    prefix sets gives exactly the serial result.
+    
+    Returns:
+        Tuple of (top, best): up to max_candidates (score, size, indices, totals)
+        tuples within score_threshold in that order, and the best combination
+        regardless of the threshold (None if none fits under the calorie cap)
+    """
+    n = len(rows)
+    base = base or (0.0, 0.0, 0.0, 0.0, 0.0)
+    valid = []
+    best = None
+    for size, first in prefixes:
+        if stop_at is not None and time.time() >= stop_at:
+            break
+        for step, rest in enumerate(itertools.combinations(range(first + 1, n), size - 1)):
+            if stop_at is not None and step % 4096 == 4095 and time.time() >= stop_at:
+                break
+            indices = (first,) + rest
+            totals = {
+                'protein': base[0] + sum(rows[i][0] for i in indices),
+                'carbs': base[1] + sum(rows[i][1] for i in indices),
+                'fat': base[2] + sum(rows[i][2] for i in indices),
+                'electrolytes': base[3] + sum(rows[i][3] for i in indices),
+                'calories': base[4] + sum(rows[i][4] for i in indices)
+            }
+            
+            # Enforce calorie cap if set
+            if calorie_cap is not None and totals['calories'] > calorie_cap:
+                continue
+            
+            score = score_totals(totals, target_values, weights, max_snacks, size)
+            candidate = (score, size, indices, totals)
+            if score <= score_threshold:
+                valid.append(candidate)
+            if best is None or candidate[:3] < best[:3]:
+                best = candidate
+    
+    top = heapq.nsmallest(max_candidates, valid, key=lambda c: c[:3])
+    return top, best
 
 class MacroOptimizer:
     """Advanced macro optimization engine for Layer 2."""
@@ -81,7 +256,7 @@ class MacroOptimizer:
         }
     
     def calculate_combination_score(self, 
-                                  products: List[Product], 
+                                  products: List[ProductView], 
                                   targets: MacroTargets) -> Tuple[float, Dict[str, float]]:
         """
         Calculate how well a combination matches the macro targets.
@@ -101,52 +276,20 @@ class MacroOptimizer:
             'calories': sum(p.calories or 0 for p in products)
         }
         
-        # Calculate weighted percentage differences
-        target_values = {
-            'protein': targets.target_protein_g,
-            'carbs': targets.target_carbs_g,
-            'fat': targets.target_fat_g,
-            'electrolytes': targets.target_electrolytes_mg
-        }
-        
-        total_score = 0.0
-        for macro, total in totals.items():
-            if macro == 'calories':
-                continue  # Calories handled separately
-                
-            target = target_values[macro]
-            if target > 0:
-                # Calculate percentage difference with asymmetric penalties
-                if total < target:
-                    # Penalize being under target more heavily
-                    diff = (target - total) / target
-                    weighted_diff = diff * self.weights[macro] * 1.5
-                else:
-                    # Be more lenient when exceeding target (common with 4-10 snacks)
-                    diff = (total - target) / target
-                    weighted_diff = diff * self.weights[macro] * 0.7
-                total_score += weighted_diff
-            elif total > 0:
-                # Penalize if we have macros but no target
-                total_score += self.weights[macro] * 0.5
-        
-        # Only penalize too many snacks (no minimum penalty for exact matching)
-        snack_count_penalty = 0.0
-        if len(products) > self.max_snacks:
-            snack_count_penalty = (len(products) - self.max_snacks) * 0.1
-        
-        total_score += snack_count_penalty
-        
-        return total_score, totals
+        return score_totals(totals, _target_values(targets), self.weights, self.max_snacks, len(products)), totals
     
 
     
     def dynamic_programming_algorithm(self, 
-                                    products: List[Product], 
+                                    products: List[ProductView], 
                                     targets: MacroTargets,
                                     max_candidates: int = 10,
                                     score_threshold: float = 0.3,
-                                    calorie_cap: float = None) -> CombinationResult:
+                                    calorie_cap: float = None,
+                                    parallelism: Optional[int] = None,
+                                    pinned: Optional[List[ProductView]] = None,
+                                    rng: Optional[random.Random] = None,
+                                    stop_at: Optional[float] = None) -> CombinationResult:
         """
         Dynamic programming algorithm that finds multiple valid combinations and randomly selects one.
         
@@ -158,49 +301,139 @@ class MacroOptimizer:
             max_candidates: Maximum number of candidate combinations to keep
             score_threshold: Score threshold above which combinations are considered valid
             calorie_cap: If set, only consider combinations with total calories <= this value
+            parallelism: Worker processes this search may occupy (None = LAYER2_PARALLELISM,
+                1 = always search in this process)
+            pinned: Products every combination contains on top of the searched ones
+            rng: Random generator of the request (None = the global one)
+            stop_at: time.time() at which to stop searching and use the best combinations so far
         """
+        pinned = pinned or []
         if len(products) > 20:
             # Fall back to simple selection for large datasets
-            return self._simple_selection_algorithm(products, targets)
+            return self._simple_selection_algorithm(products, targets, pinned)
         
-        valid_combinations = []
+        rows = nutrient_rows(products)
+        min_size, max_size = self._search_sizes(pinned)
+        settings = (_target_values(targets), self.weights, self.max_snacks, max_candidates, score_threshold, calorie_cap,
+                    pinned_totals(pinned), stop_at)
+        top, best = None, None
+        if parallelism != 1:
+            # Imported here: layer2_parallel imports this module for its workers
+            from app.core.layer2_parallel import parallel_search_combinations
+            searched = parallel_search_combinations(rows, min_size, max_size, settings, parallelism)
+            if searched is not None:
+                top, best = searched
+        if top is None:
+            top, best = search_combinations(rows, combination_prefixes(len(rows), min_size, max_size), *settings)
         
-        # Try all combinations of different sizes
-        for size in range(self.min_snacks, min(self.max_snacks + 1, len(products) + 1)):
-            for combination in itertools.combinations(products, size):
-                score, totals = self.calculate_combination_score(list(combination), targets)
-                
-                # Enforce calorie cap if set
-                if calorie_cap is not None and totals['calories'] > calorie_cap:
-                    continue
-                
-                # Keep combinations that meet the score threshold
-                if score <= score_threshold:
-                    valid_combinations.append({
-                        'combination': list(combination),
-                        'score': score,
-                        'totals': totals
-                    })
+        return self._result_from_search(products, targets, top, best, "dynamic_programming_random", "dynamic_programming",
+                                        pinned, rng)
+    
+    def knapsack_algorithm(self,
+                           products: List[ProductView],
+                           targets: MacroTargets,
+                           max_candidates: int = 10,
+                           score_threshold: float = 0.3,
+                           calorie_cap: float = None,
+                           max_servings: Union[int, Sequence[int]] = 1,
+                           grid=None,
+                           pinned: Optional[List[ProductView]] = None,
+                           rng: Optional[random.Random] = None,
+                           stop_at: Optional[float] = None) -> CombinationResult:
+        """
+        Grid dynamic programming over calories and macros (see layer2_knapsack).
+        
+        Handles hundreds of candidates and bundles with several servings of a product.
         
-        if not valid_combinations:
+        Args:
+            products: List of candidate products
+            targets: Macro targets to match
+            max_candidates: Maximum number of candidate combinations to keep
+            score_threshold: Score threshold above which combinations are considered valid
+            calorie_cap: If set, only consider combinations with total calories <= this value
+            max_servings: Servings of one product a combination may contain, or one limit per product
+            grid: DPGrid cell sizes (default: derived from the targets)
+            pinned: Products every combination contains on top of the searched ones
+            rng: Random generator of the request (None = the global one)
+            stop_at: time.time() at which to stop searching and use the best combinations so far
+        """
+        # Imported here: layer2_knapsack imports this module for the scoring
+        from app.core.layer2_knapsack import knapsack_search
+        min_size, max_size = self._search_sizes(pinned)
+        top, best = knapsack_search(
+            nutrient_rows(products), min_size, max_size, _target_values(targets), self.weights,
+            max_candidates, score_threshold, calorie_cap, max_servings=max_servings, grid=grid,
+            base=pinned_totals(pinned), stop_at=stop_at
+        )
+        return self._result_from_search(products, targets, top, best, "knapsack_dp_random", "knapsack_dp", pinned, rng)
+    
+    def pareto_algorithm(self,
+                         products: List[ProductView],
+                         targets: MacroTargets,
+                         calorie_cap: float = None,
+                         max_servings: Union[int, Sequence[int]] = 1,
+                         budget: Optional[float] = None,
+                         count_objective: bool = False,
+                         grid=None,
+                         pinned: Optional[List[ProductView]] = None,
+                         stop_at: Optional[float] = None) -> Optional[CombinationResult]:
+        """
+        Grid dynamic programming over score and total price (see layer2_pareto).
+        
+        Args:
+            products: List of candidate products
+            targets: Macro targets to match
+            calorie_cap: If set, only consider combinations with total calories <= this value
+            max_servings: Servings of one product a combination may contain, or one limit per product
+            budget: Price the selected combination should stay within (None = best score)
+            count_objective: Also prefer combinations with fewer snacks
+            grid: DPGrid cell sizes (default: derived from the targets)
+            pinned: Products every combination contains on top of the searched ones
+            stop_at: time.time() at which to stop searching and use the front found so far
+        
+        Returns:
+            The best combination within the budget (the cheapest one if none fits),
+            with the whole front as top_candidates in score order, or None
+        """
+        # Imported here: only price-aware requests need the Pareto search
+        from app.core.layer2_pareto import pareto_search, product_prices, select_for_budget
+        pinned = list(pinned or [])
+        min_size, max_size = self._search_sizes(pinned)
+        front = pareto_search(
+            nutrient_rows(products), product_prices(products), min_size, max_size, _target_values(targets),
+            self.weights, calorie_cap, max_servings=max_servings, count_objective=count_objective, grid=grid,
+            base=pinned_totals(pinned), base_price=sum(product_prices(pinned)), stop_at=stop_at
+        )
+        selected = select_for_budget(front, budget)
+        if selected is None:
+            return None
+        
+        candidates = []
+        chosen = None
+        for bundle in sorted(front, key=lambda c: (c[0], c[4], c[1])):
+            score, _, indices, totals, price = bundle
+            candidate = {'combination': pinned + [products[i] for i in indices], 'score': score, 'totals': totals,
+                         'price': price, 'target_match': self._calculate_target_match_percentage(totals, targets)}
+            candidates.append(candidate)
+            if bundle is selected:
+                chosen = candidate
+        return _result_from_candidate(chosen, "pareto_price", candidates)
+    
+    def _search_sizes(self, pinned: Optional[List[ProductView]]) -> Tuple[int, int]:
+        """Smallest and largest number of products to search for next to the pinned ones."""
+        count = len(pinned or [])
+        return max(1, self.min_snacks - count), self.max_snacks - count
+    
+    def _result_from_search(self, products, targets, top, best, algorithm_used, fallback_algorithm, pinned=None, rng=None):
+        """Build the CombinationResult from search (top, best) tuples of product indices (after the pinned products)."""
+        pinned = list(pinned or [])
+        if not top:
             # If no combinations meet the threshold, return the best one (below calorie cap if possible)
-            best_combination = None
-            best_score = float('inf')
-            best_totals = {}
-            
-            for size in range(self.min_snacks, min(self.max_snacks + 1, len(products) + 1)):
-                for combination in itertools.combinations(products, size):
-                    score, totals = self.calculate_combination_score(list(combination), targets)
-                    if calorie_cap is not None and totals['calories'] > calorie_cap:
-                        continue
-                    if score < best_score:
-                        best_score = score
-                        best_combination = list(combination)
-                        best_totals = totals
-            
-            if not best_combination:
+            if best is None:
                 return None
             
+            best_score, _, best_indices, best_totals = best
+            best_combination = pinned + [products[i] for i in best_indices]
             target_match = self._calculate_target_match_percentage(best_totals, targets)
             
             return CombinationResult(
@@ -211,33 +444,25 @@ class MacroOptimizer:
                 total_electrolytes=best_totals['electrolytes'],
                 total_calories=best_totals['calories'],
                 score=best_score,
-                algorithm_used="dynamic_programming",
+                algorithm_used=fallback_algorithm,
                 target_match_percentage=target_match
             )
         
-        # Sort by score and keep top candidates
-        valid_combinations.sort(key=lambda x: x['score'])
-        top_candidates = valid_combinations[:max_candidates]
+        # Top candidates in score order (ties in enumeration order)
+        top_candidates = [
+            {'combination': pinned + [products[i] for i in indices], 'score': score, 'totals': totals}
+            for score, _, indices, totals in top
+        ]
         
-        # Randomly select from top candidates
-        import random
-        selected = random.choice(top_candidates)
-        
-        target_match = self._calculate_target_match_percentage(selected['totals'], targets)
+        for candidate in top_candidates:
+            candidate['target_match'] = self._calculate_target_match_percentage(candidate['totals'], targets)
         
-        return CombinationResult(
-            products=selected['combination'],
-            total_protein=selected['totals']['protein'],
-            total_carbs=selected['totals']['carbs'],
-            total_fat=selected['totals']['fat'],
-            total_electrolytes=selected['totals']['electrolytes'],
-            total_calories=selected['totals']['calories'],
-            score=selected['score'],
-            algorithm_used="dynamic_programming_random",
-            target_match_percentage=target_match
-        )
+        # Randomly select from top candidates
+        selected = (rng or random).choice(top_candidates)
+        return _result_from_candidate(selected, algorithm_used, top_candidates)
     
-    def _simple_selection_algorithm(self, products: List[Product], targets: MacroTargets) -> CombinationResult:
+    def _simple_selection_algorithm(self, products: List[ProductView], targets: MacroTargets,
+                                    pinned: Optional[List[ProductView]] = None) -> CombinationResult:
         """Simple selection algorithm for large datasets."""
         # Sort products by how well they match the targets
         scored_products = []
@@ -249,7 +474,7 @@ class MacroOptimizer:
         scored_products.sort(key=lambda x: x[1])
         
         # Select top products up to max_snacks
-        selected_products = [p[0] for p in scored_products[:self.max_snacks]]
+        selected_products = list(pinned or []) + [p[0] for p in scored_products[:self._search_sizes(pinned)[1]]]
         
         # Calculate totals for selected products
         score, totals = self.calculate_combination_score(selected_products, targets)
@@ -310,13 +535,98 @@ class MacroOptimizer:
         avg_score = total_score / valid_targets
         return avg_score
 
-def optimize_macro_combination(products: List[Product], 
+def _result_from_candidate(candidate: Dict[str, Any], algorithm_used: str,
+                           top_candidates: List[Dict[str, Any]]) -> CombinationResult:
+    totals = candidate['totals']
+    return CombinationResult(
+        products=candidate['combination'],
+        total_protein=totals['protein'],
+        total_carbs=totals['carbs'],
+        total_fat=totals['fat'],
+        total_electrolytes=totals['electrolytes'],
+        total_calories=totals['calories'],
+        score=candidate['score'],
+        algorithm_used=algorithm_used,
+        target_match_percentage=candidate['target_match'],
+        top_candidates=top_candidates,
+        timing_slots=candidate.get('slots', {})
+    )
+
+def pick_from_top_candidates(result: CombinationResult, rng: Optional[random.Random] = None) -> CombinationResult:
+    """
+    Draw a new random combination from the candidates an earlier optimization kept.
+
+    Used to vary cached recommendations without re-running the optimization.
+    Results without candidates (best-effort or simple selection) are returned as is.
+    """
+    if not result.top_candidates:
+        return result
+    picked = pick_from_candidates(result.top_candidates, result.algorithm_used, rng)
+    picked.pruning = result.pruning
+    picked.candidate_pool = result.candidate_pool
+    picked.pareto_front = result.pareto_front
+    return picked
+
+def pick_from_candidates(top_candidates: List[Dict[str, Any]], algorithm_used: str,
+                         rng: Optional[random.Random] = None) -> CombinationResult:
+    """Randomly pick one of several scored combinations (dicts shaped like CombinationResult.top_candidates)."""
+    return _result_from_candidate((rng or random).choice(top_candidates), algorithm_used, top_candidates)
+
+def bundle_overlap(first: List[ProductView], second: List[ProductView]) -> float:
+    """Share of the smaller bundle's products (servings counted) that the other bundle also holds."""
+    if not first or not second:
+        return 0.0
+    shared = Counter(p.id for p in first) & Counter(p.id for p in second)
+    return sum(shared.values()) / min(len(first), len(second))
+
+def select_alternatives(result: CombinationResult,
+                        count: int,
+                        max_overlap: float = LAYER2_ALTERNATIVE_MAX_OVERLAP) -> List[Dict[str, Any]]:
+    """
+    Pick up to `count` alternatives to the selected combination from the scored candidates.
+    
+    Candidates are taken in score order and kept when they share at most
+    max_overlap of their products with the selected combination and with every
+    alternative kept so far.
+    
+    Args:
+        result: Optimization result (its candidate_pool, else its top_candidates)
+        count: Number of alternatives wanted
+        max_overlap: Largest bundle_overlap() allowed between any two bundles
+    
+    Returns:
+        Candidate dicts shaped like CombinationResult.top_candidates, best first
+    """
+    chosen = [result.products]
+    alternatives = []
+    for candidate in result.candidate_pool or result.top_candidates:
+        if len(alternatives) >= count:
+            break
+        combination = candidate['combination']
+        if all(bundle_overlap(combination, other) <= max_overlap for other in chosen):
+            chosen.append(combination)
+            alternatives.append(candidate)
+    return alternatives
+
+def optimize_macro_combination(products: List[ProductView], 
                              macro_targets: MacroTarget,
                              min_snacks: int = 1,
                              max_snacks: int = 10,
                              max_candidates: int = 10,
                              score_threshold: float = 1.5,
-                             calorie_cap: float = None) -> CombinationResult:
+                             calorie_cap: float = None,
+                             parallelism: Optional[int] = None,
+                             max_servings: Optional[int] = None,
+                             algorithm: Optional[str] = None,
+                             reduce_candidates: Optional[bool] = None,
+                             alternatives: int = 0,
+                             pinned: Optional[List[ProductView]] = None,
+                             slot_targets: Optional[Dict[str, MacroTargets]] = None,
+                             price_objective: bool = False,
+                             count_objective: bool = False,
+                             budget: Optional[float] = None,
+                             rng: Optional[random.Random] = None,
+                             deadline: Optional[Deadline] = None) -> CombinationResult:
     """
     Main function to optimize macro combinations using dynamic programming with randomization.
     
@@ -328,6 +638,25 @@ def optimize_macro_combination(products: List[Product],
         max_candidates: Maximum number of candidate combinations to consider
         score_threshold: Score threshold for valid combinations (lower = stricter)
         calorie_cap: If set, only consider combinations with total calories <= this value
+        parallelism: Worker processes the search may occupy (None = LAYER2_PARALLELISM)
+        max_servings: Servings of one product a combination may contain (None = LAYER2_MAX_SERVINGS)
+        algorithm: "exhaustive", "dp", "auto" or "simple" (greedy, no search; None = LAYER2_ALGORITHM)
+        reduce_candidates: Collapse identical and drop dominated products before the search
+            (None = LAYER2_REDUCE_CANDIDATES)
+        alternatives: Alternative bundles the caller will draw with select_alternatives(); the
+            search keeps a larger candidate_pool for them in the same pass
+        pinned: Products every combination must contain; only the remaining
+            max_snacks - len(pinned) snacks are searched, scored with the whole bundle
+        slot_targets: MacroTargets per workout timing slot; bundles are then split into
+            slots and ranked by how well every slot matches (see layer2_timing)
+        price_objective: Optimize total price next to the score: the result is the best
+            bundle within the budget on the Pareto front, kept in pareto_front
+        count_objective: With price_objective, also prefer bundles with fewer snacks
+        budget: Price the selected bundle should stay within (with price_objective)
+        rng: Random generator of the request, used for every random choice (None = the
+            global one); the same seed and inputs give the same result
+        deadline: Request deadline; the search stops there (after at least
+            DEADLINE_LAYER2_MIN_SECONDS) and uses the best bundles found so far
     
     Returns:
         CombinationResult with randomly selected optimal snack combination
@@ -349,11 +678,105 @@ def optimize_macro_combination(products: List[Product],
         max_snacks=max_snacks
     )
     
-    # Use dynamic programming with randomization
-    return optimizer.dynamic_programming_algorithm(
-        products, 
-        targets, 
-        max_candidates=max_candidates,
-        score_threshold=score_threshold,
-        calorie_cap=calorie_cap
-    ) 
\ No newline at end of file
+    max_servings = LAYER2_MAX_SERVINGS if max_servings is None else max_servings
+    pinned = list(pinned or [])
+    if len(pinned) >= max_snacks:
+        return None
+    min_size, max_size = optimizer._search_sizes(pinned)
+    
+    # Imported here: layer2_reduction imports this module for the scoring
+    from app.core import layer2_reduction
+    reduction = None
+    # The grid searches take max_servings of each product, the others every product at most once
+    servings, single_products = max_servings, products
+    if layer2_reduction.LAYER2_REDUCE_CANDIDATES if reduce_candidates is None else reduce_candidates:
+        reduction = layer2_reduction.reduce_candidates(
+            products, targets, optimizer.weights, max_snacks, max_size,
+            calorie_cap=calorie_cap, max_servings=max_servings, base=pinned_totals(pinned),
+            prices=[p.price_usd or 0.0 for p in products] if price_objective else None
+        )
+        products, servings = reduction.representatives, reduction.servings
+        single_products = reduction.copies(max_size)
+    
+    # The selected combination is still drawn from the best max_candidates
+    pool_size = max_candidates
+    if alternatives > 0:
+        pool_size = max(max_candidates, LAYER2_ALTERNATIVE_POOL_PER_BUNDLE * (alternatives + 1))
+    if slot_targets:
+        # Imported here: layer2_timing imports this module for the scoring
+        from app.core import layer2_timing
+        pool_size = max(pool_size, max_candidates * layer2_timing.LAYER2_TIMING_POOL_FACTOR)
+    
+    stop_at = deadline.stop_time(DEADLINE_LAYER2_MIN_SECONDS) if deadline is not None else None
+    algorithm = "pareto" if price_objective else (algorithm or LAYER2_ALGORITHM).lower()
+    if algorithm == "auto":
+        too_many = count_combinations(len(single_products), min_size, max_size) > LAYER2_EXHAUSTIVE_MAX_COMBINATIONS
+        algorithm = "dp" if max_servings > 1 or too_many else "exhaustive"
+    
+    if algorithm == "pareto":
+        result = optimizer.pareto_algorithm(
+            products,
+            targets,
+            calorie_cap=calorie_cap,
+            max_servings=servings,
+            budget=budget,
+            count_objective=count_objective,
+            pinned=pinned,
+            stop_at=stop_at
+        )
+    
+    elif algorithm == "simple":
+        result = optimizer._simple_selection_algorithm(single_products, targets, pinned=pinned)
+    
+    elif algorithm == "dp":
+        result = optimizer.knapsack_algorithm(
+            products,
+            targets,
+            max_candidates=pool_size,
+            score_threshold=score_threshold,
+            calorie_cap=calorie_cap,
+            max_servings=servings,
+            pinned=pinned,
+            rng=rng,
+            stop_at=stop_at
+        )
+    
+    else:
+        # Enumerate every combination with randomization
+        result = optimizer.dynamic_programming_algorithm(
+            single_products, 
+            targets, 
+            max_candidates=pool_size,
+            score_threshold=score_threshold,
+            calorie_cap=calorie_cap,
+            parallelism=parallelism,
+            pinned=pinned,
+            rng=rng,
+            stop_at=stop_at
+        )
+    
+    if stop_at is not None and time.time() >= stop_at:
+        deadline.degrade("layer2", "the bundle search stopped at the deadline with the best bundle found so far")
+        if result is None:
+            # Stopped before any bundle was complete: the greedy selection is instant
+            result = optimizer._simple_selection_algorithm(single_products, targets, pinned=pinned)
+    if reduction is not None:
+        result = reduction.apply(result, rng)
+    if algorithm == "pareto" and result is not None:
+        front = result.top_candidates
+        # The budget decides the bundle; alternatives come from the rest of the front
+        result.top_candidates = [c for c in front if c['combination'] is result.products]
+        if slot_targets:
+            result = layer2_timing.assign_timing_slots(result, slot_targets, optimizer.weights, max_candidates, rng)
+        result.pareto_front = sorted(front, key=lambda c: (c['price'], c['score']))
+        result.candidate_pool = [c for c in front if c['score'] <= score_threshold]
+        return result
+    if slot_targets:
+        return layer2_timing.assign_timing_slots(result, slot_targets, optimizer.weights, max_candidates, rng)
+    if result is not None and pool_size > max_candidates and result.top_candidates:
+        pool = result.top_candidates
+        pruning = result.pruning
+        result = pick_from_candidates(pool[:max_candidates], result.algorithm_used, rng)
+        result.pruning = pruning
+        result.candidate_pool = pool
+    return result 
\ No newline at end of file
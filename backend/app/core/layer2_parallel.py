@@ -0,0 +1,169 @@
+"""
+Process-pool parallel Layer 2 search.
+
+The exhaustive combination search of MacroOptimizer is pure CPU work in
+Python, so a single request uses one core no matter how many the machine has.
+The search space is split by (combination size, first product) prefix into
+shards of roughly equal combination counts, and each shard is scored in a
+persistent process pool:
+
+- the candidates' nutrient matrix is written once into a shared memory block
+  that the workers map, instead of pickling products into every task
+- each worker returns only its top candidates and best fallback combination
+- the shards are merged by (score, size, indices), which reproduces the serial
+  enumeration order, so the merged top-k is exactly the serial result
+
+LAYER2_PARALLELISM caps how many workers one request occupies, so a heavy
+request leaves the rest of the pool (LAYER2_WORKERS processes) to others.
+The pool belongs to one API process: under app.prefork LAYER2_WORKERS is the
+total for the server and each pre-forked worker gets its share.
+Searches smaller than LAYER2_PARALLEL_MIN_COMBINATIONS stay in-process, where
+they finish faster than the round trip to the pool.
+"""
+
+import heapq
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core import metrics
+from app.core.layer2_macro_optimization import combination_prefixes, count_combinations, search_combinations
+
+load_dotenv()
+
+LAYER2_WORKERS = int(os.getenv("LAYER2_WORKERS", str(os.cpu_count() or 1)))
+LAYER2_PARALLELISM = int(os.getenv("LAYER2_PARALLELISM", "2"))
+LAYER2_PARALLEL_MIN_COMBINATIONS = int(os.getenv("LAYER2_PARALLEL_MIN_COMBINATIONS", "20000"))
+
+NUTRIENT_WIDTH = 5  # protein, carbs, fat, electrolytes, calories
+
+
+def partition_prefixes(n: int, min_size: int, max_size: int, shards: int) -> List[List[Tuple[int, int]]]:
+    """
+    Split the (size, first index) prefixes into at most `shards` groups of similar work.
+
+    A prefix (size, first) covers C(n - first - 1, size - 1) combinations; the
+    largest prefixes are assigned first, each to the least loaded shard.
+    """
+    prefixes = combination_prefixes(n, min_size, max_size)
+    shards = max(1, min(shards, len(prefixes)))
+    loads = [0] * shards
+    parts: List[List[Tuple[int, int]]] = [[] for _ in range(shards)]
+    for size, first in sorted(prefixes, key=lambda p: -math.comb(n - p[1] - 1, p[0] - 1)):
+        shard = loads.index(min(loads))
+        parts[shard].append((size, first))
+        loads[shard] += math.comb(n - first - 1, size - 1)
+    return [sorted(part) for part in parts if part]
+
+
+def merge_search_results(results, max_candidates: int):
+    """Combine per-shard (top, best) results into the serial (top, best)."""
+    top = heapq.nsmallest(max_candidates, (c for shard_top, _ in results for c in shard_top), key=lambda c: c[:3])
+    best = min((shard_best for _, shard_best in results if shard_best is not None),
+               key=lambda c: c[:3], default=None)
+    return top, best
+
+
+def _search_shard(shm_name: str, n: int, prefixes: List[Tuple[int, int]], settings: Tuple):
+    """Worker: score one shard against the nutrient matrix in shared memory."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        matrix = np.ndarray((n, NUTRIENT_WIDTH), dtype=np.float64, buffer=shm.buf)
+        rows = [tuple(row) for row in matrix.tolist()]
+        del matrix  # release the buffer before closing the mapping
+    finally:
+        shm.close()
+    return search_combinations(rows, prefixes, *settings)
+
+
+# Global instance
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_layer2_pool() -> Optional[ProcessPoolExecutor]:
+    """Get or create the persistent Layer 2 process pool (None when LAYER2_WORKERS < 2)."""
+    global _pool
+    if LAYER2_WORKERS < 2:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: the API process has threads and loaded models that must not be forked
+                _pool = ProcessPoolExecutor(max_workers=LAYER2_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_layer2_pool():
+    """Stop the worker processes (called on application shutdown)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parallel_search_combinations(rows: List[Tuple[float, ...]], min_size: int, max_size: int,
+                                 settings: Tuple, parallelism: Optional[int] = None):
+    """
+    Run search_combinations() over the process pool.
+
+    Args:
+        rows: Nutrient rows of the candidate products (see nutrient_rows())
+        min_size: Smallest combination size
+        max_size: Largest combination size
+        settings: Remaining search_combinations() arguments (targets, weights,
+            max_snacks, max_candidates, score_threshold, calorie_cap, base, stop_at)
+        parallelism: Workers this search may occupy (None = LAYER2_PARALLELISM)
+
+    Returns:
+        The same (top, best) as the serial search, or None when the search should
+        run in-process (too small, parallelism disabled, or the pool is unavailable)
+    """
+    parallelism = LAYER2_PARALLELISM if parallelism is None else parallelism
+    n = len(rows)
+    if parallelism < 2 or n == 0 or count_combinations(n, min_size, max_size) < LAYER2_PARALLEL_MIN_COMBINATIONS:
+        return None
+    pool = get_layer2_pool()
+    if pool is None:
+        return None
+    shards = partition_prefixes(n, min_size, max_size, min(parallelism, LAYER2_WORKERS))
+    if len(shards) < 2:
+        return None
+
+    matrix = np.asarray(rows, dtype=np.float64).reshape(n, NUTRIENT_WIDTH)
+    shm = shared_memory.SharedMemory(create=True, size=matrix.nbytes)
+    try:
+        shared = np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)
+        shared[:] = matrix
+        del shared
+        futures = [pool.submit(_search_shard, shm.name, n, shard, settings) for shard in shards]
+        results = [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        print(f"Layer 2 process pool failed ({e}); searching in-process")
+        shutdown_layer2_pool()
+        return None
+    finally:
+        shm.close()
+        shm.unlink()
+
+    metrics.increment("layer2.parallel_searches")
+    return merge_search_results(results, settings[3])
+
+
+def get_layer2_pool_stats() -> Dict[str, int]:
+    """Pool configuration, for GET /metrics."""
+    return {
+        "workers": LAYER2_WORKERS if _pool is not None else 0,
+        "parallelism_per_request": LAYER2_PARALLELISM,
+        "min_combinations": LAYER2_PARALLEL_MIN_COMBINATIONS,
+    }
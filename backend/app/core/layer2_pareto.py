@@ -0,0 +1,230 @@
+"""
+Price-aware Layer 2: the Pareto front of macro match against total price.
+
+Instead of the single best-scoring bundles, one grid DP pass (the same
+construction as layer2_knapsack, with total price as an extra dimension)
+collects every bundle that no other bundle beats on both score and price
+(and, optionally, on number of snacks):
+
+- partial bundles are bucketed by (snack count, calories, macros, price) and
+  each cell keeps its lowest-score and its cheapest partial bundle
+- a partial bundle is dropped as soon as a bundle already on the front has a
+  score no worse than its score lower bound at no higher price, since adding
+  products can only raise its price and its overage penalties
+- the front is maintained with a sort-based staircase, so merging the bundles
+  completed by one product costs O(m log m)
+
+The recommended bundle is the best-scoring one within the user's budget, or
+the cheapest one when nothing fits. Products without a price count as free.
+"""
+
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.layer2_knapsack import DPGrid, _argmin_per_cell, _cell_ids, _score_arrays, _totals_dict, serving_limits
+from app.db.product_view import ProductView
+
+load_dotenv()
+
+# Optimize price when the request states a budget; optionally prefer fewer snacks as well
+LAYER2_PRICE_AWARE = os.getenv("LAYER2_PRICE_AWARE", "true").lower() == "true"
+LAYER2_PARETO_COUNT_OBJECTIVE = os.getenv("LAYER2_PARETO_COUNT_OBJECTIVE", "false").lower() == "true"
+LAYER2_PRICE_STEP_USD = float(os.getenv("LAYER2_PRICE_STEP_USD", "0.5"))
+
+
+def product_prices(products: List[ProductView]) -> List[float]:
+    """Price per product, with a missing price as 0."""
+    return [float(p.price_usd or 0.0) for p in products]
+
+
+def pareto_indices(scores: np.ndarray, prices: np.ndarray, counts: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Positions of the non-dominated points when minimizing (score, price[, count]).
+
+    Of identical points only the first is kept.
+    """
+    if counts is None:
+        if not len(scores):
+            return np.empty(0, dtype=np.int64)
+        order = np.lexsort((np.arange(len(scores)), scores, prices))
+        running = np.minimum.accumulate(scores[order])
+        keep = np.r_[True, scores[order][1:] < running[:-1]]
+        return np.sort(order[keep])
+
+    # Fewest snacks first: a point must not be dominated by a kept point with fewer snacks
+    kept = np.empty(0, dtype=np.int64)
+    for count in np.unique(counts):
+        level = np.flatnonzero(counts == count)
+        level = level[~_dominated(scores[level], prices[level], scores[kept], prices[kept])]
+        level = level[pareto_indices(scores[level], prices[level])]
+        kept = np.concatenate([kept, level])
+    return np.sort(kept)
+
+
+def _dominated(scores: np.ndarray, prices: np.ndarray, front_scores: np.ndarray, front_prices: np.ndarray) -> np.ndarray:
+    """Whether some front point has score <= and price <= each point."""
+    if not len(front_scores):
+        return np.zeros(len(scores), dtype=bool)
+    order = np.argsort(front_prices, kind="stable")
+    sorted_prices = front_prices[order]
+    best_scores = np.minimum.accumulate(front_scores[order])
+    positions = np.searchsorted(sorted_prices, prices, side="right") - 1
+    dominated = np.zeros(len(scores), dtype=bool)
+    has_cheaper = positions >= 0
+    dominated[has_cheaper] = best_scores[positions[has_cheaper]] <= scores[has_cheaper]
+    return dominated
+
+
+def pareto_search(rows: List[Tuple[float, ...]],
+                  prices: List[float],
+                  min_size: int,
+                  max_size: int,
+                  target_values: Dict[str, float],
+                  weights: Dict[str, float],
+                  calorie_cap: Optional[float],
+                  max_servings: Union[int, Sequence[int]] = 1,
+                  count_objective: bool = False,
+                  grid: Optional[DPGrid] = None,
+                  price_step: float = LAYER2_PRICE_STEP_USD,
+                  base: Optional[Tuple[float, ...]] = None,
+                  base_price: float = 0.0,
+                  stop_at: Optional[float] = None):
+    """
+    Find the Pareto front of bundles over (score, price[, snack count]).
+
+    Args:
+        rows: Nutrient rows of the candidate products (see nutrient_rows())
+        prices: Price of each candidate product
+        min_size: Smallest bundle size
+        max_size: Largest bundle size
+        target_values: Macro targets keyed like the score totals
+        weights: Macro weights of the optimizer
+        calorie_cap: If set, bundles never exceed this many calories
+        max_servings: Servings of one product a bundle may contain, or one limit per row
+        count_objective: Also prefer bundles with fewer snacks
+        grid: Cell sizes (default DPGrid.for_targets(target_values))
+        price_step: Price cell size in USD
+        base: Nutrient row added to every bundle (pinned products)
+        base_price: Price of the pinned products
+        stop_at: time.time() after which no further products are added
+
+    Returns:
+        Front bundles as (score, size, indices, totals, price) tuples, cheapest first
+    """
+    grid = grid or DPGrid.for_targets(target_values)
+    steps = np.array([grid.protein, grid.carbs, grid.fat, grid.electrolytes, grid.calories], dtype=np.float64)
+    steps[steps <= 0] = 1e-9
+    price_step = price_step if price_step > 0 else 1e-9
+    min_size = max(1, min_size)
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+    servings = serving_limits(max_servings, len(rows))
+
+    totals = np.zeros((1, 5)) if base is None else np.array([base], dtype=np.float64)
+    costs = np.full(1, float(base_price))
+    counts = np.zeros(1, dtype=np.int64)
+    scores = np.full(1, np.inf)
+    nodes = np.zeros(1, dtype=np.int64)
+    node_parents = [np.array([-1], dtype=np.int64)]
+    node_products = [np.array([-1], dtype=np.int64)]
+    next_node = 1
+
+    # Front: (score, price, count, node, totals) arrays of complete bundles
+    front_scores = np.empty(0)
+    front_costs = np.empty(0)
+    front_counts = np.empty(0, dtype=np.int64)
+    front_nodes = np.empty(0, dtype=np.int64)
+    front_totals = np.empty((0, 5))
+
+    def dominated_by_front(bound, cost, count):
+        if not count_objective:
+            return _dominated(bound, cost, front_scores, front_costs)
+        dominated = np.zeros(len(bound), dtype=bool)
+        for level in np.unique(front_counts):
+            at_level = front_counts == level
+            reachable = count >= level
+            dominated[reachable] |= _dominated(bound[reachable], cost[reachable],
+                                               front_scores[at_level], front_costs[at_level])
+        return dominated
+
+    price_rows = np.asarray(prices, dtype=np.float64)
+    for i, row in enumerate(rows):
+        if stop_at is not None and time.time() >= stop_at:
+            break
+        added = [(totals, costs, counts, scores, nodes)]
+        step_totals, step_costs, step_counts, step_nodes = totals, costs, counts, nodes
+        for _ in range(servings[i]):
+            step_totals = step_totals + row
+            step_costs = step_costs + price_rows[i]
+            step_counts = step_counts + 1
+            step_scores, bound = _score_arrays(step_totals, target_values, weights)
+            keep = step_counts <= max_size
+            if calorie_cap is not None:
+                keep &= step_totals[:, 4] <= calorie_cap
+            keep &= ~dominated_by_front(bound, step_costs, step_counts)
+            step_totals, step_costs, step_counts, step_scores = (
+                step_totals[keep], step_costs[keep], step_counts[keep], step_scores[keep]
+            )
+            if not len(step_totals):
+                break
+            node_parents.append(step_nodes[keep])
+            node_products.append(np.full(len(step_totals), i, dtype=np.int64))
+            step_nodes = np.arange(next_node, next_node + len(step_totals), dtype=np.int64)
+            next_node += len(step_totals)
+
+            complete = np.flatnonzero(step_counts >= min_size)
+            if len(complete):
+                front_scores = np.concatenate([front_scores, step_scores[complete]])
+                front_costs = np.concatenate([front_costs, step_costs[complete]])
+                front_counts = np.concatenate([front_counts, step_counts[complete]])
+                front_nodes = np.concatenate([front_nodes, step_nodes[complete]])
+                front_totals = np.concatenate([front_totals, step_totals[complete]])
+                kept = pareto_indices(front_scores, front_costs, front_counts if count_objective else None)
+                front_scores, front_costs, front_counts = front_scores[kept], front_costs[kept], front_counts[kept]
+                front_nodes, front_totals = front_nodes[kept], front_totals[kept]
+
+            added.append((step_totals, step_costs, step_counts, step_scores, step_nodes))
+
+        if len(added) == 1:
+            continue
+
+        # Keep the lowest-score and the cheapest partial bundle of every cell
+        totals = np.concatenate([a[0] for a in added])
+        costs = np.concatenate([a[1] for a in added])
+        counts = np.concatenate([a[2] for a in added])
+        scores = np.concatenate([a[3] for a in added])
+        nodes = np.concatenate([a[4] for a in added])
+        bins = np.column_stack([(totals / steps).astype(np.int64), (costs / price_step).astype(np.int64)])
+        cells = _cell_ids(counts, bins)
+        order = np.argsort(cells)
+        keep = np.zeros(len(cells), dtype=bool)
+        keep[_argmin_per_cell(cells, order, scores)] = True
+        keep[_argmin_per_cell(cells, order, costs)] = True
+        winners = np.flatnonzero(keep)
+        totals, costs, counts, scores, nodes = totals[winners], costs[winners], counts[winners], scores[winners], nodes[winners]
+
+    parents = np.concatenate(node_parents)
+    products = np.concatenate(node_products)
+
+    def bundle(score, cost, count, node, bundle_totals):
+        indices = []
+        while node > 0:
+            indices.append(int(products[node]))
+            node = parents[node]
+        return (float(score), int(count), tuple(reversed(indices)), _totals_dict(bundle_totals), float(cost))
+
+    front = [bundle(*point) for point in zip(front_scores, front_costs, front_counts, front_nodes, front_totals)]
+    return sorted(front, key=lambda c: (c[4], c[0], c[1], c[2]))
+
+
+def select_for_budget(front: List[tuple], budget: Optional[float]) -> Optional[tuple]:
+    """The best-scoring front bundle within the budget (any price if None), else the cheapest one."""
+    if not front:
+        return None
+    affordable = [c for c in front if budget is None or c[4] <= budget + 1e-9]
+    if not affordable:
+        return min(front, key=lambda c: (c[4], c[0]))
+    return min(affordable, key=lambda c: (c[0], c[4], c[1]))
@@ -0,0 +1,215 @@
+"""
+Candidate reduction before the Layer 2 search.
+
+Layer 1 often hands Layer 2 flavor variants with identical nutrient vectors and
+products that another candidate beats on every macro. Both inflate C(n, k)
+without adding any bundle worth returning, so before the search:
+
+- products with the same (protein, carbs, fat, electrolytes, calories) are
+  collapsed into one equivalence class, searched as a single product that a
+  bundle may hold as often as its members together (m members supply up to
+  m * max_servings servings)
+- products over the calorie cap on their own are dropped
+- dominated classes are dropped: A dominates B when A has no more calories and
+  swapping B for A never worsens any macro's penalty, whatever the rest of the
+  bundle holds (see dominance_matrix())
+
+When price is an objective (layer2_pareto), the price is part of the class key
+and A must also cost no more than B.
+
+A class is only dropped when its kept dominators supply more servings than the
+rest of a bundle can hold, so every bundle using it can swap it for a kept
+dominator without a worse score; the best score is therefore unchanged. Results
+are mapped back to concrete products by rotating through the members of each
+class from a random starting member, so the servings of a class are distinct
+flavor variants first and still vary between requests.
+
+Searches that take every product at most once (exhaustive, simple) search
+copies() instead: each representative once per member, up to the bundle size.
+
+Set LAYER2_REDUCE_CANDIDATES=false to search the candidates as given.
+"""
+
+import os
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.layer2_knapsack import serving_limits
+from app.core.layer2_macro_optimization import CombinationResult, MacroTargets, _target_values, nutrient_rows, score_totals
+from app.db.product_view import ProductView
+
+load_dotenv()
+
+LAYER2_REDUCE_CANDIDATES = os.getenv("LAYER2_REDUCE_CANDIDATES", "true").lower() == "true"
+
+MACROS = ("protein", "carbs", "fat", "electrolytes")
+
+
+@dataclass
+class CandidateReduction:
+    """Reduced Layer 2 problem: one representative product per kept equivalence class."""
+    representatives: List[ProductView]
+    classes: List[List[ProductView]]
+    # Servings a bundle may hold of each representative (its members' servings, up to the bundle size)
+    servings: List[int]
+    stats: Dict[str, int] = field(default_factory=dict)
+
+    def copies(self, max_size: int) -> List[ProductView]:
+        """Representatives repeated once per member (up to max_size), for searches without repeated servings."""
+        return [rep for rep, members in zip(self.representatives, self.classes)
+                for _ in range(min(len(members), max(1, max_size)))]
+
+    def expand(self, combination: List[ProductView], rng: Optional[random.Random] = None) -> List[ProductView]:
+        """Replace representatives by concrete class members (servings rotate through distinct members)."""
+        members_of = {id(rep): members for rep, members in zip(self.representatives, self.classes)}
+        offsets: Dict[int, int] = {}
+        seen: Counter = Counter()
+        expanded = []
+        for product in combination:
+            members = members_of.get(id(product))
+            if not members or len(members) == 1:
+                expanded.append(product)
+                continue
+            key = id(product)
+            if key not in offsets:
+                offsets[key] = (rng or random).randrange(len(members))
+            expanded.append(members[(offsets[key] + seen[key]) % len(members)])
+            seen[key] += 1
+        return expanded
+
+    def apply(self, result: Optional[CombinationResult], rng: Optional[random.Random] = None) -> Optional[CombinationResult]:
+        """Map a result on the representatives back to concrete products and attach the stats."""
+        if result is None:
+            return None
+        selected = None
+        for candidate in result.top_candidates:
+            chosen = candidate['combination'] is result.products
+            candidate['combination'] = self.expand(candidate['combination'], rng)
+            if chosen:
+                selected = candidate['combination']
+        result.products = selected if selected is not None else self.expand(result.products, rng)
+        result.pruning = dict(self.stats)
+        return result
+
+
+def dominance_matrix(rows: np.ndarray, target_values: Dict[str, float], weights: Dict[str, float],
+                     max_snacks: int, max_size: int, max_servings: Union[int, Sequence[int]] = 1,
+                     base: Optional[tuple] = None, prices: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    dominates[a, b]: swapping product b for product a never makes a bundle worse.
+
+    The penalty f of a macro is convex in the bundle total (V-shaped around a
+    target) or a step (no target), so for the rest R of the bundle the change
+    f(R + a) - f(R + b) is monotone in R and only has to be checked at R = 0 (or
+    the pinned products' total) and at the largest total the other max_size - 1
+    servings can add to it.
+
+    Args:
+        rows: (n, 5) nutrient rows (see nutrient_rows())
+        target_values: Macro targets keyed like the score totals
+        weights: Macro weights of the optimizer
+        max_snacks: Snack limit of the score
+        max_size: Largest bundle size
+        max_servings: Servings of one product a bundle may contain, or one limit per row
+        base: Nutrient row of products pinned into every bundle
+        prices: Price per product, if a dominator must also be no more expensive
+    """
+    n = len(rows)
+    base = base or (0.0,) * 5
+    servings = serving_limits(max_servings, n)
+    keys = []
+    for j, macro in enumerate(MACROS):
+        column = rows[:, j]
+        others = np.sort(np.repeat(column, servings))[::-1][:max(0, max_size - 1)].sum()
+        for rest in (base[j], base[j] + others):
+            keys.append([
+                score_totals({macro: rest + value}, target_values, weights, max_snacks, 0)
+                for value in column.tolist()
+            ])
+    keys.append(rows[:, 4].tolist())  # calories
+    if prices is not None:
+        keys.append(list(prices))
+    keys = np.array(keys).T.reshape(n, -1)
+    dominates = np.all(keys[:, None, :] <= keys[None, :, :], axis=2)
+    np.fill_diagonal(dominates, False)
+    return dominates
+
+
+def reduce_candidates(products: List[ProductView],
+                      targets: MacroTargets,
+                      weights: Dict[str, float],
+                      max_snacks: int,
+                      max_size: int,
+                      calorie_cap: Optional[float] = None,
+                      max_servings: int = 1,
+                      base: Optional[tuple] = None,
+                      prices: Optional[List[float]] = None) -> CandidateReduction:
+    """
+    Collapse identical nutrient vectors and drop dominated products.
+
+    Args:
+        products: Candidate products from Layer 1
+        targets: Macro targets of the search
+        weights: Macro weights of the optimizer
+        max_snacks: Snack limit of the score
+        max_size: Largest bundle size
+        calorie_cap: If set, bundles never exceed this many calories
+        max_servings: Servings of one product a bundle may contain
+        base: Nutrient row of products pinned into every bundle (see pinned_totals())
+        prices: Price per product when price is an objective
+
+    Returns:
+        CandidateReduction whose representatives keep the order of first appearance,
+        each with the servings limit of its whole class
+    """
+    classes: Dict[tuple, List[ProductView]] = {}
+    keys = nutrient_rows(products)
+    if prices is not None:
+        keys = [row + (float(price),) for row, price in zip(keys, prices)]
+    for product, key in zip(products, keys):
+        classes.setdefault(key, []).append(product)
+
+    equivalence_classes = len(classes)
+    room = None if calorie_cap is None else calorie_cap - (base[4] if base else 0.0)
+    over_cap = [row for row in classes if room is not None and row[4] > room]
+    over_cap_products = sum(len(classes[row]) for row in over_cap)
+    for row in over_cap:
+        del classes[row]
+
+    rows = list(classes)
+    max_size = max(1, max_size)
+    limits = np.array([min(len(classes[row]) * max(1, max_servings), max_size) for row in rows], dtype=np.int64)
+    dominated = 0
+    if len(rows) > 1:
+        keys = np.array(rows, dtype=np.float64)
+        dominates = dominance_matrix(keys[:, :5], _target_values(targets), weights, max_snacks, max_size,
+                                     limits, base, keys[:, 5] if prices is not None else None)
+        kept = np.ones(len(rows), dtype=bool)
+        # Strongest first, so dominators are decided before the products they dominate
+        for b in np.argsort(-dominates.sum(axis=1), kind="stable"):
+            # The other max_size - 1 servings of a bundle cannot fill every kept dominator
+            if limits[dominates[:, b] & kept].sum() >= max_size:
+                kept[b] = False
+        dominated = sum(len(classes[row]) for row, keep in zip(rows, kept) if not keep)
+        rows = [row for row, keep in zip(rows, kept) if keep]
+        limits = limits[kept]
+
+    members = [classes[row] for row in rows]
+    return CandidateReduction(
+        representatives=[group[0] for group in members],
+        classes=members,
+        servings=limits.tolist(),
+        stats={
+            'candidates': len(products),
+            'equivalence_classes': equivalence_classes,
+            'duplicates_collapsed': len(products) - equivalence_classes,
+            'over_calorie_cap': over_cap_products,
+            'dominated': dominated,
+            'searched': len(rows),
+        }
+    )
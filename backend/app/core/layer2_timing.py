@@ -0,0 +1,178 @@
+"""
+Timing-aware Layer 2: split a bundle into pre-, during- and post-workout snacks.
+
+Macro targeting computes separate pre/during/post workout targets, but the
+bundle search matches only their sums. Searching bundles for the three slots
+jointly would multiply the search space by 3^k, so the problem is decomposed:
+
+1. the usual bundle search on the summed targets keeps a larger pool of
+   near-optimal bundles (LAYER2_TIMING_POOL_FACTOR x max_candidates)
+2. each pooled bundle (at most max_snacks products) gets its best assignment of
+   products to slots, scored against every slot's targets at once; all 3^k
+   assignments are scored with one vectorized pass
+3. bundles are re-ranked by that timing score and the result is drawn from the
+   best max_candidates as usual
+
+A product can go to the slots named in its timing_suitability ("pre-workout",
+"during-workout"/"intra-workout"/"long-session", "post-workout"); products
+suitable "anytime" or without any of these tags can go anywhere.
+"""
+
+import itertools
+import os
+import random
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.layer2_knapsack import _score_arrays
+from app.core.layer2_macro_optimization import (
+    CombinationResult, MacroTargets, _target_values, nutrient_rows, pick_from_candidates
+)
+from app.db.product_view import ProductView
+
+load_dotenv()
+
+LAYER2_TIMING_POOL_FACTOR = int(os.getenv("LAYER2_TIMING_POOL_FACTOR", "3"))
+
+# Bundles up to this size try every assignment; larger ones are assigned greedily
+EXACT_ASSIGNMENT_MAX_PRODUCTS = 10
+
+SLOTS = ("pre_workout", "during_workout", "post_workout")
+SLOT_TAGS = {
+    "pre_workout": {"pre-workout"},
+    "during_workout": {"during-workout", "intra-workout", "long-session"},
+    "post_workout": {"post-workout"},
+}
+ANYTIME_TAGS = {"anytime"}
+
+
+def slot_targets_from_macro_target(macro_target) -> Optional[Dict[str, MacroTargets]]:
+    """Per-slot MacroTargets from a MacroTarget's timing breakdown (None when it has none)."""
+    breakdown = {
+        "pre_workout": getattr(macro_target, "pre_workout_macros", None),
+        "during_workout": getattr(macro_target, "during_workout_macros", None),
+        "post_workout": getattr(macro_target, "post_workout_macros", None),
+    }
+    if not any(breakdown.values()):
+        return None
+    return {
+        slot: MacroTargets(
+            target_protein_g=(macros or {}).get("protein") or 0.0,
+            target_carbs_g=(macros or {}).get("carbs") or 0.0,
+            target_fat_g=(macros or {}).get("fat") or 0.0,
+            target_electrolytes_mg=(macros or {}).get("electrolytes") or 0.0,
+        )
+        for slot, macros in breakdown.items()
+    }
+
+
+def eligible_slots(product: ProductView) -> Tuple[bool, bool, bool]:
+    """Whether the product may go to each slot of SLOTS."""
+    tags = {tag.strip().lower() for tag in product.timing_suitability or ()}
+    specific = tuple(bool(tags & SLOT_TAGS[slot]) for slot in SLOTS)
+    if tags & ANYTIME_TAGS or not any(specific):
+        return (True, True, True)
+    return specific
+
+
+@lru_cache(maxsize=None)
+def _assignments(count: int) -> np.ndarray:
+    """Every assignment of `count` products to the slots, shape (3^count, count)."""
+    return np.array(list(itertools.product(range(len(SLOTS)), repeat=count)), dtype=np.int8).reshape(-1, count)
+
+
+def _slot_scores(assignments: np.ndarray, rows: np.ndarray, slot_values: List[Dict[str, float]],
+                 weights: Dict[str, float]) -> np.ndarray:
+    scores = np.zeros(len(assignments))
+    for s, target_values in enumerate(slot_values):
+        totals = (assignments == s).astype(np.float64) @ rows
+        slot_score, _ = _score_arrays(totals, target_values, weights)
+        scores += slot_score
+    return scores
+
+
+def best_slot_assignment(products: List[ProductView], slot_targets: Dict[str, MacroTargets],
+                         weights: Dict[str, float]) -> Tuple[float, Tuple[int, ...]]:
+    """
+    Assign each product of a bundle to a slot so the slots match their targets best.
+
+    Args:
+        products: Products of the bundle
+        slot_targets: MacroTargets per slot of SLOTS
+        weights: Macro weights of the optimizer
+
+    Returns:
+        (timing score, slot index per product); the score is the sum of the
+        slots' scores, inf if a product fits no slot
+    """
+    if not products:
+        return 0.0, ()
+    rows = np.array(nutrient_rows(products), dtype=np.float64)
+    allowed = np.array([eligible_slots(p) for p in products])
+    slot_values = [_target_values(slot_targets[slot]) for slot in SLOTS]
+
+    if len(products) <= EXACT_ASSIGNMENT_MAX_PRODUCTS:
+        assignments = _assignments(len(products))
+        scores = _slot_scores(assignments, rows, slot_values, weights)
+        scores[~allowed[np.arange(len(products)), assignments].all(axis=1)] = np.inf
+        best = int(np.argmin(scores))
+        return float(scores[best]), tuple(int(s) for s in assignments[best])
+
+    # Greedy coordinate descent: move one product at a time to its best slot
+    assignment = np.argmax(allowed, axis=1).astype(np.int8)
+    for _ in range(2):
+        for i in range(len(products)):
+            options = np.repeat(assignment[None, :], len(SLOTS), axis=0)
+            options[:, i] = np.arange(len(SLOTS))
+            scores = _slot_scores(options, rows, slot_values, weights)
+            scores[~allowed[i]] = np.inf
+            assignment[i] = int(np.argmin(scores))
+    score = _slot_scores(assignment[None, :], rows, slot_values, weights)[0]
+    return float(score), tuple(int(s) for s in assignment)
+
+
+def _annotate(candidate: Dict[str, Any], slot_targets: Dict[str, MacroTargets], weights: Dict[str, float]):
+    score, assignment = best_slot_assignment(candidate['combination'], slot_targets, weights)
+    candidate['timing_score'] = score
+    candidate['slots'] = {
+        slot: [p for p, s in zip(candidate['combination'], assignment) if s == index]
+        for index, slot in enumerate(SLOTS)
+    }
+
+
+def assign_timing_slots(result: Optional[CombinationResult], slot_targets: Dict[str, MacroTargets],
+                        weights: Dict[str, float], max_candidates: int,
+                        rng: Optional[random.Random] = None) -> Optional[CombinationResult]:
+    """
+    Re-rank a result's bundles by how well they split into the timing slots.
+
+    Args:
+        result: Optimization result (its candidate_pool, else its top_candidates)
+        slot_targets: MacroTargets per slot of SLOTS
+        weights: Macro weights of the optimizer
+        max_candidates: Bundles the selected one is drawn from
+        rng: Random generator of the request (None = the global one)
+
+    Returns:
+        A result drawn from the max_candidates bundles with the best timing score,
+        with timing_slots filled in
+    """
+    if result is None:
+        return None
+    pool = result.candidate_pool or result.top_candidates
+    if not pool:
+        candidate = {'combination': result.products}
+        _annotate(candidate, slot_targets, weights)
+        result.timing_slots = candidate['slots']
+        return result
+
+    for candidate in pool:
+        _annotate(candidate, slot_targets, weights)
+    pool = sorted(pool, key=lambda c: c['timing_score'])
+    picked = pick_from_candidates(pool[:max_candidates], result.algorithm_used, rng)
+    picked.pruning = result.pruning
+    picked.candidate_pool = pool if len(pool) > max_candidates else []
+    return picked
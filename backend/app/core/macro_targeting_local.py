@@ -13,7 +13,6 @@ import json
 import yaml
 from typing import Dict, Optional, Tuple, Any, List
 import random
-import gc
 from pathlib import Path
 from langchain_chroma import Chroma
 from langchain.schema import SystemMessage, HumanMessage
@@ -24,6 +23,9 @@ from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
 from app.db.models import UserInput, MacroTarget
+from app.db.session import save_rows
+from app.core.memory_policy import checkpoint
+from app.core.deadline import DEADLINE_LLM_SECONDS, Deadline, call_before
 
 load_dotenv()
 
@@ -133,15 +135,6 @@ class MacroTargetingServiceLocal:
                     # Clear batch variables to free memory
                     del batch_embeddings
                 
-                # Clear model reference and force cleanup
-                self.model = None
-                import gc
-                gc.collect()
-                
-                # Clear CUDA cache if available
-                if hasattr(torch.cuda, 'empty_cache'):
-                    torch.cuda.empty_cache()
-                
                 return all_embeddings
             
             def embed_query(self, text):
@@ -152,15 +145,6 @@ class MacroTargetingServiceLocal:
                 with torch.no_grad():
                     embedding = model.encode([text])
                 
-                # Clear model reference and force cleanup
-                self.model = None
-                import gc
-                gc.collect()
-                
-                # Clear CUDA cache if available
-                if hasattr(torch.cuda, 'empty_cache'):
-                    torch.cuda.empty_cache()
-                
                 return embedding.tolist()[0]
         
         return GlobalSentenceTransformerEmbeddings()
@@ -221,14 +205,7 @@ class MacroTargetingServiceLocal:
                 # Add batch to documents and clear batch to free memory
                 documents.extend(batch_docs)
                 batch_docs.clear()
-                
-                # Force garbage collection after each batch
-                import gc
-                gc.collect()
-                
-                # Small delay to allow memory cleanup
-                import time
-                time.sleep(0.05)  # Reduced delay since we're doing explicit GC
+                checkpoint()
         
         print(f"Total documents loaded: {len(documents)}")
         for i, doc in enumerate(documents):
@@ -301,8 +278,7 @@ class MacroTargetingServiceLocal:
             
             # Clear debug results to free memory
             del all_results
-            import gc
-            gc.collect()
+            checkpoint()
         except Exception as e:
             print(f"Error getting all documents after creation: {e}")
     
@@ -356,7 +332,7 @@ class MacroTargetingServiceLocal:
         else:
             return exercise_type_lower
     
-    def retrieve_context_by_metadata(self, user_input: UserInput) -> str:
+    def retrieve_context_by_metadata(self, user_input: UserInput, deadline: Optional[Deadline] = None) -> str:
         """Retrieve context using metadata-based filtering."""
         # Extract metadata from user input
         age_group = self._get_age_group_from_age(user_input.age) if user_input.age else None
@@ -386,8 +362,6 @@ class MacroTargetingServiceLocal:
                 
                 # Clear debug results to free memory
                 del all_results
-                import gc
-                gc.collect()
             except Exception as e:
                 print(f"Error getting all documents: {e}")
             
@@ -413,12 +387,7 @@ class MacroTargetingServiceLocal:
                     # Store result and clear results object to free memory
                     result_content = results['documents'][0]
                     del results
-                    gc.collect()
-                    
-                    # Clear PyTorch memory
-                    import torch
-                    if hasattr(torch.cuda, 'empty_cache'):
-                        torch.cuda.empty_cache()
+                    checkpoint()
                     
                     return result_content
             except Exception as e:
@@ -426,10 +395,14 @@ class MacroTargetingServiceLocal:
         
         # Fallback to vector search if no exact match
         print("No exact metadata match found, falling back to vector search")
-        return self.retrieve_context_fallback(user_input)
+        return self.retrieve_context_fallback(user_input, deadline)
     
-    def retrieve_context_fallback(self, user_input: UserInput) -> str:
-        """Fallback to vector search when metadata matching fails."""
+    def retrieve_context_fallback(self, user_input: UserInput, deadline: Optional[Deadline] = None) -> str:
+        """Fallback to vector search when metadata matching fails (skipped once the deadline has passed)."""
+        if deadline is not None and deadline.expired():
+            deadline.degrade("retrieval", "skipped the guideline search, so macro targets use rule-based defaults")
+            return "No relevant nutrition guidelines found."
+
         # Build a query for vector search
         query_parts = []
         if user_input.age:
@@ -454,13 +427,7 @@ class MacroTargetingServiceLocal:
             # Store result and clear results object to free memory
             result_content = results[0].page_content
             del results
-            import gc
-            gc.collect()
-            
-            # Clear PyTorch memory
-            import torch
-            if hasattr(torch.cuda, 'empty_cache'):
-                torch.cuda.empty_cache()
+            checkpoint()
             
             return result_content
         else:
@@ -479,8 +446,7 @@ class MacroTargetingServiceLocal:
         
         # Clear results object to free memory
         del results
-        import gc
-        gc.collect()
+        checkpoint()
         
         return "\n\n".join(formatted_results)
     
@@ -852,18 +818,19 @@ class MacroTargetingServiceLocal:
         
         return macro_values
     
-    def generate_macro_targets(self, user_input: UserInput) -> MacroTarget:
+    def generate_macro_targets(self, user_input: UserInput, deadline: Optional[Deadline] = None) -> MacroTarget:
         """
         Generate macro targets for a user input using local RAG pipeline.
         
         Args:
             user_input: UserInput object with user context
+            deadline: Request deadline (guideline retrieval is skipped once it has passed)
             
         Returns:
             MacroTarget object with generated recommendations
         """
         # Retrieve relevant context using metadata-based filtering
-        context = self.retrieve_context_by_metadata(user_input)
+        context = self.retrieve_context_by_metadata(user_input, deadline)
         
         # Extract macro recommendations from context using YAML-based calculation
         macro_values = self._extract_macro_values_from_context(context, user_input)
@@ -963,12 +930,14 @@ class MacroTargetingServiceLocal:
         Returns:
             MacroTarget object
         """
+        # Generate before touching the database: the write transaction stays short
+        new_target = self.generate_macro_targets(user_input)
+        
         # Check if macro targets already exist
         existing_target = self.get_macro_targets_for_user(user_input.id, db)
         
         if existing_target:
             # Update existing target
-            new_target = self.generate_macro_targets(user_input)
             existing_target.target_calories = new_target.target_calories
             existing_target.target_protein = new_target.target_protein
             existing_target.target_carbs = new_target.target_carbs
@@ -983,57 +952,62 @@ class MacroTargetingServiceLocal:
             return existing_target
         else:
             # Create new target
-            macro_target = self.generate_macro_targets(user_input)
+            macro_target = new_target
             db.add(macro_target)
-            db.commit()
+            db.flush()
             db.refresh(macro_target)
+            db.commit()
             return macro_target
 
-    def generate_macro_targets_from_query(self, user_query: str, db: Session) -> Tuple[UserInput, MacroTarget]:
+    def generate_macro_targets_from_query(self, user_query: str, db: Optional[Session],
+                                          deadline: Optional[Deadline] = None) -> Tuple[UserInput, MacroTarget]:
         """
         Main integration method: Extract fields from user query and generate macro targets.
         
         Args:
             user_query: Natural language user query
-            db: Database session
+            db: Database session to save both objects with (None = the caller saves them,
+                e.g. through an AsyncSession; the macro target is linked to the user input)
+            deadline: Request deadline passed to the extraction and retrieval
             
         Returns:
             Tuple of (UserInput, MacroTarget) objects
         """
         # Step 1: Extract structured fields from user query using LLM
-        extracted_fields = self.extract_fields_from_query(user_query)
+        extracted_fields = self.extract_fields_from_query(user_query, deadline)
         
         # Step 2: Convert extracted fields to UserInput format
         user_input_data = self._convert_extracted_fields_to_user_input(extracted_fields, user_query)
         
-        # Step 3: Create UserInput object and save to database
+        # Step 3: Create UserInput object
         user_input = UserInput(**user_input_data)
-        db.add(user_input)
-        db.commit()
-        db.refresh(user_input)
         
         # Step 4: Generate macro targets using the enhanced pipeline
-        macro_target = self.generate_macro_targets_enhanced(user_input, extracted_fields)
-        macro_target.user_input_id = user_input.id
-        db.add(macro_target)
-        db.commit()
-        db.refresh(macro_target)
+        macro_target = self.generate_macro_targets_enhanced(user_input, extracted_fields, deadline)
+        
+        macro_target.user_input = user_input
+        
+        # Step 5: Save both in one short write transaction (nothing slow holds the writer)
+        if db is not None:
+            save_rows(db, user_input, macro_target)
         
         return user_input, macro_target
     
-    def generate_macro_targets_enhanced(self, user_input: UserInput, extracted_fields: Optional[Dict[str, Any]] = None) -> MacroTarget:
+    def generate_macro_targets_enhanced(self, user_input: UserInput, extracted_fields: Optional[Dict[str, Any]] = None,
+                                        deadline: Optional[Deadline] = None) -> MacroTarget:
         """
         Enhanced macro target generation that incorporates LLM-extracted preferences.
         
         Args:
             user_input: UserInput object with user context
             extracted_fields: Optional extracted fields from LLM (for enhanced reasoning)
+            deadline: Request deadline (guideline retrieval is skipped once it has passed)
             
         Returns:
             MacroTarget object with generated recommendations
         """
         # Retrieve relevant context using metadata-based filtering (unchanged)
-        context = self.retrieve_context_by_metadata(user_input)
+        context = self.retrieve_context_by_metadata(user_input, deadline)
         
         # Extract macro recommendations from context using YAML-based calculation (unchanged)
         macro_values = self._extract_macro_values_from_context(context, user_input)
@@ -1116,13 +1090,13 @@ class MacroTargetingServiceLocal:
         
         return macro_target
 
-    def get_context_and_macro_targets(self, user_input: UserInput):
+    def get_context_and_macro_targets(self, user_input: UserInput, deadline: Optional[Deadline] = None):
         """
         Retrieve the RAG context and compute macro targets for a user input.
         Returns (context, macro_target)
         """
         # Retrieve relevant context using metadata-based filtering
-        context, retrieved_metadata = self.retrieve_context_by_metadata_with_metadata(user_input)
+        context, retrieved_metadata = self.retrieve_context_by_metadata_with_metadata(user_input, deadline)
         
         # Check if the retrieved context has "strength" in its metadata
         # and add "high-protein" as a soft preference if so
@@ -1145,10 +1119,11 @@ class MacroTargetingServiceLocal:
                 print(f"[DEBUG] Added high-protein soft preference due to strength activity detection")
         
         # Generate macro targets
-        macro_target = self.generate_macro_targets(user_input)
+        macro_target = self.generate_macro_targets(user_input, deadline)
         return context, macro_target
 
-    def retrieve_context_by_metadata_with_metadata(self, user_input: UserInput) -> Tuple[str, Optional[Dict[str, Any]]]:
+    def retrieve_context_by_metadata_with_metadata(self, user_input: UserInput,
+                                                   deadline: Optional[Deadline] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
         """Retrieve context using metadata-based filtering and return both context and metadata."""
         # Extract metadata from user input
         age_group = self._get_age_group_from_age(user_input.age) if user_input.age else None
@@ -1204,7 +1179,7 @@ class MacroTargetingServiceLocal:
         
         # Fallback to vector search if no exact match
         print("No exact metadata match found, falling back to vector search")
-        return self.retrieve_context_fallback(user_input), None
+        return self.retrieve_context_fallback(user_input, deadline), None
 
     def _detect_strength_in_retrieved_metadata(self, retrieved_metadata: Optional[Dict[str, Any]], user_input: UserInput) -> bool:
         """
@@ -1234,7 +1209,8 @@ class MacroTargetingServiceLocal:
         
         return False
 
-    def extract_key_principles(self, context: str, num_principles: int = 2) -> List[str]:
+    def extract_key_principles(self, context: str, num_principles: int = 2,
+                               rng: Optional[random.Random] = None) -> List[str]:
         """
         Extract key principles from the knowledge document context.
         Specifically targets the key_principles: section and returns random principles.
@@ -1242,6 +1218,7 @@ class MacroTargetingServiceLocal:
         Args:
             context: The knowledge document content
             num_principles: Number of principles to extract (default: 2)
+            rng: Random generator of the request (None = the global one)
             
         Returns:
             List of key principles as strings
@@ -1279,16 +1256,18 @@ class MacroTargetingServiceLocal:
         
         # Return random selection if we have more than requested
         if len(principles) > num_principles:
-            return random.sample(principles, num_principles)
+            return (rng or random).sample(principles, num_principles)
         else:
             return principles[:num_principles]
     
-    def extract_fields_from_query(self, user_query: str) -> Dict[str, Any]:
+    def extract_fields_from_query(self, user_query: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         Extract structured fields from user query using OpenAI LLM.
         
         Args:
             user_query: Natural language user query
+            deadline: Request deadline; without time for the LLM (DEADLINE_LLM_SECONDS),
+                or if it does not answer before the deadline, the fallback extraction is used
             
         Returns:
             Dict with extracted fields in the expected format
@@ -1296,6 +1275,9 @@ class MacroTargetingServiceLocal:
         if not self.llm:
             print("No LLM available, using fallback field extraction")
             return self._fallback_field_extraction(user_query)
+        if deadline is not None and not deadline.allows(DEADLINE_LLM_SECONDS):
+            deadline.degrade("extraction", "used rule-based query extraction instead of the LLM")
+            return self._fallback_field_extraction(user_query)
         
         system_prompt = """You're an API that extracts structured nutrition planning fields from a user query.
 
@@ -1378,7 +1360,7 @@ Normalization rules / notes:
                 HumanMessage(content=human_prompt)
             ]
             
-            response = self.llm.invoke(messages)
+            response = self.llm.invoke(messages) if deadline is None else call_before(deadline, self.llm.invoke, messages)
             
             # Handle markdown code blocks in LLM response
             content = response.content.strip()
@@ -1394,6 +1376,12 @@ Normalization rules / notes:
             print(f"[DEBUG] LLM extracted fields: {extracted_data}")
             return extracted_data
             
+        except TimeoutError as e:
+            if deadline is not None:
+                deadline.degrade("extraction", "the LLM did not answer in time, so the query was parsed rule-based")
+            else:
+                print(f"Error in LLM field extraction: {e}")
+            return self._fallback_field_extraction(user_query)
         except Exception as e:
             print(f"Error in LLM field extraction: {e}")
             return self._fallback_field_extraction(user_query)
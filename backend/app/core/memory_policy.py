@@ -0,0 +1,211 @@
+"""
+Memory management policy for the embedding and retrieval layers.
+
+The embedding wrappers and retrieval helpers used to call gc.collect() and
+torch.cuda.empty_cache() on every call. With torch and chromadb loaded a full
+collection walks a very large heap, so that cost was paid on every request.
+This module replaces those calls with a single, configurable policy that
+amortizes the work. Hot paths call checkpoint(); the policy decides whether
+anything actually happens.
+
+Policies (MEMORY_POLICY environment variable):
+- none: never collect explicitly, rely on CPython's generational GC
+- periodic: full collection every MEMORY_GC_EVERY_N checkpoints (default)
+- threshold: raise the automatic GC thresholds (MEMORY_GC_THRESHOLDS) so young
+  collections run less often; checkpoints are free
+- rss: trim memory (gc + malloc_trim + CUDA cache) only when resident memory
+  exceeds MEMORY_RSS_LIMIT_MB, checked at most every MEMORY_RSS_CHECK_SECONDS
+
+Independently of the policy, MEMORY_GC_FREEZE=true moves every object alive
+after warmup (model weights, Chroma clients, imported modules) into the
+permanent generation with gc.freeze(), so later collections skip them.
+
+See tests/utils/benchmark_memory_policy.py for the latency impact of each option.
+"""
+
+import gc
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POLICIES = ("none", "periodic", "threshold", "rss")
+
+
+def current_rss_mb() -> float:
+    """Return the resident set size of this process in MB (0.0 if unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Peak RSS is the best we can do without /proc; KB on Linux, bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+    except (ImportError, ValueError):
+        return 0.0
+
+
+def _malloc_trim() -> bool:
+    """Return freed heap pages to the OS (glibc only)."""
+    try:
+        import ctypes
+        return bool(ctypes.CDLL("libc.so.6").malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+
+def _empty_cuda_cache():
+    """Release cached CUDA blocks if torch is already imported and CUDA is in use."""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _parse_thresholds(value: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in value.split(",") if part.strip())
+
+
+@dataclass
+class MemoryPolicyStats:
+    """Counters describing what the policy has done so far."""
+    checkpoints: int = 0
+    collections: int = 0
+    trims: int = 0
+    total_pause_ms: float = 0.0
+    last_rss_mb: float = 0.0
+    frozen_objects: int = 0
+
+
+class MemoryPolicy:
+    """Amortized replacement for per-call gc.collect()."""
+
+    def __init__(self,
+                 policy: str = "periodic",
+                 gc_every_n: int = 200,
+                 gc_thresholds: Optional[Tuple[int, ...]] = None,
+                 rss_limit_mb: float = 1500.0,
+                 rss_check_seconds: float = 5.0,
+                 freeze_after_warmup: bool = True):
+        """
+        Args:
+            policy: One of "none", "periodic", "threshold", "rss"
+            gc_every_n: Checkpoints between full collections (periodic policy)
+            gc_thresholds: Values passed to gc.set_threshold() (threshold policy)
+            rss_limit_mb: Resident memory above which the rss policy trims
+            rss_check_seconds: Minimum interval between RSS reads (rss policy)
+            freeze_after_warmup: Whether freeze_after_warmup() calls gc.freeze()
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown memory policy '{policy}', expected one of {POLICIES}")
+        self.policy = policy
+        self.gc_every_n = max(1, gc_every_n)
+        self.gc_thresholds = gc_thresholds or (50000, 20, 100)
+        self.rss_limit_mb = rss_limit_mb
+        self.rss_check_seconds = rss_check_seconds
+        self.freeze_enabled = freeze_after_warmup
+        self.stats = MemoryPolicyStats()
+        self._lock = threading.Lock()
+        self._last_rss_check = 0.0
+        self._frozen = False
+        self._default_thresholds = gc.get_threshold()
+
+        if self.policy == "threshold":
+            gc.set_threshold(*self.gc_thresholds)
+
+    @classmethod
+    def from_env(cls) -> "MemoryPolicy":
+        """Build a policy from MEMORY_* environment variables."""
+        return cls(
+            policy=os.getenv("MEMORY_POLICY", "periodic").lower(),
+            gc_every_n=int(os.getenv("MEMORY_GC_EVERY_N", "200")),
+            gc_thresholds=_parse_thresholds(os.getenv("MEMORY_GC_THRESHOLDS", "50000,20,100")),
+            rss_limit_mb=float(os.getenv("MEMORY_RSS_LIMIT_MB", "1500")),
+            rss_check_seconds=float(os.getenv("MEMORY_RSS_CHECK_SECONDS", "5")),
+            freeze_after_warmup=os.getenv("MEMORY_GC_FREEZE", "true").lower() == "true",
+        )
+
+    def checkpoint(self):
+        """
+        Mark a point where freeing memory would be acceptable.
+
+        This is called from request hot paths, so in the common case it only
+        increments a counter.
+        """
+        with self._lock:
+            self.stats.checkpoints += 1
+            if self.policy == "periodic":
+                due = self.stats.checkpoints % self.gc_every_n == 0
+            elif self.policy == "rss":
+                now = time.monotonic()
+                due = False
+                if now - self._last_rss_check >= self.rss_check_seconds:
+                    self._last_rss_check = now
+                    self.stats.last_rss_mb = current_rss_mb()
+                    due = self.stats.last_rss_mb > self.rss_limit_mb
+            else:
+                due = False
+        if due:
+            self.release(trim=self.policy == "rss")
+
+    def release(self, trim: bool = False):
+        """Run a full collection now, optionally returning freed pages to the OS."""
+        start = time.perf_counter()
+        gc.collect()
+        if trim:
+            _malloc_trim()
+            _empty_cuda_cache()
+        pause_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.stats.collections += 1
+            if trim:
+                self.stats.trims += 1
+            self.stats.total_pause_ms += pause_ms
+
+    def freeze_after_warmup(self):
+        """
+        Move everything currently alive into the permanent generation.
+
+        Call after the embedding model and vector stores are loaded. Calling it
+        again after further warmup freezes the newly loaded objects as well.
+        """
+        if not self.freeze_enabled:
+            return
+        gc.collect()
+        gc.freeze()
+        self._frozen = True
+        self.stats.frozen_objects = gc.get_freeze_count()
+        print(f"[DEBUG] Froze {self.stats.frozen_objects} objects after warmup")
+
+    def reset(self):
+        """Undo freeze and threshold changes (used by tests and benchmarks)."""
+        if self._frozen:
+            gc.unfreeze()
+            self._frozen = False
+        gc.set_threshold(*self._default_thresholds)
+
+
+# Global instance
+_memory_policy = None
+
+
+def get_memory_policy() -> MemoryPolicy:
+    """Get or create the global memory policy instance."""
+    global _memory_policy
+    if _memory_policy is None:
+        _memory_policy = MemoryPolicy.from_env()
+    return _memory_policy
+
+
+def checkpoint():
+    """Convenience wrapper around the global policy's checkpoint()."""
+    get_memory_policy().checkpoint()
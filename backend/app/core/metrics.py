@@ -0,0 +1,35 @@
+"""
+In-process counters for operational metrics.
+
+Counters are plain named integers ("singleflight.recommend.coalesced", ...)
+exposed by GET /api/v1/metrics. They are per worker process.
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_counters: Dict[str, int] = defaultdict(int)
+_lock = threading.Lock()
+
+
+def increment(name: str, value: int = 1):
+    """Add value to the named counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def get_counter(name: str) -> int:
+    return _counters.get(name, 0)
+
+
+def get_counters() -> Dict[str, int]:
+    """Snapshot of every counter."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    """Clear every counter (used by tests)."""
+    with _lock:
+        _counters.clear()
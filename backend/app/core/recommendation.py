@@ -1,20 +1,45 @@
 from app.core.enhanced_embedding import get_top_matching_products, rank_products_by_similarity
+import hashlib
 import os
-from typing import List, Dict, Any, Tuple
+import random
+import secrets
+from typing import List, Dict, Any, Optional, Tuple, Union
+from dataclasses import dataclass
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 import itertools
 import re
 from dotenv import load_dotenv
 from datetime import datetime
 load_dotenv()
-from app.schemas.recommendation import RecommendationRequest, RecommendationResponse, EnhancedRecommendationResponse, UserProfileInfo, BundleStats, PreferenceInfo, KeyPrinciple
+from app.schemas.recommendation import RecommendationRequest, RecommendationResponse, EnhancedRecommendationResponse, UserProfileInfo, BundleStats, PreferenceInfo, KeyPrinciple, AlternativeBundle, BundleSwapRequest, BundleSwapResponse, TimingMacroBreakdown
 from app.schemas.product import Product as ProductSchema
 from app.schemas.macro_target import MacroTargetResponse
-from app.core.macro_targeting_local import MacroTargetingServiceLocal
-from app.core.layer2_macro_optimization import optimize_macro_combination
-from app.db.models import UserInput, Product, MacroTarget
-from app.db.vector_store import get_product_vector_store
-from sqlalchemy.orm import load_only
+from app.core.layer2_macro_optimization import PIPELINE_OPTIMIZER_SETTINGS, LAYER2_ALTERNATIVE_MAX_OVERLAP, CombinationResult, MacroOptimizer, MacroTargets, optimize_macro_combination, pick_from_top_candidates, select_alternatives
+from app.core.layer2_timing import assign_timing_slots, slot_targets_from_macro_target
+from app.core.layer2_pareto import LAYER2_PARETO_COUNT_OBJECTIVE, LAYER2_PRICE_AWARE
+from app.core.bundle_sessions import BundleSession, get_bundle_session, reoptimize_bundle, start_bundle_session
+from app.core.result_cache import canonical_request_key, get_recommendation_cache
+from app.core.singleflight import get_single_flight
+from app.core.bundle_library import lookup_precomputed_bundles
+from app.core.deadline import DEADLINE_EMBEDDING_SECONDS, Deadline
+from app.core.diversity import DEFAULT_MMR_LAMBDA
+from app.db.models import UserInput, MacroTarget
+from app.db.catalog_index import CatalogGeneration, get_catalog_generation
+from app.db.product_view import CatalogSnapshot, ProductView
+from app.db.session import save_rows
+from app.db.async_session import get_async_sessionmaker, save_rows_async
+
+# Upper bound on RecommendationRequest.num_alternatives
+RECOMMEND_MAX_ALTERNATIVES = int(os.getenv("RECOMMEND_MAX_ALTERNATIVES", "5"))
+
+# Requests without a seed: derive it from the canonical request (same request, same
+# response) instead of drawing a fresh one (variety between identical requests)
+RECOMMEND_SEED_FROM_REQUEST = os.getenv("RECOMMEND_SEED_FROM_REQUEST", "false").lower() == "true"
+
+# RecommendationRequest fields stored on a UserInput row
+USER_INPUT_COLUMNS = {column.key for column in UserInput.__table__.columns}
 
 # Module-level singleton for MacroTargetingServiceLocal
 _macro_service_instance = None
@@ -23,6 +48,8 @@ def get_macro_service():
     """Get singleton instance of MacroTargetingServiceLocal to avoid multiple expensive initializations."""
     global _macro_service_instance
     if _macro_service_instance is None:
+        # Imported here: langchain, chromadb and torch load on first use (or warmup), not with app.main
+        from app.core.macro_targeting_local import MacroTargetingServiceLocal
         _macro_service_instance = MacroTargetingServiceLocal()
     return _macro_service_instance
 
@@ -69,63 +96,28 @@ def _build_hard_filters_from_llm_extraction(preferences: Dict[str, Any]) -> Dict
     
     return hard_filters
 
-def _pre_filter_products_by_hard_constraints(db: Session, hard_filters: Dict[str, Any]) -> List[Product]:
+def _pre_filter_products_by_hard_constraints(generation: CatalogGeneration, snapshot: CatalogSnapshot, hard_filters: Dict[str, Any]) -> List[ProductView]:
     """
     Pre-filter products based on hard constraints before vector search.
     
     Args:
-        db: Database session
+        generation: Catalog generation holding the dietary/allergen indexes
+        snapshot: Product views of the same generation
         hard_filters: Dictionary of hard filters from LLM extraction
         
     Returns:
         List of products that meet all hard constraints
     """
-    # Start with all products
-    query = db.query(Product)
-    
-    # Apply dietary restrictions
-    dietary_requirements = hard_filters.get("dietary_requirements", [])
-    if dietary_requirements:
-        # Products must have ALL required dietary flags
-        for requirement in dietary_requirements:
-            # Check both dietary_flags and diet fields
-            query = query.filter(
-                (Product.dietary_flags.contains([requirement])) |
-                (Product.diet == requirement) |
-                (Product.diet.contains([requirement]))
-            )
-    
-    # Apply allergen restrictions - exclude products that contain restricted allergens
-    allergen_restrictions = hard_filters.get("allergen_restrictions", [])
-    if allergen_restrictions:
-        # Use a more reliable approach for SQLite JSON filtering
-        for allergen in allergen_restrictions:
-            # Exclude products that contain this allergen
-            # Use JSON_ARRAY_CONTAINS for SQLite or fallback to Python filtering
-            query = query.filter(
-                ~(Product.allergens.contains([allergen]))
-            )
-        
-        # Execute query and do additional Python-level filtering as backup
-        filtered_products = query.all()
-        
-        # Additional Python-level filtering to ensure allergens are properly excluded
-        final_filtered = []
-        for product in filtered_products:
-            product_allergens = product.allergens or []
-            # Check if any restricted allergen is in this product's allergens
-            has_restricted_allergen = any(allergen in product_allergens for allergen in allergen_restrictions)
-            if not has_restricted_allergen:
-                final_filtered.append(product)
-        
-        return final_filtered
+    # Products must have ALL required dietary values (dietary_flags or diet)
+    # and none of the restricted allergens
+    matching_ids = generation.ids_matching(
+        dietary_requirements=hard_filters.get("dietary_requirements", []),
+        allergen_restrictions=hard_filters.get("allergen_restrictions", [])
+    )
     
     # Note: Price is NOT applied here - it's a soft constraint for optimization
     
-    # Execute query and return results
-    filtered_products = query.all()
-    
-    return filtered_products
+    return [view for view in snapshot.views if view.id in matching_ids]
 
 def _build_hard_filters(preferences: Dict[str, Any]) -> Dict[str, Any]:
     """Build hard filters for vector search based on user preferences."""
@@ -150,7 +142,7 @@ def _build_hard_filters(preferences: Dict[str, Any]) -> Dict[str, Any]:
         hard_filters["form"] = preferences["form_preferences"]  
     return hard_filters
 
-def _apply_hard_filters(products: List[Product], preferences: Dict[str, Any]) -> List[Product]:
+def _apply_hard_filters(products: List[ProductView], preferences: Dict[str, Any]) -> List[ProductView]:
     """Filters a list of products based on hard constraints."""
     filtered_products = []
     
@@ -189,8 +181,320 @@ def extract_soft_guidance(context: str) -> str:
         guidance_lines = lines[:2]
     return " ".join(guidance_lines)
 
-async def get_recommendations(request: RecommendationRequest, db: Session) -> RecommendationResponse:
+@dataclass
+class CachedRecommendation:
+    """A computed response plus what is needed to vary it on a cache hit."""
+    response: EnhancedRecommendationResponse
+    optimization_result: Optional[CombinationResult]
+    reasoning_steps: List[str]  # Reasoning up to (not including) the Layer 2 lines
+    bundle_session: Optional[BundleSession] = None  # Every response gets its own session from this
+    seed: Optional[int] = None  # Seed the response was computed with
+
+
+async def get_recommendations(request: RecommendationRequest, db: Union[AsyncSession, Session],
+                              deadline: Optional[Deadline] = None, degraded: bool = False) -> RecommendationResponse:
+    """
+    Recommend snacks for a request, serving near-identical requests from the result cache.
+
+    db (an AsyncSession from the endpoint, or a Session) saves the user input and
+    macro targets extracted from the query; the catalog is read through the
+    async read engine (app.db.async_session).
+
+    Concurrent identical requests are coalesced onto one pipeline run. See
+    app.core.result_cache for how requests are canonicalized. Only the request
+    that ran the pipeline saves the user input and macro targets, and only if
+    it is still connected when the run finishes: like cache hits, requests that
+    joined its run are not recorded, and a run whose caller went away is not
+    recorded at all.
+
+    Every random choice of a pipeline run draws from one generator seeded per
+    request, and the seed is returned with the response: a request repeated with
+    that seed gets the same response, from the cache or recomputed. Requests
+    without a seed get a fresh one, and cache hits re-draw their bundle, unless
+    RECOMMEND_SEED_FROM_REQUEST derives the seed from the request itself.
+
+    With a deadline, stages that would run past it take a cheaper path (see
+    app.core.deadline); such degraded responses are not cached.
+
+    degraded (set by admission control while the server is saturated) takes the
+    cheap path right away: cached or precomputed bundles when available, else
+    rule-based extraction and a greedy bundle instead of the Layer 2 search.
+    """
+    catalog = get_catalog_generation()
+    key = canonical_request_key(request, catalog.generation)
+    seed = _request_seed(request, key)
+    cache = get_recommendation_cache()
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return _vary_cached_response(cached, request, seed)
+
+    if degraded:
+        # No time for the expensive stages: every deadline check takes its cheap path
+        deadline = Deadline.after(0)
+        deadline.degrade("admission", "the server was busy, so a quickly selected bundle is returned")
+
+    computed_here = False
+
+    async def compute() -> Tuple[CachedRecommendation, List[Any]]:
+        nonlocal computed_here
+        computed_here = True
+        # The pipeline blocks (LLM, embedding, optimization); run it off the event
+        # loop so identical requests arriving meanwhile can join this computation
+        run_seed = secrets.randbits(32) if seed is None else seed
+        snapshot = await _catalog_snapshot(catalog)
+        result, unsaved = await run_in_threadpool(
+            _compute_recommendations, request, catalog, snapshot, run_seed, deadline, degraded
+        )
+        if cache is not None and not (deadline is not None and deadline.degradations):
+            cache.put(key, result)
+        return result, unsaved
+
+    # Degraded runs never stand in for full ones
+    flight_key = f"degraded:{key}" if degraded else key
+    computed, unsaved = await get_single_flight("recommend").do(flight_key, compute)
+    if not computed_here:
+        # Joined another request's computation: serve it like a cache hit
+        return _vary_cached_response(computed, request, seed)
+    # Saved here rather than in the shared computation, which outlives this
+    # request (and its session) when the client goes away; joined requests
+    # (and cache hits) save nothing
+    if unsaved:
+        await _save_rows(db, unsaved)
+    token = start_bundle_session(computed.bundle_session)
+    if token is None:
+        return computed.response
+    return computed.response.model_copy(update={"bundle_session_token": token})
+
+
+async def _catalog_snapshot(catalog: CatalogGeneration) -> CatalogSnapshot:
+    """The generation's product snapshot, read (once per generation) without blocking the event loop."""
+    async with get_async_sessionmaker(read_only=True)() as read_db:
+        return await catalog.snapshot_async(read_db)
+
+
+async def _save_rows(db: Union[AsyncSession, Session], rows: List[Any]):
+    """Save rows the pipeline created; a failed save is logged, the response is still served."""
+    try:
+        if isinstance(db, AsyncSession):
+            await save_rows_async(db, *rows)
+        else:
+            await run_in_threadpool(save_rows, db, *rows)
+    except Exception as e:
+        print(f"Failed to save the request's user input and macro targets: {e}")
+        if isinstance(db, AsyncSession):
+            await db.rollback()
+        else:
+            await run_in_threadpool(db.rollback)
+
+
+def _request_seed(request: RecommendationRequest, key: str) -> Optional[int]:
+    """The request's seed, one derived from its cache key (RECOMMEND_SEED_FROM_REQUEST), or None."""
+    if request.seed is not None:
+        return request.seed
+    if RECOMMEND_SEED_FROM_REQUEST:
+        return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:4], "big")
+    return None
+
+
+def _vary_cached_response(cached: CachedRecommendation, request: RecommendationRequest,
+                          seed: Optional[int] = None) -> EnhancedRecommendationResponse:
+    """
+    Serve a computed response to another request with the same cache key.
+
+    A request with the seed the response was computed with gets the same bundle;
+    otherwise the bundle is re-drawn from the cached top candidates (with the
+    request's seed if it has one). Either way the request's own profile is shown.
+    """
+    updates = {}
+    result = cached.optimization_result
+    if (seed is None or seed != cached.seed) and result is not None and result.top_candidates:
+        # A re-drawn bundle cannot be replayed by recomputing, so no seed is returned
+        updates["seed"] = None
+        result = pick_from_top_candidates(result, random.Random(seed))
+        updates["recommended_products"] = [ProductSchema.model_validate(p, from_attributes=True) for p in result.products]
+        updates["bundle_stats"] = _bundle_stats_from_result(result)
+        updates["reasoning"] = "\n".join(cached.reasoning_steps + _layer2_reasoning(result))
+        updates["alternative_bundles"] = _alternative_bundles(result, request)
+        if result.timing_slots and cached.response.timing_breakdown is not None:
+            updates["timing_breakdown"] = cached.response.timing_breakdown.model_copy(update=_timing_slot_products(result))
+    if _has_activity_info(request):
+        # Bucketed fields share an entry; display the exact values of this request
+        updates["user_profile"] = _build_user_profile(request)
+    updates["bundle_session_token"] = start_bundle_session(cached.bundle_session, seed)
+    return cached.response.model_copy(update=updates)
+
+
+async def swap_bundle_products(request: BundleSwapRequest) -> Optional[BundleSwapResponse]:
+    """
+    Replace snacks of a recommended bundle by re-running Layer 2 on the bundle session.
+
+    Returns:
+        The new bundle, or None if the session expired or the catalog changed since
+
+    Raises:
+        KeyError: If a product id does not belong to the session
+        ValueError: If no bundle fits the pinned products
+    """
+    session = get_bundle_session(request.bundle_session_token, get_catalog_generation().generation)
+    if session is None:
+        return None
+    result = await run_in_threadpool(
+        reoptimize_bundle, session, request.product_ids, request.exclude_product_ids, request.pin_product_ids
+    )
+    if result is None:
+        raise ValueError("No bundle fits the pinned products")
+    kept = sum(1 for p in result.products if p.id in request.product_ids)
+    reasoning = [f"Re-optimized the bundle from the session's candidates, keeping {kept} of its snacks."]
+    slot_products = _timing_slot_products(result)
+    return BundleSwapResponse(
+        recommended_products=[ProductSchema.model_validate(p, from_attributes=True) for p in result.products],
+        bundle_stats=_bundle_stats_from_result(result),
+        reasoning="\n".join(reasoning + _layer2_reasoning(result)),
+        bundle_session_token=request.bundle_session_token,
+        timing_breakdown=TimingMacroBreakdown(**slot_products) if slot_products else None
+    )
+
+
+def _has_activity_info(request: RecommendationRequest) -> bool:
+    return any([
+        request.age is not None,
+        request.weight_kg is not None,
+        request.exercise_type is not None,
+        request.exercise_duration_minutes is not None
+    ])
+
+
+def _layer2_reasoning(optimization_result: CombinationResult) -> List[str]:
+    steps = []
+    pruning = optimization_result.pruning
+    if pruning and pruning['searched'] < pruning['candidates']:
+        steps.append(
+            f"Layer 2 searched {pruning['searched']} of {pruning['candidates']} candidates ({pruning['duplicates_collapsed']} identical nutrient profiles collapsed, {pruning['dominated']} dominated, {pruning['over_calorie_cap']} over the calorie cap)."
+        )
+    front = optimization_result.pareto_front
+    if front:
+        steps.append(
+            f"Price-aware optimization found {len(front)} bundles on the score/price Pareto front (${front[0]['price']:.2f}-${front[-1]['price']:.2f}); selected a ${_total_price(optimization_result.products) or 0.0:.2f} bundle for the budget."
+        )
+    if optimization_result.timing_slots:
+        counts = {slot: len(products) for slot, products in optimization_result.timing_slots.items()}
+        steps.append(
+            f"Split the bundle by workout timing: {counts.get('pre_workout', 0)} pre-workout, {counts.get('during_workout', 0)} during-workout and {counts.get('post_workout', 0)} post-workout snacks."
+        )
+    return steps + [
+        f"Layer 2 optimization selected {len(optimization_result.products)} snacks with score {optimization_result.score:.3f} and {optimization_result.target_match_percentage:.1f}% target match.",
+        f"Combination provides: {optimization_result.total_protein:.1f}g protein, {optimization_result.total_carbs:.1f}g carbs, {optimization_result.total_fat:.1f}g fat, {optimization_result.total_electrolytes:.0f}mg electrolytes, {optimization_result.total_calories:.0f} calories."
+    ]
+
+
+def _bundle_stats_from_result(optimization_result: CombinationResult) -> BundleStats:
+    return BundleStats(
+        total_protein=optimization_result.total_protein,
+        total_carbs=optimization_result.total_carbs,
+        total_fat=optimization_result.total_fat,
+        total_electrolytes=optimization_result.total_electrolytes,
+        total_calories=optimization_result.total_calories,
+        num_snacks=len(optimization_result.products),
+        target_match_percentage=optimization_result.target_match_percentage,
+        total_price=_total_price(optimization_result.products)
+    )
+
+
+def _total_price(products: List[ProductView]) -> Optional[float]:
+    """Sum of the known product prices, or None if no product has a price."""
+    prices = [p.price_usd for p in products if p.price_usd is not None]
+    return round(sum(prices), 2) if prices else None
+
+
+def _bundle_budget(preferences: Dict[str, Any]) -> Optional[float]:
+    """Bundle budget in USD from request preferences or the LLM-extracted price limit."""
+    budget = preferences.get("budget_usd") or (preferences.get("soft_preferences") or {}).get("price_dollars")
+    try:
+        return float(budget) if budget else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _price_settings(budget: Optional[float]) -> Dict[str, Any]:
+    """optimize_macro_combination() settings that make a budget an objective of Layer 2."""
+    if budget is None or not LAYER2_PRICE_AWARE:
+        return {}
+    return {"price_objective": True, "count_objective": LAYER2_PARETO_COUNT_OBJECTIVE, "budget": budget}
+
+
+def _timing_slot_products(optimization_result: Optional[CombinationResult]) -> Dict[str, List[ProductSchema]]:
+    """TimingMacroBreakdown product fields for a timing-aware result (empty otherwise)."""
+    if optimization_result is None or not optimization_result.timing_slots:
+        return {}
+    return {
+        f"{slot}_products": [ProductSchema.model_validate(p, from_attributes=True) for p in products]
+        for slot, products in optimization_result.timing_slots.items()
+    }
+
+
+def _num_alternatives(request: RecommendationRequest) -> int:
+    return max(0, min(request.num_alternatives or 0, RECOMMEND_MAX_ALTERNATIVES))
+
+
+def _alternative_bundles(optimization_result: Optional[CombinationResult], request: RecommendationRequest) -> List[AlternativeBundle]:
+    """Alternatives to the selected bundle, drawn from the candidates of the same optimization."""
+    count = _num_alternatives(request)
+    if optimization_result is None or count == 0:
+        return []
+    max_overlap = request.max_alternative_overlap
+    if max_overlap is None:
+        max_overlap = LAYER2_ALTERNATIVE_MAX_OVERLAP
+    bundles = []
+    for candidate in select_alternatives(optimization_result, count, max_overlap):
+        totals = candidate["totals"]
+        bundles.append(AlternativeBundle(
+            recommended_products=[ProductSchema.model_validate(p, from_attributes=True) for p in candidate["combination"]],
+            bundle_stats=BundleStats(
+                total_protein=totals["protein"],
+                total_carbs=totals["carbs"],
+                total_fat=totals["fat"],
+                total_electrolytes=totals["electrolytes"],
+                total_calories=totals["calories"],
+                num_snacks=len(candidate["combination"]),
+                target_match_percentage=candidate["target_match"],
+                total_price=_total_price(candidate["combination"])
+            )
+        ))
+    return bundles
+
+
+def _build_user_profile(source_data) -> UserProfileInfo:
+    """Build user profile info for display from a UserInput or the request itself."""
+    age_display = f"{source_data.age} years old" if source_data.age else "using default age 21"
+    weight_display = f"{source_data.weight_kg}kg" if source_data.weight_kg else "using default 70kg weight"
+    
+    if source_data.exercise_type and source_data.exercise_duration_minutes:
+        exercise_display = f"{source_data.exercise_type} for {source_data.exercise_duration_minutes} minutes"
+    elif source_data.exercise_type:
+        exercise_display = f"{source_data.exercise_type} (using default 60-minute duration)"
+    elif source_data.exercise_duration_minutes:
+        exercise_display = f"cardio for {source_data.exercise_duration_minutes} minutes (using default exercise type)"
+    else:
+        exercise_display = "cardio (using default 60-minute duration)"
+    
+    return UserProfileInfo(
+        age=source_data.age,
+        weight_kg=source_data.weight_kg,
+        exercise_type=source_data.exercise_type,
+        exercise_duration_minutes=source_data.exercise_duration_minutes,
+        age_display=age_display,
+        weight_display=weight_display,
+        exercise_display=exercise_display
+    )
+
+
+def _compute_recommendations(request: RecommendationRequest, catalog: CatalogGeneration, snapshot: CatalogSnapshot,
+                             seed: Optional[int] = None, deadline: Optional[Deadline] = None,
+                             degraded: bool = False) -> Tuple[CachedRecommendation, List[Any]]:
+    """Run the pipeline; returns the result and the rows to save (the caller owns the database session)."""
     preferences = request.preferences or {}
+    # One generator for every random choice of this request
+    rng = random.Random(seed)
     reasoning_steps = []
     
     # Initialize service once at the beginning
@@ -200,7 +504,7 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
     if not preferences and request.user_query:
         try:
             # Use existing service for preference extraction
-            extracted_fields = macro_targeting_service.extract_fields_from_query(request.user_query)
+            extracted_fields = macro_targeting_service.extract_fields_from_query(request.user_query, deadline)
             
             # Convert LLM extracted fields to preferences format
             if extracted_fields:
@@ -213,6 +517,7 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
                     "soft_preferences": {
                         "flavor": soft_prefs.get("flavor", []),
                         "texture": soft_prefs.get("texture", []),
+                        "price_dollars": soft_prefs.get("price_dollars"),
                         "dietary": []  # Will be populated by macro targeting service
                     },
                     "flavor_preferences": soft_prefs.get("flavor", []),  # Legacy format support
@@ -239,12 +544,7 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
             preferences = {}
 
     # --- 1. Parse user query and preferences for available info ---
-    has_activity_info = any([
-        request.age is not None,
-        request.weight_kg is not None,
-        request.exercise_type is not None,
-        request.exercise_duration_minutes is not None
-    ])
+    has_activity_info = _has_activity_info(request)
     has_flavor_info = bool(preferences.get("flavor_preferences") or preferences.get("texture_preferences"))
     calorie_cap = None
     if preferences.get("calorie_cap"):
@@ -252,24 +552,29 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
             calorie_cap = float(preferences["calorie_cap"])
         except (ValueError, TypeError):
             calorie_cap = None
+    # A budget means a Pareto search, which a degraded request cannot afford
+    price_settings = {} if degraded else _price_settings(_bundle_budget(preferences))
 
     # --- 2. Always generate macro targets (with defaults if needed) ---
     macro_target = None
     context = ""
     user_input_db = None
+    unsaved = []
     
     # Use existing macro targeting service (already initialized)
     
     if has_activity_info:
         # Use structured fields from request
-        user_input_db = UserInput(**request.model_dump())
-        context, macro_target = macro_targeting_service.get_context_and_macro_targets(user_input_db)
+        # Only the UserInput columns: the request also carries response options (alternatives, seed, ...)
+        user_input_db = UserInput(**request.model_dump(include=USER_INPUT_COLUMNS))
+        context, macro_target = macro_targeting_service.get_context_and_macro_targets(user_input_db, deadline)
         reasoning_steps.append(f"Retrieved RAG context and generated macro targets: ~{macro_target.target_protein or 0:.0f}g protein, ~{macro_target.target_carbs or 0:.0f}g carbs.")
     else:
         # Try to extract activity info from natural language query
         try:
-            user_input_db, macro_target = macro_targeting_service.generate_macro_targets_from_query(request.user_query, db)
-            context = macro_targeting_service.retrieve_context_by_metadata(user_input_db)
+            user_input_db, macro_target = macro_targeting_service.generate_macro_targets_from_query(request.user_query, None, deadline)
+            unsaved = [user_input_db, macro_target]
+            context = macro_targeting_service.retrieve_context_by_metadata(user_input_db, deadline=deadline)
             reasoning_steps.append(f"Extracted activity info from query and generated macro targets: ~{macro_target.target_protein or 0:.0f}g protein, ~{macro_target.target_carbs or 0:.0f}g carbs.")
         except Exception as e:
             # If extraction fails, create a default user input and generate macro targets
@@ -284,14 +589,16 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
                 exercise_duration_minutes=60  # Default duration
             )
             user_input_db = default_user_input
-            context, macro_target = macro_targeting_service.get_context_and_macro_targets(default_user_input)
+            context, macro_target = macro_targeting_service.get_context_and_macro_targets(default_user_input, deadline)
             reasoning_steps.append(f"Generated macro targets with default values: ~{macro_target.target_protein or 0:.0f}g protein, ~{macro_target.target_carbs or 0:.0f}g carbs.")
 
     # --- 3. Pre-filter products by hard constraints from LLM extraction ---
+    # The whole request uses one catalog generation; the pipeline works on
+    # its detached product views (read by the caller) and never touches the ORM
     hard_filters = _build_hard_filters_from_llm_extraction(preferences)
     if hard_filters:
-        pre_filtered_products = _pre_filter_products_by_hard_constraints(db, hard_filters)
-        reasoning_steps.append(f"Pre-filtered products by hard constraints: {len(pre_filtered_products)} products remaining from {db.query(Product).count()} total.")
+        pre_filtered_products = _pre_filter_products_by_hard_constraints(catalog, snapshot, hard_filters)
+        reasoning_steps.append(f"Pre-filtered products by hard constraints: {len(pre_filtered_products)} products remaining from {len(snapshot)} total.")
         
         # Log what filters were applied
         filter_details = []
@@ -302,158 +609,53 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
         if filter_details:
             reasoning_steps.append(f"Applied hard filters: {', '.join(filter_details)}")
     else:
-        pre_filtered_products = db.query(Product).all()
+        pre_filtered_products = list(snapshot.views)
         reasoning_steps.append("No hard constraints found; using all products for vector search.")
 
-    # --- 4. Build vector search query ---
-    if macro_target:
-        # Use macro targets to build query (always available now)
-        soft_guidance = extract_soft_guidance(context)
-        user_soft_prefs = []
-        if preferences.get("flavor_preferences"):
-            user_soft_prefs.append(f"flavor: {'/'.join(preferences['flavor_preferences'])}")
-        if preferences.get("texture_preferences"):
-            user_soft_prefs.append(f"texture: {'/'.join(preferences['texture_preferences'])}")
-        if preferences.get("flavor_exclusions"):
-            user_soft_prefs.append(f"not: {'/'.join(preferences['flavor_exclusions'])}")
-        
-        # Add high-protein preference if detected from strength activities
-        if preferences.get("soft_preferences", {}).get("dietary"):
-            dietary_prefs = preferences["soft_preferences"]["dietary"]
-            if "high-protein" in dietary_prefs:
-                user_soft_prefs.append("high-protein")
-                reasoning_steps.append("Added high-protein preference based on strength activity detection")
-        
-        vector_query = f"{soft_guidance} {' '.join(user_soft_prefs)}"
-        reasoning_steps.append(f"Built vector search query with macro guidance: '{vector_query}'")
-    elif has_flavor_info:
-        # Use only flavor/texture info
-        vector_query = " ".join([
-            f"flavor: {'/'.join(preferences['flavor_preferences'])}" if preferences.get("flavor_preferences") else "",
-            f"texture: {'/'.join(preferences['texture_preferences'])}" if preferences.get("texture_preferences") else ""
-        ]).strip()
-        reasoning_steps.append(f"Built vector search query (flavor/texture only): '{vector_query}'")
-    else:
-        # Fallback to user_query
-        vector_query = request.user_query
-        reasoning_steps.append(f"Built vector search query (fallback to user_query): '{vector_query}'")
-
-    # --- 5. Vector search on pre-filtered products (Layer 1) ---
-    vector_store = get_product_vector_store()
-
-    # Prepare holders to avoid UnboundLocalError regardless of branch
-    vector_results = []
-    candidate_snacks = []
-
-    # Check if we have soft preferences (including high-protein from strength activities)
-    has_soft_preferences = bool(
-        preferences.get("flavor_preferences") or 
-        preferences.get("texture_preferences") or
-        preferences.get("soft_preferences", {}).get("dietary")
-    )
-
-    # If we have soft preferences and macro targets, use enhanced embedding system
-    if has_soft_preferences and macro_target:
-        # Prepare soft preferences for enhanced embedding
-        soft_preferences = {}
-        if preferences.get("flavor_preferences"):
-            soft_preferences["flavor"] = preferences["flavor_preferences"]
-        if preferences.get("texture_preferences"):
-            soft_preferences["texture"] = preferences["texture_preferences"]
-        if preferences.get("soft_preferences", {}).get("dietary"):
-            soft_preferences["dietary"] = preferences["soft_preferences"]["dietary"]
-
-        # Prepare macro targets for enhanced embedding
-        macro_targets = {
-            "target_protein": macro_target.target_protein,
-            "target_carbs": macro_target.target_carbs,
-            "target_calories": macro_target.target_calories
-        }
-
-        # Use enhanced embedding system for better matching with soft preferences
-        candidate_snacks = _enhanced_vector_search_with_embeddings(
-            user_query=vector_query,
-            pre_filtered_products=pre_filtered_products,
-            soft_preferences=soft_preferences,
-            macro_targets=macro_targets
+    # --- 4-7. Precomputed bundles, or Layer 1 candidate search ---
+    library_result = None
+    # Stored bundles were optimized without prices, so a budget always runs Layer 2
+    if macro_target and not has_flavor_info and not preferences.get("flavor_exclusions") and not preferences.get("ingredient_exclusions") and not price_settings:
+        library_result = lookup_precomputed_bundles(
+            catalog, snapshot, macro_targeting_service, user_input_db, hard_filters, calorie_cap, macro_target, rng
         )
-        reasoning_steps.append(f"Enhanced embedding search returned {len(candidate_snacks)} candidate snacks with soft preferences.")
+    if library_result is not None:
+        candidate_snacks = []
+        reasoning_steps.append("Found precomputed bundles for this profile in the bundle library; skipped vector search.")
     else:
-        # Use standard vector store search
-        # If we have pre-filtered products, we need to do vector search on that subset
-        if len(pre_filtered_products) < db.query(Product).count():
-            # Do vector search on all products first, then filter to our pre-filtered subset
-            vector_results = vector_store.query_similar_products(
-                query=vector_query,
-                top_k=100,  # Get more candidates since we'll filter
-                hard_filters=None,  # Don't use vector store hard filters since we pre-filtered
-                use_mmr=True,
-                mmr_lambda=0.5
-            )
-
-            # Filter results to only include pre-filtered products
-            pre_filtered_ids = set(p.id for p in pre_filtered_products)
-            filtered_vector_results = []
-            seen_product_ids = set()
-
-            for result in vector_results:
-                product_id = result['product_id']
-                if product_id in pre_filtered_ids and product_id not in seen_product_ids:
-                    filtered_vector_results.append(result)
-                    seen_product_ids.add(product_id)
-
-            # Take top results from filtered subset
-            vector_results = filtered_vector_results[:50]
-            reasoning_steps.append(f"Vector search on pre-filtered products returned {len(vector_results)} candidates.")
-        else:
-            # No hard filters, do normal vector search on all products
-            vector_results = vector_store.query_similar_products(
-                query=vector_query,
-                top_k=50,
-                hard_filters=None,
-                use_mmr=True,
-                mmr_lambda=0.5
-            )
-            reasoning_steps.append(f"Vector search returned {len(vector_results)} candidate snacks with diversity optimization.")
-
-    # --- 6. Convert vector results to Product objects (only if not using enhanced path) ---
-    if not candidate_snacks:
-        for result in vector_results:
-            product = (
-                db.query(Product)
-                .options(load_only(*(getattr(Product, c.name) for c in Product.__table__.columns)))
-                .filter(Product.id == result['product_id'])
-                .first()
-            )
-            if product:
-                candidate_snacks.append(product)
-
-        reasoning_steps.append(f"Vector search returned {len(candidate_snacks)} candidate snacks.")
-
-    # --- 7. Apply additional hard filters (ingredient exclusions) ---
-    additional_filters = {
-        key: preferences.get(key) for key in ["ingredient_exclusions"] if preferences.get(key)
-    }
-    if additional_filters:
-        candidate_snacks = _apply_hard_filters(candidate_snacks, additional_filters)
-        reasoning_steps.append(f"Applied additional hard filters. {len(candidate_snacks)} products remaining.")
+        candidate_snacks = _layer1_candidates(
+            request, preferences, macro_target, context, has_flavor_info,
+            catalog, snapshot, pre_filtered_products, reasoning_steps, deadline
+        )
 
     # --- 8. Macro optimization (Layer 2) if macro targets are available ---
     optimization_result = None
-    if macro_target:
+    layer2_step = len(reasoning_steps)
+    slot_targets = slot_targets_from_macro_target(macro_target) if macro_target and request.timing_aware else None
+    if library_result is not None:
+        optimization_result = library_result
+        if slot_targets:
+            optimization_result = assign_timing_slots(
+                optimization_result, slot_targets, MacroOptimizer().weights, PIPELINE_OPTIMIZER_SETTINGS["max_candidates"], rng
+            )
+        final_recommendations = optimization_result.products
+        reasoning_steps.extend(_layer2_reasoning(optimization_result))
+    elif macro_target:
         optimization_result = optimize_macro_combination(
             products=candidate_snacks,
             macro_targets=macro_target,
-            min_snacks=1,
-            max_snacks=8,
-            max_candidates=10,
-            score_threshold=1.5,
-            calorie_cap=calorie_cap
+            calorie_cap=calorie_cap,
+            alternatives=_num_alternatives(request),
+            slot_targets=slot_targets,
+            rng=rng,
+            deadline=deadline,
+            algorithm="simple" if degraded else None,
+            **price_settings,
+            **PIPELINE_OPTIMIZER_SETTINGS
         )
         if optimization_result:
             final_recommendations = optimization_result.products
-            reasoning_steps.append(f"Layer 2 optimization selected {len(final_recommendations)} snacks with score {optimization_result.score:.3f} and {optimization_result.target_match_percentage:.1f}% target match.")
-            reasoning_steps.append(f"Combination provides: {optimization_result.total_protein:.1f}g protein, {optimization_result.total_carbs:.1f}g carbs, {optimization_result.total_fat:.1f}g fat, {optimization_result.total_electrolytes:.0f}mg electrolytes, {optimization_result.total_calories:.0f} calories.")
+            reasoning_steps.extend(_layer2_reasoning(optimization_result))
         else:
             final_recommendations = candidate_snacks[:6]
             reasoning_steps.append(f"Layer 2 optimization failed, using top {len(final_recommendations)} candidates as fallback.")
@@ -476,44 +678,12 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
     response_products = [ProductSchema.model_validate(p, from_attributes=True) for p in final_recommendations]
 
     # Build user profile info for display (always create)
-    user_profile = None
     # Use extracted user_input_db if available, otherwise use request fields
-    source_data = user_input_db if user_input_db else request
-    
-    age_display = f"{source_data.age} years old" if source_data.age else "using default age 21"
-    weight_display = f"{source_data.weight_kg}kg" if source_data.weight_kg else "using default 70kg weight"
-    
-    if source_data.exercise_type and source_data.exercise_duration_minutes:
-        exercise_display = f"{source_data.exercise_type} for {source_data.exercise_duration_minutes} minutes"
-    elif source_data.exercise_type:
-        exercise_display = f"{source_data.exercise_type} (using default 60-minute duration)"
-    elif source_data.exercise_duration_minutes:
-        exercise_display = f"cardio for {source_data.exercise_duration_minutes} minutes (using default exercise type)"
-    else:
-        exercise_display = "cardio (using default 60-minute duration)"
-    
-    user_profile = UserProfileInfo(
-        age=source_data.age,
-        weight_kg=source_data.weight_kg,
-        exercise_type=source_data.exercise_type,
-        exercise_duration_minutes=source_data.exercise_duration_minutes,
-        age_display=age_display,
-        weight_display=weight_display,
-        exercise_display=exercise_display
-    )
+    user_profile = _build_user_profile(user_input_db if user_input_db else request)
 
     # Build bundle stats (always calculate)
-    bundle_stats = None
     if optimization_result:
-        bundle_stats = BundleStats(
-            total_protein=optimization_result.total_protein,
-            total_carbs=optimization_result.total_carbs,
-            total_fat=optimization_result.total_fat,
-            total_electrolytes=optimization_result.total_electrolytes,
-            total_calories=optimization_result.total_calories,
-            num_snacks=len(final_recommendations),
-            target_match_percentage=optimization_result.target_match_percentage
-        )
+        bundle_stats = _bundle_stats_from_result(optimization_result)
     else:
         # Calculate totals manually if no optimization result
         total_protein = sum(p.protein or 0 for p in final_recommendations)
@@ -582,7 +752,7 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
     key_principles = []
     if macro_target and macro_target.rag_context:
         # Use existing service instance
-        principles = macro_targeting_service.extract_key_principles(macro_target.rag_context, num_principles=2)
+        principles = macro_targeting_service.extract_key_principles(macro_target.rag_context, num_principles=2, rng=rng)
         key_principles = [KeyPrinciple(principle=principle) for principle in principles]
 
     # Build macro target response
@@ -606,14 +776,16 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
         )
         
         # Create timing breakdown for frontend display
-        from app.schemas.recommendation import TimingMacroBreakdown
         timing_breakdown = TimingMacroBreakdown(
             pre_workout=macro_target.pre_workout_macros,
             during_workout=macro_target.during_workout_macros,
-            post_workout=macro_target.post_workout_macros
+            post_workout=macro_target.post_workout_macros,
+            **_timing_slot_products(optimization_result)
         )
 
-    return EnhancedRecommendationResponse(
+    if deadline is not None:
+        reasoning_steps.extend(deadline.reasoning())
+    response = EnhancedRecommendationResponse(
         recommended_products=response_products,
         macro_targets=macro_target_response,
         timing_breakdown=timing_breakdown,
@@ -621,18 +793,177 @@ async def get_recommendations(request: RecommendationRequest, db: Session) -> Re
         user_profile=user_profile,
         bundle_stats=bundle_stats,
         preferences=preferences_info,
-        key_principles=key_principles
+        key_principles=key_principles,
+        alternative_bundles=_alternative_bundles(optimization_result, request),
+        seed=seed
+    )
+    bundle_session = None
+    if macro_target and optimization_result is not None:
+        # Layer 2 inputs for /recommend/swap
+        candidates = candidate_snacks
+        if not candidates:
+            # Bundle library hit: no Layer 1 candidates, use the products of the stored bundles
+            combinations = [c["combination"] for c in optimization_result.top_candidates] or [optimization_result.products]
+            candidates = list({p.id: p for combination in combinations for p in combination}.values())
+        bundle_session = BundleSession(
+            generation=catalog.generation,
+            candidates=candidates,
+            targets=MacroTargets(
+                target_protein_g=macro_target.target_protein or 0.0,
+                target_carbs_g=macro_target.target_carbs or 0.0,
+                target_fat_g=macro_target.target_fat or 0.0,
+                target_electrolytes_mg=macro_target.target_electrolytes or 0.0
+            ),
+            calorie_cap=calorie_cap,
+            settings=dict(PIPELINE_OPTIMIZER_SETTINGS, slot_targets=slot_targets, **price_settings),
+            seed=seed
+        )
+    return CachedRecommendation(
+        response=response,
+        optimization_result=optimization_result,
+        reasoning_steps=reasoning_steps[:layer2_step],
+        bundle_session=bundle_session,
+        seed=seed
+    ), unsaved
+
+
+def _layer1_candidates(request: RecommendationRequest, preferences: Dict[str, Any], macro_target: MacroTarget,
+                       context: str, has_flavor_info: bool, catalog: CatalogGeneration, snapshot: CatalogSnapshot,
+                       pre_filtered_products: List[ProductView], reasoning_steps: List[str],
+                       deadline: Optional[Deadline] = None) -> List[ProductView]:
+    """Layer 1: vector search over the pre-filtered products, returning candidate snacks for Layer 2."""
+    # --- 4. Build vector search query ---
+    if macro_target:
+        # Use macro targets to build query (always available now)
+        soft_guidance = extract_soft_guidance(context)
+        user_soft_prefs = []
+        if preferences.get("flavor_preferences"):
+            user_soft_prefs.append(f"flavor: {'/'.join(preferences['flavor_preferences'])}")
+        if preferences.get("texture_preferences"):
+            user_soft_prefs.append(f"texture: {'/'.join(preferences['texture_preferences'])}")
+        if preferences.get("flavor_exclusions"):
+            user_soft_prefs.append(f"not: {'/'.join(preferences['flavor_exclusions'])}")
+        
+        # Add high-protein preference if detected from strength activities
+        if preferences.get("soft_preferences", {}).get("dietary"):
+            dietary_prefs = preferences["soft_preferences"]["dietary"]
+            if "high-protein" in dietary_prefs:
+                user_soft_prefs.append("high-protein")
+                reasoning_steps.append("Added high-protein preference based on strength activity detection")
+        
+        vector_query = f"{soft_guidance} {' '.join(user_soft_prefs)}"
+        reasoning_steps.append(f"Built vector search query with macro guidance: '{vector_query}'")
+    elif has_flavor_info:
+        # Use only flavor/texture info
+        vector_query = " ".join([
+            f"flavor: {'/'.join(preferences['flavor_preferences'])}" if preferences.get("flavor_preferences") else "",
+            f"texture: {'/'.join(preferences['texture_preferences'])}" if preferences.get("texture_preferences") else ""
+        ]).strip()
+        reasoning_steps.append(f"Built vector search query (flavor/texture only): '{vector_query}'")
+    else:
+        # Fallback to user_query
+        vector_query = request.user_query
+        reasoning_steps.append(f"Built vector search query (fallback to user_query): '{vector_query}'")
+
+    # --- 5. Vector search on pre-filtered products (Layer 1) ---
+    vector_store = catalog.vector_store
+
+    # Prepare holders to avoid UnboundLocalError regardless of branch
+    vector_results = []
+    candidate_snacks = []
+
+    # Check if we have soft preferences (including high-protein from strength activities)
+    has_soft_preferences = bool(
+        preferences.get("flavor_preferences") or 
+        preferences.get("texture_preferences") or
+        preferences.get("soft_preferences", {}).get("dietary")
     )
 
+    # Encoding every candidate for the query is the slow path; short on time,
+    # rank with the catalog's precomputed embeddings instead
+    if has_soft_preferences and macro_target and deadline is not None and not deadline.allows(DEADLINE_EMBEDDING_SECONDS):
+        deadline.degrade("embedding", "ranked candidates with precomputed embeddings instead of the preference-aware search")
+        has_soft_preferences = False
+
+    # If we have soft preferences and macro targets, use enhanced embedding system
+    if has_soft_preferences and macro_target:
+        # Prepare soft preferences for enhanced embedding
+        soft_preferences = {}
+        if preferences.get("flavor_preferences"):
+            soft_preferences["flavor"] = preferences["flavor_preferences"]
+        if preferences.get("texture_preferences"):
+            soft_preferences["texture"] = preferences["texture_preferences"]
+        if preferences.get("soft_preferences", {}).get("dietary"):
+            soft_preferences["dietary"] = preferences["soft_preferences"]["dietary"]
+
+        # Prepare macro targets for enhanced embedding
+        macro_targets = {
+            "target_protein": macro_target.target_protein,
+            "target_carbs": macro_target.target_carbs,
+            "target_calories": macro_target.target_calories
+        }
+
+        # Use enhanced embedding system for better matching with soft preferences
+        candidate_snacks = _enhanced_vector_search_with_embeddings(
+            user_query=vector_query,
+            pre_filtered_products=pre_filtered_products,
+            soft_preferences=soft_preferences,
+            macro_targets=macro_targets,
+            mmr_lambda=DEFAULT_MMR_LAMBDA
+        )
+        reasoning_steps.append(f"Enhanced embedding search returned {len(candidate_snacks)} candidate snacks with soft preferences.")
+    else:
+        # Use standard vector store search
+        # If we have pre-filtered products, we need to do vector search on that subset
+        if len(pre_filtered_products) < len(snapshot):
+            # Restrict the search to the pre-filtered subset before diversifying
+            vector_results = vector_store.query_similar_products(
+                query=vector_query,
+                top_k=50,
+                hard_filters=None,  # Don't use vector store hard filters since we pre-filtered
+                use_mmr=True,
+                mmr_lambda=DEFAULT_MMR_LAMBDA,
+                candidate_ids={p.id for p in pre_filtered_products}
+            )
+            reasoning_steps.append(f"Vector search on pre-filtered products returned {len(vector_results)} candidates.")
+        else:
+            # No hard filters, do normal vector search on all products
+            vector_results = vector_store.query_similar_products(
+                query=vector_query,
+                top_k=50,
+                hard_filters=None,
+                use_mmr=True,
+                mmr_lambda=DEFAULT_MMR_LAMBDA
+            )
+            reasoning_steps.append(f"Vector search returned {len(vector_results)} candidate snacks with diversity optimization.")
+
+    # --- 6. Convert vector results to product views (only if not using enhanced path) ---
+    if not candidate_snacks:
+        candidate_snacks = snapshot.get_many(result['product_id'] for result in vector_results)
+
+        reasoning_steps.append(f"Vector search returned {len(candidate_snacks)} candidate snacks.")
+
+    # --- 7. Apply additional hard filters (ingredient exclusions) ---
+    additional_filters = {
+        key: preferences.get(key) for key in ["ingredient_exclusions"] if preferences.get(key)
+    }
+    if additional_filters:
+        candidate_snacks = _apply_hard_filters(candidate_snacks, additional_filters)
+        reasoning_steps.append(f"Applied additional hard filters. {len(candidate_snacks)} products remaining.")
+
+    return candidate_snacks
+
 
-def _enhanced_vector_search_with_embeddings(user_query: str, pre_filtered_products: List[Product], soft_preferences: dict = None, macro_targets: dict = None) -> List[Product]:
+def _enhanced_vector_search_with_embeddings(user_query: str, pre_filtered_products: List[ProductView], soft_preferences: dict = None, macro_targets: dict = None, mmr_lambda: float = DEFAULT_MMR_LAMBDA) -> List[ProductView]:
     """Enhanced vector search using unified embeddings for user queries and products."""
-    # Use the enhanced embedding system to rank products
+    # Use the enhanced embedding system to rank products, diversified with the
+    # same MMR lambda as the standard vector search path
     ranked_products = rank_products_by_similarity(
         user_query, 
         pre_filtered_products, 
         soft_preferences, 
-        macro_targets
+        macro_targets,
+        mmr_lambda=mmr_lambda,
+        top_k=50  # Reasonable number for optimization
     )
-    # Return top products (limit to reasonable number for optimization)
-    return [product for product, score in ranked_products[:50]]
+    return [product for product, score in ranked_products]
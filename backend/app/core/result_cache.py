@@ -0,0 +1,165 @@
+"""
+Response-level cache for /recommend.
+
+Requests that differ only by a kilogram of body weight or a few minutes of
+exercise produce macro targets that differ by fractions of a gram, so they are
+served from the same cache entry. The cache key is a canonical form of the
+request:
+
+- user_query lowercased with whitespace collapsed
+- weight_kg rounded to RESULT_CACHE_WEIGHT_STEP_KG (default 2.5 kg)
+- exercise_duration_minutes rounded to RESULT_CACHE_DURATION_STEP_MIN (default 15)
+- preferences with every list sorted and dict keys ordered
+- the number of alternative bundles, their allowed overlap and the timing-aware flag
+- the client's seed, if it sent one, so a seeded request replays its own response
+- the catalog generation, so a catalog swap never serves stale products
+
+Entries expire after RESULT_CACHE_TTL_SECONDS and the least recently used
+entry is evicted once RESULT_CACHE_MAX_ENTRIES is reached. Set
+RESULT_CACHE_ENABLED=false to disable caching.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from app.core.nlp import normalize_text
+
+load_dotenv()
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_WEIGHT_STEP_KG = float(os.getenv("RESULT_CACHE_WEIGHT_STEP_KG", "2.5"))
+RESULT_CACHE_DURATION_STEP_MIN = float(os.getenv("RESULT_CACHE_DURATION_STEP_MIN", "15"))
+
+V = TypeVar("V")
+
+
+def quantize(value: Optional[float], step: float) -> Optional[float]:
+    """Round value to the nearest multiple of step (None stays None)."""
+    if value is None or step <= 0:
+        return value
+    return round(round(value / step) * step, 6)
+
+
+def _canonical(value: Any) -> Any:
+    """Recursively sort lists and normalize strings so equivalent preferences compare equal."""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (list, tuple, set)):
+        items = [_canonical(v) for v in value]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+    if isinstance(value, str):
+        return normalize_text(value)
+    return value
+
+
+def canonical_request_key(request, generation: str,
+                          weight_step: float = RESULT_CACHE_WEIGHT_STEP_KG,
+                          duration_step: float = RESULT_CACHE_DURATION_STEP_MIN) -> str:
+    """
+    Build the cache key of a recommendation request.
+
+    Args:
+        request: RecommendationRequest (or any object with the same fields)
+        generation: Catalog generation the response is computed from
+        weight_step: Body weight bucket size in kg
+        duration_step: Exercise duration bucket size in minutes
+    """
+    fields = {
+        "user_query": normalize_text(request.user_query or ""),
+        "age": request.age,
+        "weight_kg": quantize(request.weight_kg, weight_step),
+        "sex": _canonical(request.sex),
+        "exercise_type": _canonical(request.exercise_type),
+        "exercise_duration_minutes": quantize(request.exercise_duration_minutes, duration_step),
+        "exercise_intensity": _canonical(request.exercise_intensity),
+        "timing": _canonical(request.timing),
+        "preferences": _canonical(request.preferences or {}),
+        "num_alternatives": getattr(request, "num_alternatives", 0),
+        "max_alternative_overlap": getattr(request, "max_alternative_overlap", None),
+        "timing_aware": getattr(request, "timing_aware", False),
+        "seed": getattr(request, "seed", None),
+        "generation": generation,
+    }
+    return json.dumps(fields, sort_keys=True, default=str)
+
+
+@dataclass
+class CacheStats:
+    """Counters describing cache effectiveness."""
+    hits: int = 0
+    misses: int = 0
+    expirations: int = 0
+    evictions: int = 0
+
+
+class TTLCache(Generic[V]):
+    """Thread-safe LRU cache whose entries also expire after a fixed TTL."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+                 clock=time.monotonic):
+        """
+        Args:
+            max_entries: Entries kept before the least recently used one is evicted
+            ttl_seconds: Lifetime of an entry
+            clock: Time source (injectable for tests)
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: V):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Global instance
+_recommendation_cache = None
+
+
+def get_recommendation_cache() -> Optional[TTLCache]:
+    """Get or create the global recommendation cache (None when disabled)."""
+    global _recommendation_cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _recommendation_cache is None:
+        _recommendation_cache = TTLCache()
+    return _recommendation_cache
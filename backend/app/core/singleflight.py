@@ -0,0 +1,91 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+When several identical requests arrive while the first one is still being
+computed (bursts of the frontend's example queries, client retries), only the
+first one runs; the others await its result. Keys are canonicalized requests,
+e.g. app.core.result_cache.canonical_request_key().
+
+Each SingleFlight group counts executed and coalesced calls in app.core.metrics
+as singleflight.<name>.executed / singleflight.<name>.coalesced.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.core import metrics
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key onto one computation."""
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Group name used in metric names
+        """
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn() unless a call with the same key is already in flight, in which
+        case wait for that call and return its result (or raise its exception).
+
+        The computation runs as its own task that every caller awaits through
+        asyncio.shield, the first caller included: cancelling any caller (a
+        client disconnect) only cancels that caller's wait, never the shared
+        computation or the other callers' results.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.increment(f"singleflight.{self.name}.coalesced")
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            metrics.increment(f"singleflight.{self.name}.executed")
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved when every caller has gone away
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def coalescing_rate(self) -> float:
+        """Share of calls that were served by another call's computation."""
+        executed = metrics.get_counter(f"singleflight.{self.name}.executed")
+        coalesced = metrics.get_counter(f"singleflight.{self.name}.coalesced")
+        total = executed + coalesced
+        return coalesced / total if total else 0.0
+
+
+# Groups registered by name
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """Get or create the named single-flight group."""
+    if name not in _groups:
+        _groups[name] = SingleFlight(name)
+    return _groups[name]
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, float]]:
+    """Executed/coalesced counts, coalescing rate and in-flight calls per group."""
+    return {
+        name: {
+            "executed": metrics.get_counter(f"singleflight.{name}.executed"),
+            "coalesced": metrics.get_counter(f"singleflight.{name}.coalesced"),
+            "coalescing_rate": group.coalescing_rate(),
+            "in_flight": group.in_flight,
+        }
+        for name, group in _groups.items()
+    }
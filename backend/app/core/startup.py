@@ -0,0 +1,223 @@
+"""
+Warm startup and readiness.
+
+GET /health only says the process is up. Before the first request can be
+served quickly, the worker has to import torch, sentence-transformers and
+chromadb, load the SentenceTransformer, open the catalog generation and the
+guideline store, and load the enhanced product vectors of the catalog.
+On startup a background thread runs these steps in order:
+
+- imports of the heavy libraries
+- embedding model
+- catalog generation (arrays, vector store, product snapshot)
+- guideline store (macro targeting service)
+- enhanced product vectors, precomputed when the generation was built (only
+  the legacy store, which has none, is encoded here)
+- warmup inference: one vector search and one Layer 2 optimization
+
+then freezes the warmed objects (see app.core.memory_policy) and flips GET
+/ready from 503 to 200. The report of /ready times every step, including the
+imports done before the startup thread ran (process start until then, on
+Linux), and flags a startup slower than STARTUP_BUDGET_SECONDS. A failing
+step leaves the worker not ready, with the error in the report.
+
+STARTUP_WARMUP=false skips the steps (everything loads lazily on the first
+request, as before) and reports ready right away.
+tests/utils/startup_report.py prints the breakdown, with per-package import
+times from python -X importtime.
+"""
+
+import importlib
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.core import metrics
+from app.core.memory_policy import get_memory_policy
+
+load_dotenv()
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "30"))
+
+# Imported first so their cost shows up separately (each after the ones before it)
+HEAVY_IMPORTS = ("torch", "sentence_transformers", "chromadb", "langchain_chroma", "langchain_openai")
+
+WARMUP_QUERY = "high protein snack after a 60 minute run"
+
+
+@dataclass
+class StartupStep:
+    name: str
+    seconds: float
+    error: Optional[str] = None
+
+
+@dataclass
+class StartupReport:
+    budget_seconds: float
+    steps: List[StartupStep] = field(default_factory=list)
+    ready: bool = False
+    failed: bool = False
+    total_seconds: float = 0.0
+
+    @property
+    def over_budget(self) -> bool:
+        return self.total_seconds > self.budget_seconds
+
+    def as_dict(self) -> Dict[str, object]:
+        return dict(asdict(self), over_budget=self.over_budget)
+
+
+def process_uptime() -> Optional[float]:
+    """Seconds since this process started (Linux), None if unknown."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _import_step(module: str) -> Callable[[], None]:
+    return lambda: importlib.import_module(module)
+
+
+def _load_embedding_model():
+    from app.core.global_embeddings import get_embedding_model
+    get_embedding_model()
+
+
+def _load_catalog():
+    from app.db.catalog_index import get_catalog_generation
+    generation = get_catalog_generation()
+    generation.open_vector_store()
+    generation.warm()
+
+
+def _load_guideline_store():
+    from app.core.recommendation import get_macro_service
+    get_macro_service()
+
+
+def _load_enhanced_vectors():
+    from app.core.enhanced_embedding import enhanced_product_vectors
+    from app.db.catalog_index import get_catalog_generation
+    from app.db.session import ReadSessionLocal
+    generation = get_catalog_generation()
+    if generation.enhanced_embeddings is not None:
+        # Stored in catalog.npz (and inherited from the pre-fork master); index them
+        generation.enhanced_row_of
+        return
+    # Legacy store: encode the catalog once into the enhanced vector cache
+    db = ReadSessionLocal()
+    try:
+        views = generation.snapshot(db).views
+    finally:
+        db.close()
+    if views:
+        enhanced_product_vectors(views)
+
+
+def _warmup_inference():
+    from app.core.layer2_macro_optimization import MacroTargets, optimize_macro_combination
+    from app.db.catalog_index import get_catalog_generation
+    from app.db.session import ReadSessionLocal
+    generation = get_catalog_generation()
+    results = generation.vector_store.query_similar_products(query=WARMUP_QUERY, top_k=10)
+    db = ReadSessionLocal()
+    try:
+        products = generation.snapshot(db).get_many(result['product_id'] for result in results)
+    finally:
+        db.close()
+    if products:
+        optimize_macro_combination(products, MacroTargets(20.0, 40.0, 8.0, 0.0), max_snacks=3)
+
+
+def default_steps() -> List[Tuple[str, Callable[[], None]]]:
+    """The startup steps, in order."""
+    return [(f"import {module}", _import_step(module)) for module in HEAVY_IMPORTS] + [
+        ("embedding model", _load_embedding_model),
+        ("catalog generation", _load_catalog),
+        ("guideline store", _load_guideline_store),
+        ("enhanced product vectors", _load_enhanced_vectors),
+        ("warmup inference", _warmup_inference),
+    ]
+
+
+class Startup:
+    """Runs the startup steps once and tracks readiness."""
+
+    def __init__(self, steps: Optional[List[Tuple[str, Callable[[], None]]]] = None,
+                 budget_seconds: float = STARTUP_BUDGET_SECONDS):
+        """
+        Args:
+            steps: (name, function) pairs to run in order (None = default_steps())
+            budget_seconds: Startup time above which the report is over budget
+        """
+        self.steps = steps
+        self.report = StartupReport(budget_seconds=budget_seconds)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.report.ready
+
+    def run(self) -> StartupReport:
+        """Run every step in this thread; the worker is ready once all succeeded."""
+        steps = default_steps() if self.steps is None else self.steps
+        uptime = process_uptime()
+        if uptime is not None:
+            self.report.steps.append(StartupStep("process start until warmup", uptime))
+        for name, fn in steps:
+            start = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                self.report.steps.append(StartupStep(name, time.perf_counter() - start, error=str(e)))
+                self.report.failed = True
+                print(f"Startup step '{name}' failed: {e}")
+                metrics.increment("startup.failed")
+                break
+            self.report.steps.append(StartupStep(name, time.perf_counter() - start))
+        self.report.total_seconds = sum(step.seconds for step in self.report.steps)
+
+        if not self.report.failed:
+            if steps:
+                get_memory_policy().freeze_after_warmup()
+            self.report.ready = True
+        if self.report.over_budget:
+            metrics.increment("startup.over_budget")
+            print(f"Startup took {self.report.total_seconds:.1f}s, over the {self.report.budget_seconds:.0f}s budget")
+        print("Startup: " + ", ".join(f"{step.name} {step.seconds:.2f}s" for step in self.report.steps))
+        return self.report
+
+    def start(self):
+        """Run the steps in a daemon thread (GET /health answers meanwhile)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name="startup", daemon=True)
+        self._thread.start()
+
+
+# Global instance
+_startup = None
+
+
+def get_startup() -> Startup:
+    """Get or create the process-wide startup tracker."""
+    global _startup
+    if _startup is None:
+        _startup = Startup(steps=None if STARTUP_WARMUP else [])
+    return _startup
+
+
+def start_warmup():
+    """Begin the startup steps in the background (called from the app lifespan)."""
+    get_startup().start()
@@ -0,0 +1,116 @@
+"""
+Async database access for the async endpoints.
+
+The endpoints are `async def`, so a synchronous Session blocks the event
+loop for every SQL round-trip. Here the same two engines as app.db.session
+(a writer and a read-only pool, same pool settings and SQLite pragmas) are
+opened through SQLAlchemy asyncio, with aiosqlite for SQLite (asyncpg for
+PostgreSQL):
+
+- get_async_db: AsyncSession on the writer (saving user inputs and macro targets)
+- get_async_read_db: AsyncSession on the read pool (catalog and history queries)
+
+The engines are created on first use, i.e. in each worker after the
+pre-fork. Sessions keep objects loaded after commit (expire_on_commit=False)
+since an async session cannot lazy-load them afterwards.
+ASYNC_DATABASE_URL overrides the URL derived from DATABASE_URL.
+tests/utils/benchmark_async_db.py compares concurrent throughput with the
+sync sessions.
+"""
+
+import os
+import threading
+from typing import AsyncIterator, Dict
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from app.db.session import (
+    DATABASE_READ_URL, DATABASE_URL, apply_sqlite_pragmas, engine_options, is_sqlite, is_sqlite_memory
+)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# Async driver of each backend
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def to_async_url(url: str) -> str:
+    """
+    The async-driver URL of a database URL (sqlite:///x.db -> sqlite+aiosqlite:///x.db).
+
+    Raises:
+        ValueError: If the backend has no async driver configured
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for database backend '{backend}'; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def create_async_database_engine(url: str, read_only: bool = False) -> AsyncEngine:
+    """Async twin of app.db.session.create_database_engine (same pool options and pragmas)."""
+    async_url = to_async_url(url)
+    new_engine = create_async_engine(async_url, **engine_options(url, read_only))
+    if is_sqlite(url) and not is_sqlite_memory(url):
+        apply_sqlite_pragmas(new_engine.sync_engine, read_only)
+    return new_engine
+
+
+# Global instances (per worker, created on first use)
+_engines: Dict[bool, AsyncEngine] = {}
+_sessionmakers: Dict[bool, async_sessionmaker] = {}
+_engines_lock = threading.RLock()
+
+
+def get_async_engine(read_only: bool = False) -> AsyncEngine:
+    """Get or create the async writer (or read-only) engine."""
+    engine = _engines.get(read_only)
+    if engine is None:
+        with _engines_lock:
+            if read_only not in _engines:
+                url = ASYNC_DATABASE_URL or (DATABASE_READ_URL if read_only else DATABASE_URL)
+                if read_only and url == DATABASE_URL and is_sqlite_memory(url):
+                    # One in-memory database: reads go through the writer
+                    _engines[read_only] = get_async_engine()
+                else:
+                    _engines[read_only] = create_async_database_engine(url, read_only=read_only)
+            engine = _engines[read_only]
+    return engine
+
+
+def get_async_sessionmaker(read_only: bool = False) -> async_sessionmaker:
+    """Session factory bound to get_async_engine(read_only)."""
+    factory = _sessionmakers.get(read_only)
+    if factory is None:
+        factory = async_sessionmaker(bind=get_async_engine(read_only), autoflush=False, expire_on_commit=False)
+        _sessionmakers[read_only] = factory
+    return factory
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+async def get_async_read_db() -> AsyncIterator[AsyncSession]:
+    async with get_async_sessionmaker(read_only=True)() as db:
+        yield db
+
+
+async def save_rows_async(db: AsyncSession, *rows):
+    """Async twin of app.db.session.save_rows: one short transaction, ids and server defaults loaded."""
+    db.add_all(rows)
+    await db.flush()
+    for row in rows:
+        await db.refresh(row)
+    await db.commit()
+
+
+async def dispose_async_engines():
+    """Close the async engines' pooled connections (app shutdown)."""
+    for engine in set(_engines.values()):
+        await engine.dispose()
+    _engines.clear()
+    _sessionmakers.clear()
@@ -0,0 +1,501 @@
+"""
+Versioned product catalog index with atomic, double-buffered swaps.
+
+A catalog generation bundles everything the recommendation pipeline reads
+from the product catalog:
+
+- vectors/        Chroma store with one vector per product
+- catalog.npz     product ids, nutrient matrix and normalized embedding matrix,
+                  plus the enhanced product vectors (app.core.enhanced_embedding)
+                  and the keys of their embedding texts
+- filters.json    hard-filter indexes (dietary value -> ids, allergen -> ids)
+- manifest.json   generation name, product count, build time
+
+Refreshes build a new generation in a hidden staging directory next to the
+live ones, validate it, rename it into place and then atomically replace the
+CURRENT pointer file. Running workers never see a half-built index: they keep
+serving from the generation they hold until the new one is fully loaded and
+warmed, then swap a single reference. In-flight requests finish on the old
+generation because they hold their own reference to it.
+
+Layout under PRODUCT_INDEX_ROOT (default ./data/product_index):
+
+    CURRENT
+    gen-20250101T120000-ab12cd/
+    gen-20250102T090000-ef34gh/
+
+Without a CURRENT pointer the legacy store at ./data/product_vector_store is
+served as generation "legacy".
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only
+
+from app.db.models import Product
+from app.db.product_view import CatalogSnapshot
+
+load_dotenv()
+
+PRODUCT_INDEX_ROOT = Path(os.getenv("PRODUCT_INDEX_ROOT", "./data/product_index"))
+LEGACY_VECTOR_STORE_PATH = Path("./data/product_vector_store")
+CATALOG_WATCH_SECONDS = float(os.getenv("CATALOG_WATCH_SECONDS", "10"))
+CATALOG_KEEP_GENERATIONS = int(os.getenv("CATALOG_KEEP_GENERATIONS", "3"))
+
+POINTER_FILE = "CURRENT"
+STAGING_PREFIX = ".staging-"
+
+# Column order of the nutrient matrix
+NUTRIENT_COLUMNS = ("protein", "carbs", "fat", "electrolytes_mg", "calories")
+
+
+class CatalogValidationError(RuntimeError):
+    """Raised when a freshly built generation fails validation."""
+
+
+class CatalogGeneration:
+    """One immutable, fully loaded version of the product catalog index."""
+
+    def __init__(self,
+                 generation: str,
+                 path: Optional[Path],
+                 product_ids: np.ndarray,
+                 nutrients: np.ndarray,
+                 embeddings: np.ndarray,
+                 filter_index: Dict[str, Dict[str, List[int]]],
+                 vector_store=None,
+                 enhanced_keys: Optional[np.ndarray] = None,
+                 enhanced_embeddings: Optional[np.ndarray] = None):
+        """
+        Args:
+            generation: Generation name (directory name, or "legacy")
+            path: Generation directory (None for the legacy store)
+            product_ids: Product ids, one per matrix row
+            nutrients: float32 matrix (n, len(NUTRIENT_COLUMNS))
+            embeddings: float32 matrix of L2-normalized product vectors (n, dim)
+            filter_index: {"dietary": {value: [ids]}, "allergens": {value: [ids]}}
+            vector_store: ProductVectorStore serving this generation
+            enhanced_keys: Keys of the products' enhanced embedding texts, one per row
+                (None for the legacy store and generations built before they were stored)
+            enhanced_embeddings: float32 matrix of normalized enhanced product vectors (n, dim)
+        """
+        self.generation = generation
+        self.path = path
+        self.product_ids = product_ids
+        self.nutrients = nutrients
+        self.embeddings = embeddings
+        self.filter_index = filter_index
+        self.vector_store = vector_store
+        self.enhanced_keys = enhanced_keys
+        self.enhanced_embeddings = enhanced_embeddings
+        self.row_of = {int(pid): row for row, pid in enumerate(product_ids)}
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+
+    @property
+    def product_count(self) -> int:
+        return len(self.product_ids)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """Content hash of the ids, nutrients and filter indexes (not the vectors)."""
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(self.product_ids, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(self.nutrients, dtype=np.float32).tobytes())
+        digest.update(json.dumps(self.filter_index, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    @cached_property
+    def enhanced_row_of(self) -> Dict[str, int]:
+        """Row of each enhanced embedding text key in enhanced_embeddings."""
+        if self.enhanced_keys is None:
+            return {}
+        return {str(key): row for row, key in enumerate(self.enhanced_keys)}
+
+    def ids_matching(self,
+                     dietary_requirements: Optional[Iterable[str]] = None,
+                     allergen_restrictions: Optional[Iterable[str]] = None) -> Set[int]:
+        """
+        Product ids satisfying every dietary requirement and containing none of the allergens.
+
+        Mirrors the semantics of the SQL pre-filter: a requirement matches either
+        dietary_flags or diet.
+        """
+        ids = set(int(pid) for pid in self.product_ids)
+        dietary = self.filter_index.get("dietary", {})
+        for requirement in dietary_requirements or []:
+            ids &= set(dietary.get(requirement, []))
+        allergens = self.filter_index.get("allergens", {})
+        for allergen in allergen_restrictions or []:
+            ids -= set(allergens.get(allergen, []))
+        return ids
+
+    def snapshot(self, db: Session) -> CatalogSnapshot:
+        """Detached ProductViews for this generation, read from the database once."""
+        if self._snapshot is None:
+            with self._snapshot_lock:
+                if self._snapshot is None:
+                    self._snapshot = CatalogSnapshot.load(db, self.generation, self.row_of.keys())
+        return self._snapshot
+
+    async def snapshot_async(self, db: AsyncSession) -> CatalogSnapshot:
+        """
+        snapshot() through an AsyncSession, without blocking the event loop on the query.
+
+        The lock is not held while awaiting (a coroutine waiting on it would block
+        the loop), so concurrent first calls may each read; the first one is kept.
+        """
+        if self._snapshot is None:
+            snapshot = await db.run_sync(CatalogSnapshot.load, self.generation, self.row_of.keys())
+            with self._snapshot_lock:
+                if self._snapshot is None:
+                    self._snapshot = snapshot
+        return self._snapshot
+
+    @classmethod
+    def load(cls, path: Path, open_vector_store: bool = True) -> "CatalogGeneration":
+        """Load a published generation directory."""
+        arrays = np.load(path / "catalog.npz")
+        with open(path / "filters.json") as f:
+            filter_index = json.load(f)
+        enhanced = "enhanced_embeddings" in arrays.files
+        generation = cls(
+            generation=path.name,
+            path=path,
+            product_ids=arrays["product_ids"],
+            nutrients=arrays["nutrients"],
+            embeddings=arrays["embeddings"],
+            filter_index=filter_index,
+            enhanced_keys=arrays["enhanced_keys"] if enhanced else None,
+            enhanced_embeddings=arrays["enhanced_embeddings"] if enhanced else None
+        )
+        if open_vector_store:
+            generation.open_vector_store()
+        return generation
+
+    def open_vector_store(self):
+        """Open the generation's Chroma store if it was loaded without one."""
+        if self.vector_store is None and self.path is not None:
+            from app.db.vector_store import ProductVectorStore
+            self.vector_store = ProductVectorStore(persist_directory=str(self.path / "vectors"))
+
+    @classmethod
+    def from_legacy(cls, db: Session, persist_directory: Path = LEGACY_VECTOR_STORE_PATH) -> "CatalogGeneration":
+        """Serve the pre-generation vector store, building the arrays in memory."""
+        from app.db.vector_store import ProductVectorStore
+        vector_store = ProductVectorStore(persist_directory=str(persist_directory))
+        product_ids, nutrients, filter_index = _catalog_arrays(db)
+        embeddings = _embedding_matrix(vector_store, product_ids)
+        return cls("legacy", None, product_ids, nutrients, embeddings, filter_index, vector_store)
+
+    def warm(self):
+        """Touch the index once so the first request after a swap does not pay for it."""
+        if self.vector_store is not None and self.product_count:
+            self.vector_store.vectorstore.similarity_search_by_vector(self.embeddings[0].tolist(), k=1)
+        from app.db.session import ReadSessionLocal
+        db = ReadSessionLocal()
+        try:
+            self.snapshot(db)
+        finally:
+            db.close()
+
+
+def _catalog_arrays(db: Session):
+    """Build (product_ids, nutrient matrix, filter index) from the products table."""
+    columns = [Product.id, Product.dietary_flags, Product.diet, Product.allergens]
+    columns += [getattr(Product, name) for name in NUTRIENT_COLUMNS]
+    products = db.query(Product).options(load_only(*columns)).order_by(Product.id).all()
+
+    product_ids = np.array([p.id for p in products], dtype=np.int64)
+    nutrients = np.array(
+        [[getattr(p, name) or 0.0 for name in NUTRIENT_COLUMNS] for p in products],
+        dtype=np.float32
+    ).reshape(len(products), len(NUTRIENT_COLUMNS))
+
+    dietary: Dict[str, List[int]] = {}
+    allergens: Dict[str, List[int]] = {}
+    for p in products:
+        diet = p.diet if isinstance(p.diet, list) else ([p.diet] if p.diet else [])
+        for value in set((p.dietary_flags or []) + diet):
+            dietary.setdefault(value, []).append(p.id)
+        for value in set(p.allergens or []):
+            allergens.setdefault(value, []).append(p.id)
+    return product_ids, nutrients, {"dietary": dietary, "allergens": allergens}
+
+
+def _embedding_matrix(vector_store, product_ids: np.ndarray) -> np.ndarray:
+    """Read product vectors back out of Chroma, ordered like product_ids and L2-normalized."""
+    stored = vector_store.vectorstore.get(include=["embeddings", "metadatas"])
+    by_id = {m["product_id"]: e for m, e in zip(stored["metadatas"], stored["embeddings"])}
+    if not by_id:
+        return np.zeros((len(product_ids), 0), dtype=np.float32)
+    dim = len(next(iter(by_id.values())))
+    matrix = np.zeros((len(product_ids), dim), dtype=np.float32)
+    for row, pid in enumerate(product_ids):
+        if int(pid) in by_id:
+            matrix[row] = by_id[int(pid)]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def validate_generation(path: Path, expected_count: int, vector_store=None):
+    """
+    Check a built generation before it is published.
+
+    Raises:
+        CatalogValidationError: if counts disagree, arrays contain non-finite
+            values, or the vector index cannot answer a query
+    """
+    generation = CatalogGeneration.load(path, open_vector_store=False)
+    if generation.product_count != expected_count:
+        raise CatalogValidationError(f"{path.name}: {generation.product_count} rows, expected {expected_count}")
+    if generation.nutrients.shape != (expected_count, len(NUTRIENT_COLUMNS)):
+        raise CatalogValidationError(f"{path.name}: nutrient matrix has shape {generation.nutrients.shape}")
+    if not np.isfinite(generation.nutrients).all() or not np.isfinite(generation.embeddings).all():
+        raise CatalogValidationError(f"{path.name}: non-finite values in catalog arrays")
+    if generation.enhanced_embeddings is not None:
+        if len(generation.enhanced_keys) != expected_count or len(generation.enhanced_embeddings) != expected_count:
+            raise CatalogValidationError(f"{path.name}: {len(generation.enhanced_embeddings)} enhanced vectors, "
+                                         f"expected {expected_count}")
+        if not np.isfinite(generation.enhanced_embeddings).all():
+            raise CatalogValidationError(f"{path.name}: non-finite values in enhanced vectors")
+    if vector_store is not None:
+        indexed = vector_store.vectorstore._collection.count()
+        if indexed != expected_count:
+            raise CatalogValidationError(f"{path.name}: vector index holds {indexed} products, expected {expected_count}")
+        if expected_count and not vector_store.vectorstore.similarity_search_by_vector(generation.embeddings[0].tolist(), k=1):
+            raise CatalogValidationError(f"{path.name}: vector index returned no results")
+
+
+def _read_pointer(root: Path) -> Optional[str]:
+    try:
+        return (root / POINTER_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish_generation(path: Path, root: Path = PRODUCT_INDEX_ROOT):
+    """Atomically point CURRENT at a built generation and prune old ones."""
+    tmp = root / f"{POINTER_FILE}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w") as f:
+        f.write(path.name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, root / POINTER_FILE)
+    print(f"Published catalog generation {path.name}")
+    prune_generations(root)
+
+
+def prune_generations(root: Path = PRODUCT_INDEX_ROOT, keep: int = CATALOG_KEEP_GENERATIONS):
+    """Delete all but the newest `keep` generations (never the current one)."""
+    current = _read_pointer(root)
+    generations = sorted(p for p in root.glob("gen-*") if p.is_dir())
+    for path in generations[:-max(keep, 2)]:
+        if path.name != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def build_generation(db: Session, root: Path = PRODUCT_INDEX_ROOT, incremental: bool = True,
+                     chunk_size: int = 256, batch_size: int = 64) -> Path:
+    """
+    Build and validate a new generation in a side directory.
+
+    With incremental=True the live generation's vectors (Chroma and enhanced)
+    are reused so only new or edited products are re-embedded. chunk_size and
+    batch_size are passed to ProductVectorStore.rebuild_from_database.
+
+    Returns:
+        Path of the new (validated, not yet published) generation
+
+    Raises:
+        CatalogValidationError: if any product failed to index, or validation fails
+    """
+    from app.core.enhanced_embedding import encode_catalog_vectors
+    from app.db.vector_store import ProductVectorStore
+
+    root.mkdir(parents=True, exist_ok=True)
+    name = f"gen-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+    staging = root / f"{STAGING_PREFIX}{name}"
+    staging.mkdir()
+    try:
+        current = _read_pointer(root)
+        source = root / current / "vectors" if current else LEGACY_VECTOR_STORE_PATH
+        if incremental and source.exists():
+            shutil.copytree(source, staging / "vectors")
+
+        vector_store = ProductVectorStore(persist_directory=str(staging / "vectors"))
+        stats = vector_store.rebuild_from_database(db, incremental=incremental, chunk_size=chunk_size,
+                                                   batch_size=batch_size)
+        if stats['failed']:
+            # Their old vectors (or none) would be published as if current
+            raise CatalogValidationError(f"{name}: {stats['failed']} products failed to index")
+
+        product_ids, nutrients, filter_index = _catalog_arrays(db)
+        embeddings = _embedding_matrix(vector_store, product_ids)
+        previous = _stored_enhanced_vectors(root / current) if incremental and current else None
+        views = CatalogSnapshot.load(db, name, product_ids.tolist()).get_many(product_ids.tolist())
+        enhanced_keys, enhanced_embeddings = encode_catalog_vectors(views, previous)
+        np.savez(staging / "catalog.npz", product_ids=product_ids, nutrients=nutrients, embeddings=embeddings,
+                 enhanced_keys=enhanced_keys, enhanced_embeddings=enhanced_embeddings)
+        with open(staging / "filters.json", "w") as f:
+            json.dump(filter_index, f)
+        with open(staging / "manifest.json", "w") as f:
+            json.dump({
+                "generation": name,
+                "product_count": int(len(product_ids)),
+                "nutrient_columns": list(NUTRIENT_COLUMNS),
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }, f, indent=2)
+
+        validate_generation(staging, len(product_ids), vector_store)
+        final = root / name
+        os.rename(staging, final)
+        return final
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def _stored_enhanced_vectors(path: Path) -> Optional[Dict[str, np.ndarray]]:
+    """Enhanced vectors by text key of a published generation (None if it has none)."""
+    try:
+        generation = CatalogGeneration.load(path, open_vector_store=False)
+    except FileNotFoundError:
+        return None
+    if generation.enhanced_embeddings is None:
+        return None
+    return {key: generation.enhanced_embeddings[row] for key, row in generation.enhanced_row_of.items()}
+
+
+# Live generation for this process
+_current_generation: Optional[CatalogGeneration] = None
+_swap_lock = threading.Lock()
+_watcher: Optional[threading.Thread] = None
+
+
+def _load_published_or_legacy(root: Path = PRODUCT_INDEX_ROOT) -> CatalogGeneration:
+    current = _read_pointer(root)
+    if current:
+        generation = CatalogGeneration.load(root / current)
+    else:
+        from app.db.session import ReadSessionLocal
+        db = ReadSessionLocal()
+        try:
+            generation = CatalogGeneration.from_legacy(db)
+        finally:
+            db.close()
+    generation.warm()
+    return generation
+
+
+def get_catalog_generation() -> CatalogGeneration:
+    """
+    Get the live catalog generation for this process.
+
+    Callers should fetch it once per request and use that reference throughout,
+    so a concurrent swap never mixes two generations within one request.
+    """
+    global _current_generation
+    generation = _current_generation
+    if generation is None:
+        with _swap_lock:
+            if _current_generation is None:
+                _current_generation = _load_published_or_legacy()
+            generation = _current_generation
+    return generation
+
+
+def live_catalog_generation() -> Optional[CatalogGeneration]:
+    """The live generation if one is loaded; unlike get_catalog_generation() it never loads one."""
+    return _current_generation
+
+
+def preload_catalog_generation(root: Path = PRODUCT_INDEX_ROOT) -> Optional[CatalogGeneration]:
+    """
+    Load the published generation without its vector store and make it live.
+
+    Used by the pre-fork master (app.prefork): the arrays, filter indexes and
+    product snapshot are inherited by the forked workers, which then open the
+    Chroma store with open_vector_store(). Returns None without a published
+    generation, since the legacy store needs its Chroma client for the arrays.
+    """
+    current = _read_pointer(root)
+    if not current:
+        return None
+    generation = CatalogGeneration.load(root / current, open_vector_store=False)
+    from app.db.session import ReadSessionLocal
+    db = ReadSessionLocal()
+    try:
+        generation.snapshot(db)
+    finally:
+        db.close()
+    swap_generation(generation)
+    return generation
+
+
+def swap_generation(generation: CatalogGeneration) -> CatalogGeneration:
+    """Make a fully loaded generation live; returns the previous one."""
+    global _current_generation
+    with _swap_lock:
+        previous, _current_generation = _current_generation, generation
+    print(f"Swapped catalog generation {previous.generation if previous else None} -> {generation.generation}")
+    return previous
+
+
+def reload_if_changed(root: Path = PRODUCT_INDEX_ROOT) -> bool:
+    """Load and swap in the published generation if it differs from the live one."""
+    published = _read_pointer(root)
+    live = _current_generation
+    if not published or (live is not None and live.generation == published):
+        return False
+    # Load and warm outside the lock; requests keep using the old generation meanwhile
+    generation = CatalogGeneration.load(root / published)
+    generation.warm()
+    swap_generation(generation)
+    return True
+
+
+def refresh_catalog(db: Session, root: Path = PRODUCT_INDEX_ROOT, incremental: bool = True) -> CatalogGeneration:
+    """Build, validate, publish and swap in a new generation in this process."""
+    path = build_generation(db, root, incremental=incremental)
+    publish_generation(path, root)
+    generation = CatalogGeneration.load(path)
+    generation.warm()
+    swap_generation(generation)
+    return generation
+
+
+def start_catalog_watcher(interval: float = CATALOG_WATCH_SECONDS, root: Path = PRODUCT_INDEX_ROOT):
+    """
+    Poll the CURRENT pointer in a daemon thread and swap in new generations.
+
+    This is how workers that did not run the refresh themselves pick it up.
+    """
+    global _watcher
+    if interval <= 0 or (_watcher is not None and _watcher.is_alive()):
+        return
+
+    def _watch():
+        while True:
+            time.sleep(interval)
+            try:
+                reload_if_changed(root)
+            except Exception as e:
+                print(f"Catalog watcher failed to load new generation: {e}")
+
+    _watcher = threading.Thread(target=_watch, name="catalog-watcher", daemon=True)
+    _watcher.start()
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, JSON, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, JSON, DateTime, Text, ForeignKey, Index
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from .session import Base
+from .types import EmbeddingVector
 
 """
 
@@ -16,9 +17,11 @@ SQLAlchemy models for the database
 
 class Product(Base):
     __tablename__ = "products"
+    # Names identify products for imports (INSERT ... ON CONFLICT (name), see app.db.product_import)
+    __table_args__ = (Index("ux_products_name", "name", unique=True),)
     
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
+    name = Column(String)
     brand = Column(String, index=True)
     description = Column(String)
     serving_size = Column(String)
@@ -56,9 +59,10 @@ class Product(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
-    # Embedding storage for vector search
-    embedding = Column(JSON)  # Store embedding as JSON array
-    embedding_text = Column(Text)  # The text used to generate the embedding
+    # Embedding storage for vector search. Deferred so catalog queries never
+    # load vectors unless they ask for them (undefer(Product.embedding)).
+    embedding = deferred(Column(EmbeddingVector()), group="embedding")  # float32 BLOB
+    embedding_text = deferred(Column(Text), group="embedding")  # The text used to generate the embedding
 
 
 class UserInput(Base):
@@ -0,0 +1,313 @@
+"""
+Streaming product import with upsert semantics.
+
+Feeds are read one product at a time, so memory stays bounded by the chunk
+size whatever the size of the file:
+
+- template: the line-per-field format of adding_products/products_input_template.txt
+  ("# PRODUCT n" starts a product, other "#" lines are comments)
+- csv:      a header row of product column names, one product per row
+- jsonl:    one JSON object per line (lists may be JSON arrays)
+
+Every product is validated into a ProductRecord (N / empty = missing,
+comma-separated lists, t/f booleans) and written in chunks of
+INSERT ... ON CONFLICT (name) statements, one transaction per chunk: a
+product whose name is already in the catalog is updated in place, or left
+alone with skip_existing. The existing names are read once up front so the
+import can report inserted and updated counts. Invalid products are reported
+and skipped.
+
+After the import, build an incremental catalog generation
+(app.db.catalog_index.build_generation) so that only new or edited products
+are re-embedded; adding_products/import_products.py does both.
+"""
+
+import csv
+import json
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from app.db.models import Product
+
+# Field order of the template format
+FIELD_ORDER = [
+    "name", "brand", "description", "serving_size", "calories", "protein", "carbs", "fat", "fiber", "sugar", "electrolytes_mg", "flavor", "texture", "form", "price_usd", "categories", "dietary_flags", "timing_suitability", "tags", "allergens", "diet", "link", "image_url", "source", "verified"
+]
+
+LIST_FIELDS = {"categories", "dietary_flags", "timing_suitability", "tags", "allergens", "diet"}
+FLOAT_FIELDS = {"calories", "protein", "carbs", "fat", "fiber", "sugar", "electrolytes_mg", "price_usd"}
+BOOL_FIELDS = {"verified"}
+
+PRODUCT_MARKER = re.compile(r"# PRODUCT \d+")
+MISSING = {"", "N"}
+TRUE_VALUES = {"t", "true", "y", "yes", "1"}
+FALSE_VALUES = {"f", "false", "n", "no", "0"}
+
+# Products per executemany of the upsert and per transaction
+IMPORT_CHUNK_SIZE = 1000
+
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+class ProductImportError(ValueError):
+    """Raised for a product that fails validation."""
+
+
+@dataclass
+class ProductRecord:
+    """One validated product of a feed, with the columns of the products table."""
+    name: str
+    brand: Optional[str] = None
+    description: Optional[str] = None
+    serving_size: Optional[str] = None
+    calories: float = 0.0
+    protein: float = 0.0
+    carbs: float = 0.0
+    fat: float = 0.0
+    fiber: float = 0.0
+    sugar: float = 0.0
+    electrolytes_mg: float = 0.0
+    flavor: Optional[str] = None
+    texture: Optional[str] = None
+    form: Optional[str] = None
+    price_usd: float = 0.0
+    categories: Optional[List[str]] = None
+    dietary_flags: Optional[List[str]] = None
+    timing_suitability: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    allergens: Optional[List[str]] = None
+    diet: Optional[List[str]] = None
+    link: Optional[str] = None
+    image_url: Optional[str] = None
+    source: Optional[str] = None
+    verified: bool = False
+
+    @classmethod
+    def from_values(cls, values: Dict[str, Any]) -> "ProductRecord":
+        """
+        Validate raw feed values (strings, or JSON values) into a record.
+
+        Missing values (absent, None, "" or "N") become 0.0 for numbers, False
+        for booleans and None otherwise. Unknown columns are ignored.
+
+        Raises:
+            ProductImportError: If the name is missing or a number or boolean does not parse
+        """
+        record = {}
+        for name in FIELD_ORDER:
+            value = values.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or (isinstance(value, str) and value in MISSING):
+                if name in FLOAT_FIELDS:
+                    record[name] = 0.0
+                elif name in BOOL_FIELDS:
+                    record[name] = False
+                else:
+                    record[name] = None
+            elif name in LIST_FIELDS:
+                items = value.split(",") if isinstance(value, str) else value
+                if not isinstance(items, (list, tuple)):
+                    raise ProductImportError(f"{name}: '{value}' is not a list")
+                record[name] = [str(item).strip() for item in items if str(item).strip()]
+            elif name in FLOAT_FIELDS:
+                try:
+                    record[name] = float(value)
+                except (TypeError, ValueError):
+                    raise ProductImportError(f"{name}: '{value}' is not a number")
+            elif name in BOOL_FIELDS:
+                record[name] = _parse_bool(name, value)
+            else:
+                record[name] = str(value)
+        if not record["name"]:
+            raise ProductImportError("name is missing")
+        return cls(**record)
+
+    def as_row(self) -> Dict[str, Any]:
+        """Column values for the insert (a shallow copy; asdict would deep-copy every list)."""
+        return dict(self.__dict__)
+
+
+def _parse_bool(name: str, value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ProductImportError(f"{name}: '{value}' is not t or f")
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    invalid: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> int:
+        return self.inserted + self.updated
+
+
+def iter_template_values(lines: Iterable[str]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(line number of the marker, values) per product of the template format."""
+    position, block = None, []
+    for number, line in enumerate(lines, start=1):
+        if PRODUCT_MARKER.search(line):
+            if position is not None and block:
+                yield position, dict(zip(FIELD_ORDER, block))
+            position, block = number, []
+            continue
+        line = line.strip()
+        if position is not None and line and not line.startswith("#"):
+            block.append(line)
+    if position is not None and block:
+        yield position, dict(zip(FIELD_ORDER, block))
+
+
+def iter_csv_values(f: TextIO) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(line number, values) per row of a CSV feed with a header row."""
+    reader = csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_jsonl_lines(f: TextIO) -> Iterator[Tuple[int, str]]:
+    """(line number, line) per non-empty line of a JSON Lines feed (parsed by parse_json_object)."""
+    for number, line in enumerate(f, start=1):
+        if line.strip():
+            yield number, line
+
+
+def parse_json_object(line: str) -> Dict[str, Any]:
+    try:
+        values = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ProductImportError(f"invalid JSON: {e.msg}")
+    if not isinstance(values, dict):
+        raise ProductImportError("not a JSON object")
+    return values
+
+
+def detect_format(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "template"
+
+
+def read_products(f: TextIO, feed_format: str, stats: ImportStats) -> Iterator[ProductRecord]:
+    """
+    Validated records of a feed, read incrementally; invalid products are counted and skipped.
+
+    Args:
+        f: Open text file of the feed
+        feed_format: "template", "csv" or "jsonl"
+        stats: Receives the read and invalid counts and the error messages
+    """
+    # format -> (reader yielding (position, raw product), parser of the raw product)
+    readers = {
+        "template": (iter_template_values, dict),
+        "csv": (iter_csv_values, dict),
+        "jsonl": (iter_jsonl_lines, parse_json_object),
+    }
+    if feed_format not in readers:
+        raise ValueError(f"Unknown feed format '{feed_format}' (expected one of {sorted(readers)})")
+    reader, parse = readers[feed_format]
+    for position, raw in reader(f):
+        stats.read += 1
+        try:
+            yield ProductRecord.from_values(parse(raw))
+        except ProductImportError as e:
+            stats.invalid += 1
+            stats.errors.append(f"line {position}: {e}")
+
+
+def ensure_unique_names(db: Session):
+    """
+    Create the unique index on products.name that ON CONFLICT (name) needs.
+
+    Databases created before the index was part of the model get it here; it
+    fails if the table already holds duplicate names.
+    """
+    index = next(index for index in Product.__table__.indexes if index.name == "ux_products_name")
+    index.create(db.connection(), checkfirst=True)
+
+
+def upsert_statement(dialect_name: str, skip_existing: bool = False):
+    """
+    INSERT ... ON CONFLICT (name) for the products table, executed with a list of rows.
+
+    The statement is compiled once and run as an executemany; a multi-row
+    VALUES clause would be recompiled for every chunk.
+    """
+    if dialect_name not in UPSERT_INSERTS:
+        raise ValueError(f"Upserts are not supported on '{dialect_name}'")
+    statement = UPSERT_INSERTS[dialect_name](Product.__table__)
+    if skip_existing:
+        return statement.on_conflict_do_nothing(index_elements=["name"])
+    updates = {name: statement.excluded[name] for name in FIELD_ORDER if name != "name"}
+    updates["updated_at"] = func.now()
+    return statement.on_conflict_do_update(index_elements=["name"], set_=updates)
+
+
+def import_products(db: Session, records: Iterable[ProductRecord], chunk_size: int = IMPORT_CHUNK_SIZE,
+                    skip_existing: bool = False, stats: Optional[ImportStats] = None) -> ImportStats:
+    """
+    Upsert records by name in chunks, committing each chunk.
+
+    Args:
+        db: Database session (the writer)
+        records: Validated products, e.g. from read_products
+        chunk_size: Products per upsert executemany and transaction
+        skip_existing: Leave products whose name exists untouched (default: update them)
+        stats: Counts to add to (read_products fills in read and invalid)
+
+    Returns:
+        Import counts
+    """
+    stats = stats or ImportStats()
+    ensure_unique_names(db)
+    db.commit()
+    existing: Set[str] = set(db.scalars(select(Product.name)))
+    statement = upsert_statement(db.get_bind().dialect.name, skip_existing)
+
+    chunk: Dict[str, Dict[str, Any]] = {}
+
+    def flush():
+        db.execute(statement, list(chunk.values()))
+        db.commit()
+        chunk.clear()
+        print(f"Imported {stats.changed + stats.skipped} products "
+              f"({stats.inserted} new, {stats.updated} updated, {stats.skipped} skipped)")
+
+    for record in records:
+        if record.name in existing:
+            if skip_existing:
+                stats.skipped += 1
+                continue
+            stats.updated += 1
+        else:
+            stats.inserted += 1
+            existing.add(record.name)
+        # A name twice in one statement cannot be upserted; the later product wins
+        chunk.pop(record.name, None)
+        chunk[record.name] = record.as_row()
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return stats
@@ -0,0 +1,120 @@
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.db.models import Product
+
+"""
+
+Read-only product views for the recommendation pipeline
+
+- ProductView: Immutable, slotted copy of the Product columns the pipeline reads
+- CatalogSnapshot: All ProductViews of one catalog generation, built once
+
+Filtering, ranking and Layer 2 optimization read nutrients in tight loops. Doing
+that on ORM instances goes through instrumented attributes and keeps the rows
+(and the session) alive for the whole request. ProductView has the same
+attribute names as Product, so pipeline code and ProductSchema.model_validate
+work on either, but it is detached from the session and hashable.
+
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class ProductView:
+    id: int
+    name: str
+    brand: Optional[str] = None
+    description: Optional[str] = None
+    serving_size: Optional[str] = None
+
+    # Nutrition facts
+    calories: Optional[float] = None
+    protein: Optional[float] = None
+    carbs: Optional[float] = None
+    fat: Optional[float] = None
+    fiber: Optional[float] = None
+    sugar: Optional[float] = None
+    electrolytes_mg: Optional[float] = None
+
+    # Metadata used by vector search and soft preferences
+    flavor: Optional[str] = None
+    texture: Optional[str] = None
+    form: Optional[str] = None
+    price_usd: Optional[float] = None
+
+    # Classifications (tuples so the view stays immutable)
+    categories: Tuple[str, ...] = ()
+    dietary_flags: Tuple[str, ...] = ()
+    timing_suitability: Tuple[str, ...] = ()
+    tags: Tuple[str, ...] = ()
+    allergens: Tuple[str, ...] = ()
+    diet: Tuple[str, ...] = ()
+
+    # External links and bookkeeping
+    link: Optional[str] = None
+    image_url: Optional[str] = None
+    source: Optional[str] = None
+    verified: bool = False
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_orm(cls, product: Product) -> "ProductView":
+        """Copy the scalar columns of a Product (embedding columns are never touched)."""
+        values = {}
+        for field in fields(cls):
+            value = getattr(product, field.name)
+            if field.name in _LIST_FIELDS:
+                value = _as_tuple(value)
+            elif field.name == "verified":
+                value = bool(value)
+            values[field.name] = value
+        return cls(**values)
+
+
+_LIST_FIELDS = frozenset(("categories", "dietary_flags", "timing_suitability", "tags", "allergens", "diet"))
+
+
+def _as_tuple(value) -> Tuple[str, ...]:
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+
+class CatalogSnapshot:
+    """ProductViews for one catalog generation, in product id order."""
+
+    def __init__(self, generation: str, views: Iterable[ProductView]):
+        self.generation = generation
+        self.views: Tuple[ProductView, ...] = tuple(views)
+        self.by_id: Dict[int, ProductView] = {view.id: view for view in self.views}
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+    def get_many(self, product_ids: Iterable[int]) -> List[ProductView]:
+        """Views for the given ids, in the given order, skipping unknown ids."""
+        return [self.by_id[pid] for pid in product_ids if pid in self.by_id]
+
+    @classmethod
+    def load(cls, db: Session, generation: str, product_ids: Optional[Iterable[int]] = None) -> "CatalogSnapshot":
+        """
+        Read every product once and detach it into views.
+
+        Args:
+            db: Database session
+            generation: Name of the catalog generation the snapshot belongs to
+            product_ids: Restrict the snapshot to these ids (the generation's rows)
+        """
+        keep = set(product_ids) if product_ids is not None else None
+        views = [
+            ProductView.from_orm(product)
+            for product in db.query(Product).order_by(Product.id).all()
+            if keep is None or product.id in keep
+        ]
+        return cls(generation, views)
@@ -1,6 +1,35 @@
-from sqlalchemy import create_engine
+"""
+Database engines and sessions.
+
+Two engines share DATABASE_URL:
+
+- engine / SessionLocal / get_db: the writer, for inserts and updates
+  (user inputs, macro targets, catalog refreshes).
+- read_engine / ReadSessionLocal / get_read_db: pooled read-only connections
+  for catalog and history queries.
+
+On SQLite every connection gets the tuning pragmas on connect: WAL journal
+(readers never block the writer or each other), a busy timeout instead of
+immediate "database is locked" errors, synchronous=NORMAL (safe with WAL),
+a larger page cache and memory-mapped reads. SQLite allows one writer at a
+time, so the writer engine has a single pooled connection: writes queue for
+it in the process instead of spinning on the file lock. Keep write
+transactions short (no model or LLM calls between the first statement and
+the commit). Read connections are query_only, so a stray write through them
+fails instead of taking the lock.
+
+Other backends (e.g. PostgreSQL) get a regular pool with pre-ping and
+recycling; DATABASE_READ_URL points the read engine at a replica.
+
+The async endpoints use the same two engines through SQLAlchemy asyncio
+(see app.db.async_session).
+"""
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
+from typing import Any, Dict, List
 import os
 from dotenv import load_dotenv
 
@@ -11,8 +40,110 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/products_and_kds.db")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set. Create a .env file with DATABASE_URL=sqlite:///./data/products_and_kds.db")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or DATABASE_URL
+
+# SQLite tuning (applied to every connection)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_MB = int(os.getenv("SQLITE_CACHE_SIZE_MB", "64"))
+SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+# Seconds a write waits for the single writer connection
+SQLITE_WRITER_TIMEOUT_SECONDS = float(os.getenv("SQLITE_WRITER_TIMEOUT_SECONDS", "30"))
+
+# Pool settings of other backends
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def is_sqlite_memory(url: str) -> bool:
+    """In-memory SQLite: every connection is its own database, so there is nothing to split."""
+    database = make_url(url).database
+    return is_sqlite(url) and (not database or database == ":memory:" or "mode=memory" in str(url))
+
+
+def sqlite_pragmas(read_only: bool = False) -> List[str]:
+    """The PRAGMA statements run on each new SQLite connection."""
+    pragmas = [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA journal_mode = WAL",
+        f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+        f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_MB * 1024}",  # negative = KiB
+        f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE_MB * 1024 * 1024}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    return pragmas
+
+
+def engine_options(url: str, read_only: bool = False) -> Dict[str, Any]:
+    """
+    create_engine() keyword arguments for a URL.
+
+    Args:
+        url: Database URL
+        read_only: Options of the read engine instead of the writer
+
+    Returns:
+        Keyword arguments for create_engine
+    """
+    if is_sqlite_memory(url):
+        return {"connect_args": {"check_same_thread": False}}
+    if is_sqlite(url):
+        options = {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        if read_only:
+            options.update(pool_size=SQLITE_READ_POOL_SIZE, max_overflow=SQLITE_READ_POOL_SIZE)
+        else:
+            options.update(pool_size=1, max_overflow=0, pool_timeout=SQLITE_WRITER_TIMEOUT_SECONDS)
+        return options
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": True,
+    }
+
+
+def apply_sqlite_pragmas(target_engine, read_only: bool = False):
+    """Run sqlite_pragmas() on every new connection of a (sync) engine."""
+    pragmas = sqlite_pragmas(read_only)
+
+    @event.listens_for(target_engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def create_database_engine(url: str, read_only: bool = False):
+    """Create an engine for `url` with engine_options() and, on SQLite, the tuning pragmas."""
+    new_engine = create_engine(url, **engine_options(url, read_only))
+    if is_sqlite(url) and not is_sqlite_memory(url):
+        apply_sqlite_pragmas(new_engine, read_only)
+    return new_engine
+
+
+engine = create_database_engine(DATABASE_URL)
+if DATABASE_READ_URL == DATABASE_URL and is_sqlite_memory(DATABASE_URL):
+    read_engine = engine
+else:
+    read_engine = create_database_engine(DATABASE_READ_URL, read_only=True)
+
+# expire_on_commit=False: committed objects stay loaded, so reading them after
+# the commit does not open another transaction on the writer connection
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
@@ -21,4 +152,25 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def save_rows(db, *rows):
+    """Insert rows in one short transaction, loading their ids and server defaults (created_at)."""
+    db.add_all(rows)
+    db.flush()
+    for row in rows:
+        db.refresh(row)
+    db.commit()
+
+def dispose_engines():
+    """Close every pooled connection (before forking workers)."""
+    engine.dispose()
+    if read_engine is not engine:
+        read_engine.dispose()
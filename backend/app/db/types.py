@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+"""
+
+Custom column types
+
+- EmbeddingVector: Stores an embedding as a packed little-endian float BLOB
+
+"""
+
+
+class EmbeddingVector(TypeDecorator):
+    """
+    Embedding stored as raw float32 (or float16) bytes instead of a JSON list.
+
+    A 384-dimensional vector takes 1.5 KB as float32 (768 bytes as float16)
+    versus ~8 KB of JSON text, and decoding is a single np.frombuffer() call.
+    Rows written before the switch still hold JSON text; they are decoded
+    transparently until adding_products/migrate_embeddings_to_binary.py
+    rewrites them.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dtype: str = "float32", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return np.asarray(value, dtype=self.dtype).tobytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # Legacy JSON array
+            return np.asarray(json.loads(value), dtype=np.float32)
+        return np.frombuffer(value, dtype=self.dtype).astype(np.float32)
@@ -1,12 +1,13 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional
 from sqlalchemy.orm import Session
 from langchain_chroma import Chroma
 from langchain.embeddings.base import Embeddings
 import numpy as np
 from app.db.models import Product
-from app.core.embedding import generate_product_embedding_text, generate_query_embedding
+from app.core.embedding import generate_product_embedding_text, generate_query_embedding, embedding_text_hash
 from app.core.global_embeddings import get_embedding_model
-import gc
+from app.core.memory_policy import checkpoint
+from app.core.diversity import mmr_rerank, normalize_rows
 
 """
 Responsible for storing and retrieving embeddings from a vector database
@@ -42,17 +43,11 @@ class ProductVectorStore:
             def embed_documents(self, texts):
                 model = self._get_model()
                 embeddings = model.encode(texts)
-                # Clear model reference to help with memory management
-                self.model = None
-                gc.collect()
                 return embeddings.tolist()
 
             def embed_query(self, text):
                 model = self._get_model()
                 embedding = model.encode([text])
-                # Clear model reference to help with memory management
-                self.model = None
-                gc.collect()
                 return embedding.tolist()[0]
 
         return SentenceTransformerEmbeddings()
@@ -76,10 +71,12 @@ class ProductVectorStore:
 
     def _create_vectorstore(self):
         """
-        Create a new vector store.
+        Create a new, empty vector store, dropping any existing collection.
         """
         # Lazy import to avoid loading heavy dependencies at startup
         from langchain_chroma import Chroma
+        if getattr(self, "vectorstore", None) is not None:
+            self.vectorstore.delete_collection()
         # Create empty vector store
         self.vectorstore = Chroma(
             persist_directory=self.persist_directory,
@@ -87,21 +84,10 @@ class ProductVectorStore:
         )
         print(f"Created new product vector store at {self.persist_directory}")
 
-    def add_product_embedding(self, product: Product):
-        """
-        Store product embedding in vector DB.
-
-        Args:
-            product: Product object with all metadata
-        """
-        # Generate embedding text
-        embedding_text = generate_product_embedding_text(product)
-
-        # Generate embedding using global singleton
-        embedding = get_embedding_model().encode([embedding_text])
-
-        # Create metadata for filtering (convert lists to strings for Chroma compatibility)
-        metadata = {
+    @staticmethod
+    def _product_metadata(product: Product, text_hash: str) -> Dict[str, Any]:
+        """Metadata stored alongside each product vector (lists flattened for Chroma)."""
+        return {
             'product_id': product.id,
             'name': product.name,
             'brand': product.brand,
@@ -112,20 +98,64 @@ class ProductVectorStore:
             'dietary_flags': ', '.join(product.dietary_flags or []),
             'tags': ', '.join(product.tags or []),
             'allergens': ', '.join(product.allergens or []),
-            'timing_suitability': ', '.join(product.timing_suitability or [])
+            'timing_suitability': ', '.join(product.timing_suitability or []),
+            'embedding_hash': text_hash
         }
 
-        # Add to vector store
-        from langchain.schema import Document
-        doc = Document(
-            page_content=embedding_text,
-            metadata=metadata
+    def _indexed_products(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Map product_id -> {'ids': [...], 'hash': embedding_hash} for everything in the index.
+
+        Entries written before hashes were stored have hash None, so they are
+        re-embedded once by the next incremental rebuild.
+        """
+        existing = self.vectorstore.get(include=["metadatas"])
+        indexed = {}
+        for doc_id, metadata in zip(existing['ids'], existing['metadatas']):
+            entry = indexed.setdefault(metadata['product_id'], {'ids': [], 'hash': None})
+            entry['ids'].append(doc_id)
+            entry['hash'] = metadata.get('embedding_hash')
+        return indexed
+
+    def _index_batch(self, products: List[Product], texts: List[str], hashes: List[str],
+                     stale_ids: Optional[List[str]] = None, batch_size: int = 64):
+        """
+        Encode a batch of products in one call and bulk-upsert them into the index.
+
+        Args:
+            products: Products to (re)index
+            texts: Embedding texts, parallel to products
+            hashes: Embedding text hashes, parallel to products
+            stale_ids: Index document ids to remove first (previous versions)
+            batch_size: Encoder batch size
+        """
+        if stale_ids:
+            self.vectorstore.delete(ids=stale_ids)
+        embeddings = get_embedding_model().encode(texts, batch_size=batch_size)
+        # The collection's upsert, since Chroma.add_texts takes no vectors and would
+        # re-encode the texts; the vectors are needed here for products.embedding
+        self.vectorstore._collection.upsert(
+            ids=[f"product-{p.id}" for p in products],
+            embeddings=embeddings.tolist(),
+            documents=texts,
+            metadatas=[self._product_metadata(p, h) for p, h in zip(products, hashes)]
         )
-        self.vectorstore.add_documents([doc])
+        # Update products with embedding info
+        for product, text, embedding in zip(products, texts, embeddings):
+            product.embedding = embedding
+            product.embedding_text = text
 
-        # Update product with embedding info
-        product.embedding = embedding.tolist()[0]
-        product.embedding_text = embedding_text
+    def add_product_embedding(self, product: Product):
+        """
+        Store product embedding in vector DB.
+
+        Args:
+            product: Product object with all metadata
+        """
+        embedding_text = generate_product_embedding_text(product)
+        # Replace any previous version of this product in the index
+        stale_ids = self.vectorstore.get(where={"product_id": product.id})['ids']
+        self._index_batch([product], [embedding_text], [embedding_text_hash(embedding_text)], stale_ids)
 
     def query_similar_products(
         self,
@@ -133,7 +163,8 @@ class ProductVectorStore:
         top_k: int = 20,
         hard_filters: Optional[Dict[str, Any]] = None,
         use_mmr: bool = True,
-        mmr_lambda: float = 0.8  # Higher lambda = more emphasis on relevance
+        mmr_lambda: float = 0.8,  # Higher lambda = more emphasis on relevance
+        candidate_ids: Optional[Iterable[int]] = None
     ) -> List[Dict[str, Any]]:
         """
         Return similar products with hard filtering and optional MMR diversity.
@@ -143,183 +174,178 @@ class ProductVectorStore:
             top_k: Number of results to retrieve
             hard_filters: Dict of hard constraints (e.g., {"dietary_flags": ["vegan"]})
             use_mmr: Whether to apply Maximal Marginal Relevance for diversity
-            mmr_lambda: MMR parameter (0.0 = max diversity, 10 = max relevance)
+            mmr_lambda: MMR parameter (0.0 = max diversity, 1.0 = max relevance)
+            candidate_ids: Only return these product ids (applied before MMR)
 
         Returns:
-            List of product results with scores
+            List of product results with scores ('score' is the Chroma distance,
+            'similarity' the cosine similarity to the query)
         """
-        # Retrieve candidates using similarity search first
-        results = self.vectorstore.similarity_search_with_score(
-            query,
-            k=top_k * 3  # Get more candidates for filtering and MMR
+        allowed = set(candidate_ids) if candidate_ids is not None else None
+        if allowed is not None and not allowed:
+            return []
+
+        # Retrieve candidates with their vectors so MMR needs no second lookup
+        query_embedding = get_embedding_model().encode([query])[0]
+        results = self.vectorstore._collection.query(
+            query_embeddings=[np.asarray(query_embedding).tolist()],
+            n_results=top_k * 3,  # Get more candidates for filtering and MMR
+            where={"product_id": {"$in": sorted(allowed)}} if allowed is not None else None,
+            include=["metadatas", "documents", "distances", "embeddings"]
         )
-        
-        # Convert to candidates with similarity scores
+
+        # Convert to candidates, one per product
         candidates = []
-        for doc, score in results:
+        candidate_vectors = []
+        seen_product_ids = set()
+        for metadata, text, distance, vector in zip(results['metadatas'][0], results['documents'][0],
+                                                    results['distances'][0], results['embeddings'][0]):
+            product_id = metadata['product_id']
+            if product_id in seen_product_ids or (allowed is not None and product_id not in allowed):
+                continue
+            seen_product_ids.add(product_id)
             candidates.append({
-                'product_id': doc.metadata['product_id'],
-                'metadata': doc.metadata,
-                'score': score,
-                'text': doc.page_content
+                'product_id': product_id,
+                'metadata': metadata,
+                'score': distance,
+                'text': text
             })
-        
-        # Clear results object to free memory
-        del results
-        import gc
-        gc.collect()
+            candidate_vectors.append(vector)
         
         # Apply hard filters in Python if specified
         if hard_filters:
-            filtered_candidates = []
-            for candidate in candidates:
-                matches_all_filters = True
-                for key, value in hard_filters.items():
-                    if key == "dietary_flags" and isinstance(value, list):
-                        # Check if any dietary flag is in the comma-separated string
-                        stored_flags = candidate['metadata'].get(key, "").split(", ")
-                        if not any(flag in stored_flags for flag in value):
-                            matches_all_filters = False
-                            break
-                    elif isinstance(value, list):
-                        # For other list fields, check exact match
-                        stored_value = candidate['metadata'].get(key, "")
-                        if stored_value not in value:
-                            matches_all_filters = False
-                            break
-                    else:
-                        # For single values, check exact match
-                        if candidate['metadata'].get(key) != value:
-                            matches_all_filters = False
-                            break
-                
-                if matches_all_filters:
-                    filtered_candidates.append(candidate)
-            
-            candidates = filtered_candidates
-
-        # Apply MMR if requested (very conservative approach)
-        if use_mmr and len(candidates) > 1:
-            # Only apply MMR to the top 3 results and only if there's significant diversity benefit
-            top_candidates = candidates[:3]
-            remaining_candidates = candidates[3:]
-            
-            # Apply MMR to top candidates
-            top_candidates = self._apply_mmr(top_candidates, query, mmr_lambda)
-            
-            # Combine MMR results with remaining candidates
-            candidates = top_candidates + remaining_candidates
-
-        # Return top_k results
-        # Clear candidates to free memory
+            keep = [i for i, candidate in enumerate(candidates)
+                    if self._matches_hard_filters(candidate['metadata'], hard_filters)]
+            candidates = [candidates[i] for i in keep]
+            candidate_vectors = [candidate_vectors[i] for i in keep]
+
+        if candidates:
+            vectors = normalize_rows(np.asarray(candidate_vectors, dtype=np.float32))
+            similarities = vectors @ normalize_rows(query_embedding)[0]
+            for candidate, similarity in zip(candidates, similarities):
+                candidate['similarity'] = float(similarity)
+
+            # Diversify the whole candidate list over the product embeddings
+            if use_mmr and len(candidates) > 1:
+                order = mmr_rerank(similarities, vectors, lambda_param=mmr_lambda, k=top_k)
+                candidates = [candidates[i] for i in order]
+
+        # Return top_k results; memory is reclaimed by the amortized policy
         final_results = candidates[:top_k]
-        del candidates
-        import gc
-        gc.collect()
+        checkpoint()
         
         return final_results
 
-    def _apply_mmr(self, candidates: List[Dict], query: str, lambda_param: float) -> List[Dict]:
-        """
-        Apply Maximal Marginal Relevance for diversity.
-
-        Args:
-            candidates: List of candidate products with scores
-            query: Original query
-            lambda_param: MMR parameter (0.0 = max diversity, 10 = max relevance)
-
-        Returns:
-            Reordered candidates with diversity
-        """
-        if len(candidates) <= 1:
-            return candidates
-
-        # Sort by relevance score
-        candidates.sort(key=lambda x: x['score'], reverse=True)
-
-        # Initialize selected and remaining
-        selected = [candidates[0]]
-        remaining = candidates[1:]
-
-        # Apply MMR selection (very conservative)
-        while remaining and len(selected) < len(candidates):
-            # Calculate MMR scores
-            mmr_scores = []
-            for candidate in remaining:
-                # Relevance score (already calculated)
-                relevance = candidate['score']
-
-                # Diversity score (very conservative)
-                diversity = 0.0
-                if selected:
-                    similarities = []
-                    for selected_item in selected:
-                        # Only consider diversity if forms are very different
-                        if candidate['metadata']['form'] != selected_item['metadata']['form']:
-                            # Check if forms are significantly different
-                            form_pairs = [
-                                ('bar', 'powder'), ('bar', 'cup'), ('bar', 'whole'),
-                                ('powder', 'cup'), ('powder', 'whole'), ('cup', 'whole')
-                            ]
-                            if (candidate['metadata']['form'], selected_item['metadata']['form']) in form_pairs:
-                                similarities.append(0.01)  # Very small diversity bonus
-                            else:
-                                similarities.append(0.0)
-                        else:
-                            similarities.append(0.0)  # No penalty for same form
-                    diversity = 1 - max(similarities) if similarities else 0.0
-
-                # MMR score (heavily weighted toward relevance)
-                mmr_score = lambda_param * relevance + (1 - lambda_param) * diversity
-                mmr_scores.append((mmr_score, candidate))
-
-            # Select item with highest MMR score
-            mmr_scores.sort(key=lambda x: x[0], reverse=True)
-            selected.append(mmr_scores[0][1])
-            remaining = [item[1] for item in mmr_scores[1:]]
-
-        return selected
-
-    def rebuild_from_database(self, db: Session):
+    @staticmethod
+    def _matches_hard_filters(metadata: Dict[str, Any], hard_filters: Dict[str, Any]) -> bool:
+        """Check a candidate's index metadata against hard constraints."""
+        for key, value in hard_filters.items():
+            if key == "dietary_flags" and isinstance(value, list):
+                # Check if any dietary flag is in the comma-separated string
+                stored_flags = metadata.get(key, "").split(", ")
+                if not any(flag in stored_flags for flag in value):
+                    return False
+            elif isinstance(value, list):
+                # For other list fields, check exact match
+                if metadata.get(key, "") not in value:
+                    return False
+            else:
+                # For single values, check exact match
+                if metadata.get(key) != value:
+                    return False
+        return True
+
+    def rebuild_from_database(self, db: Session, incremental: bool = True,
+                              chunk_size: int = 256, batch_size: int = 64) -> Dict[str, int]:
         """
         Rebuild vector store from all products in database.
 
+        Products are streamed in id order, chunk_size rows at a time, and each
+        chunk is encoded and upserted in bulk. In incremental mode, products whose
+        embedding text hash matches the indexed one are skipped and products no
+        longer in the database are removed from the index. A chunk that fails to
+        encode or upsert is counted as failed and the rebuild moves on; callers
+        must not publish an index with failures (see build_generation).
+
         Args:
             db: Database session
-        """
-        print("Rebuilding product vector store from database...")
-
-        # Clear existing vector store
-        self._create_vectorstore()
-
-        # Get all products
-        products = db.query(Product).all()
-        print(f"Found {len(products)} products to index")
+            incremental: Only re-embed new or edited products (False = full rebuild)
+            chunk_size: Number of products loaded and committed per chunk
+            batch_size: Encoder batch size
 
-        # Add each product
-        for i, product in enumerate(products):
-            try:
-                self.add_product_embedding(product)
-                if (i + 1) % 100 == 0:
-                    print(f"Indexed {i + 1} products")
-            except Exception as e:
-                print(f"Error indexing product {product.id}: {e}")
-
-        # Commit embedding updates to database
-        db.commit()
-        print(f"Successfully indexed {len(products)} products")
-
-# Global instance
-_product_vector_store = None
+        Returns:
+            Dict with scanned, indexed, skipped, failed and removed counts
+        """
+        print(f"Rebuilding product vector store from database ({'incremental' if incremental else 'full'})...")
+
+        if incremental:
+            indexed = self._indexed_products()
+        else:
+            # Clear existing vector store
+            self._create_vectorstore()
+            indexed = {}
+
+        stats = {'scanned': 0, 'indexed': 0, 'skipped': 0, 'failed': 0, 'removed': 0}
+        seen_ids = set()
+        last_id = 0
+        while True:
+            # Only ask whether an embedding is stored; the vectors stay deferred
+            chunk = (
+                db.query(Product, Product.embedding.isnot(None))
+                .filter(Product.id > last_id)
+                .order_by(Product.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1][0].id
+            stats['scanned'] += len(chunk)
+
+            changed, texts, hashes, stale_ids = [], [], [], []
+            for product, has_embedding in chunk:
+                seen_ids.add(product.id)
+                text = generate_product_embedding_text(product)
+                text_hash = embedding_text_hash(text)
+                previous = indexed.get(product.id)
+                if previous and previous['hash'] == text_hash and has_embedding:
+                    stats['skipped'] += 1
+                    continue
+                changed.append(product)
+                texts.append(text)
+                hashes.append(text_hash)
+                if previous:
+                    stale_ids.extend(i for i in previous['ids'] if i != f"product-{product.id}")
+
+            if changed:
+                try:
+                    self._index_batch(changed, texts, hashes, stale_ids, batch_size=batch_size)
+                    stats['indexed'] += len(changed)
+                except Exception as e:
+                    stats['failed'] += len(changed)
+                    print(f"Error indexing products {changed[0].id}-{changed[-1].id}: {e}")
+
+            # Commit embedding updates per chunk and release the rows
+            db.commit()
+            for product, _ in chunk:
+                db.expunge(product)
+            print(f"Processed {stats['scanned']} products ({stats['indexed']} indexed, {stats['skipped']} unchanged)")
+
+        removed_ids = [doc_id for product_id, entry in indexed.items()
+                       if product_id not in seen_ids for doc_id in entry['ids']]
+        if removed_ids:
+            self.vectorstore.delete(ids=removed_ids)
+            stats['removed'] = len(removed_ids)
+
+        print(f"Successfully rebuilt product index: {stats}")
+        return stats
 
 def get_product_vector_store() -> ProductVectorStore:
     """
-    Get or create the global product vector store instance.
+    Get the vector store of the live catalog generation (see app.db.catalog_index).
     """
-    global _product_vector_store
-    if _product_vector_store is None:
-        _product_vector_store = ProductVectorStore()
-    return _product_vector_store
+    from app.db.catalog_index import get_catalog_generation
+    return get_catalog_generation().vector_store
 
 def add_product_embedding(product_id: int, db: Session):
     """
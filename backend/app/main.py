@@ -1,13 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.router import api_router
+from app.core.admission import ADMISSION_CONTROL, AdmissionMiddleware
+from app.core.layer2_parallel import shutdown_layer2_pool
+from app.core.startup import start_warmup
+from app.db.async_session import dispose_async_engines
+from app.db.catalog_index import start_catalog_watcher
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up catalog generations published by other workers or the rebuild script
+    start_catalog_watcher()
+    # Load models and indexes and warm them up; GET /ready turns 200 when done
+    start_warmup()
+    yield
+    shutdown_layer2_pool()
+    await dispose_async_engines()
 
 app = FastAPI(
     title="Nutrition Bot API",
     description="API for nutrition recommendations and analysis",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Bound concurrent pipeline runs; overloaded requests are degraded or get 503
+# (added before CORS so rejections still carry the CORS headers)
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
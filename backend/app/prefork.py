@@ -0,0 +1,225 @@
+"""
+Pre-fork server launch: load the read-only state once, then fork the workers.
+
+`uvicorn --workers N` spawns fresh interpreters, so every worker imports
+torch and langchain and loads its own copy of the embedding model and
+catalog. This launcher instead prepares everything that is read-only and
+fork-safe in a master process:
+
+- the application modules (torch, sentence-transformers, langchain, FastAPI app)
+- the SentenceTransformer weights
+- the published catalog generation: product ids, nutrient and embedding
+  matrices, hard-filter indexes and the product snapshot
+- the Layer 2 timing assignment tables
+
+then calls gc.freeze() and forks PREFORK_WORKERS workers that share those
+pages copy-on-write. Freezing keeps the cyclic GC of the workers from
+writing to (and so copying) the inherited objects.
+
+Chroma clients and SQLite connections are not fork-safe, so every worker
+opens the catalog's vector store and the guideline store itself after the
+fork, and the master disposes its database connections before forking. No
+inference runs in the master: torch's thread pool must not exist before the
+fork. The master restarts workers that die and forwards SIGTERM/SIGINT.
+
+The workers accept from one listening socket created by the master. Catalog
+generations published later are loaded by each worker separately (see
+start_catalog_watcher) and are not shared.
+
+Every worker starts its own Layer 2 search pool (see layer2_parallel), so
+LAYER2_WORKERS is split between them: each worker's pool gets
+LAYER2_WORKERS // workers processes (a pool of one searches in-process).
+With both left at cpu_count that is one search process per core in total
+instead of cpu_count squared.
+
+Usage:
+    python -m app.prefork [--workers 4] [--host 0.0.0.0] [--port 8000] [--no-preload]
+
+See tests/utils/benchmark_prefork.py for per-worker memory and throughput.
+"""
+
+import argparse
+import gc
+import importlib
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", str(os.cpu_count() or 1)))
+PREFORK_BACKLOG = int(os.getenv("PREFORK_BACKLOG", "2048"))
+PREFORK_RESTART_DELAY_SECONDS = 1.0  # before restarting a worker that died right after starting
+
+
+def preload() -> Dict[str, float]:
+    """
+    Load the shared state in this (master) process.
+
+    Returns:
+        Seconds spent per step
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    import app.main  # noqa: F401
+    # app.main leaves the ML stacks to first use; import them here so they are shared
+    from app.core.startup import HEAVY_IMPORTS
+    for module in HEAVY_IMPORTS + ("app.core.macro_targeting_local", "app.db.vector_store"):
+        importlib.import_module(module)
+    timings["imports"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from app.core.global_embeddings import get_embedding_model
+    get_embedding_model()
+    timings["embedding_model"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from app.db.catalog_index import preload_catalog_generation
+    generation = preload_catalog_generation()
+    if generation is None:
+        print("Pre-fork: no published catalog generation; workers load the legacy store themselves")
+    timings["catalog"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from app.core.layer2_macro_optimization import PIPELINE_OPTIMIZER_SETTINGS
+    from app.core.layer2_timing import _assignments
+    for count in range(1, PIPELINE_OPTIMIZER_SETTINGS["max_snacks"] + 1):
+        _assignments(count)
+    timings["timing_tables"] = time.perf_counter() - start
+
+    # Children must open their own connections
+    from app.db.session import dispose_engines
+    dispose_engines()
+
+    start = time.perf_counter()
+    gc.collect()
+    gc.freeze()
+    timings["gc_freeze"] = time.perf_counter() - start
+    print(f"Pre-fork: froze {gc.get_freeze_count()} objects; " +
+          ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timings.items()))
+    return timings
+
+
+def share_layer2_workers(workers: int) -> int:
+    """
+    Split the LAYER2_WORKERS search processes between the pre-forked workers.
+
+    Args:
+        workers: Number of pre-forked workers
+
+    Returns:
+        Layer 2 pool size of each worker
+    """
+    from app.core import layer2_parallel
+    layer2_parallel.LAYER2_WORKERS = max(1, layer2_parallel.LAYER2_WORKERS // max(1, workers))
+    return layer2_parallel.LAYER2_WORKERS
+
+
+def after_fork():
+    """Per-worker setup: fresh random state and the stores that cannot be inherited."""
+    random.seed()
+    from app.db.catalog_index import get_catalog_generation
+    generation = get_catalog_generation()
+    generation.open_vector_store()
+    generation.warm()
+    from app.core.recommendation import get_macro_service
+    get_macro_service()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(PREFORK_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, log_level: str):
+    import uvicorn
+    from app.main import app
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    after_fork()
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int = PREFORK_WORKERS, preload_state: bool = True, log_level: str = "info"):
+    """Preload (optionally), bind, fork `workers` workers and supervise them until SIGTERM/SIGINT."""
+    if preload_state:
+        preload()
+    sock = bind_socket(host, port)
+    layer2_workers = share_layer2_workers(workers)
+    children: Dict[int, int] = {}  # pid -> worker number
+    started: Dict[int, float] = {}
+    stopping = False
+
+    def spawn(number: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(sock, log_level)
+            except BaseException as e:
+                print(f"Pre-fork worker {number} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = number
+        started[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for number in range(max(1, workers)):
+        spawn(number)
+    print(f"Pre-fork: serving on {host}:{port} with workers {sorted(children)}, "
+          f"{layer2_workers} Layer 2 search processes each")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        number = children.pop(pid, None)
+        if number is not None and not stopping:
+            print(f"Pre-fork: worker {pid} exited ({os.waitstatus_to_exitcode(status)}); restarting")
+            if time.monotonic() - started.pop(pid) < PREFORK_RESTART_DELAY_SECONDS:
+                time.sleep(PREFORK_RESTART_DELAY_SECONDS)
+            spawn(number)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with pre-forked workers sharing preloaded state")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--no-preload", action="store_true", help="Fork without preloading (for comparison)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, preload_state=not args.no_preload, log_level=args.log_level)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,10 @@ class TimingMacroBreakdown(BaseModel):
     pre_workout: Optional[Dict[str, Any]] = None
     during_workout: Optional[Dict[str, Any]] = None
     post_workout: Optional[Dict[str, Any]] = None
+    # Snacks of the bundle per slot (timing-aware optimization only)
+    pre_workout_products: List[Product] = []
+    during_workout_products: List[Product] = []
+    post_workout_products: List[Product] = []
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -26,6 +30,10 @@ class RecommendationRequest(BaseModel):
     exercise_intensity: Optional[str] = None
     timing: Optional[str] = None
     preferences: Optional[Dict[str, Any]] = None  # calorie_cap is optional, e.g. preferences={"calorie_cap": 300}
+    num_alternatives: int = 0  # Alternative bundles to return besides the recommended one
+    max_alternative_overlap: Optional[float] = None  # Largest share of snacks two bundles may have in common (0-1)
+    timing_aware: bool = False  # Split the bundle into pre/during/post workout snacks matching each slot's targets
+    seed: Optional[int] = None  # Seed of every random choice; the same seed and request give the same response
 
     # Logic will branch based on which fields are present (see core/recommendation.py)
     model_config = ConfigDict(from_attributes=True)
@@ -51,6 +59,14 @@ class BundleStats(BaseModel):
     total_calories: float
     num_snacks: int
     target_match_percentage: float
+    total_price: Optional[float] = None
+    
+    model_config = ConfigDict(from_attributes=True)
+
+class AlternativeBundle(BaseModel):
+    """Another bundle from the same optimization, sharing few snacks with the others."""
+    recommended_products: List[Product]
+    bundle_stats: BundleStats
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -79,6 +95,26 @@ class EnhancedRecommendationResponse(BaseModel):
     bundle_stats: Optional[BundleStats] = None
     preferences: Optional[PreferenceInfo] = None
     key_principles: List[KeyPrinciple] = []
+    alternative_bundles: List[AlternativeBundle] = []
+    bundle_session_token: Optional[str] = None  # Pass to /recommend/swap to change the bundle
+    seed: Optional[int] = None  # Pass back as RecommendationRequest.seed to replay this response
+    
+    model_config = ConfigDict(from_attributes=True)
+
+class BundleSwapRequest(BaseModel):
+    """Request model for replacing snacks of a recommended bundle."""
+    bundle_session_token: str
+    product_ids: List[int]  # Products of the bundle being changed
+    exclude_product_ids: List[int] = []  # Rejected products (also kept out of later swaps)
+    pin_product_ids: Optional[List[int]] = None  # Products to keep (default: every product not excluded)
+
+class BundleSwapResponse(BaseModel):
+    """The re-optimized bundle."""
+    recommended_products: List[Product]
+    bundle_stats: BundleStats
+    reasoning: str
+    bundle_session_token: str
+    timing_breakdown: Optional[TimingMacroBreakdown] = None  # Snacks per workout timing slot (timing-aware bundles only)
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -2,8 +2,11 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import random
+
 import pytest
 
+from app.db.product_view import ProductView
 from app.db.session import SessionLocal
 
 
@@ -14,4 +17,18 @@ def db():
     try:
         yield session
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+
+@pytest.fixture()
+def random_products():
+    """Factory of n ProductViews with random macros (ids 0..n-1), reproducible per seed."""
+    def make(n, seed=0):
+        rng = random.Random(seed)
+        return [
+            ProductView(id=i, name=f"Snack {i}", protein=float(rng.randint(0, 20)), carbs=float(rng.randint(0, 40)),
+                        fat=float(rng.randint(0, 15)), electrolytes_mg=float(rng.choice([0, 100, 250])),
+                        calories=float(rng.randint(50, 250)))
+            for i in range(n)
+        ]
+    return make
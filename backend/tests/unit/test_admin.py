@@ -0,0 +1,21 @@
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.endpoints.admin import _require_admin
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def test_admin_token_is_required_and_checked(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    with pytest.raises(HTTPException) as disabled:
+        _require_admin("anything")
+    assert disabled.value.status_code == 403
+
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret-tøken")
+    _require_admin("s3cret-tøken")
+    for token in (None, "", "s3cret", "s3cret-tøken!"):
+        with pytest.raises(HTTPException) as rejected:
+            _require_admin(token)
+        assert rejected.value.status_code == 401
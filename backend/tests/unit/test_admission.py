@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.core.admission import ADMITTED, DEGRADED, REJECTED, AdmissionController, AdmissionMiddleware
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_queued_request_gets_the_released_slot():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=1.0, overload="reject")
+
+    async def main():
+        first = await controller.acquire()
+        second = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+        # Queue full: overloaded right away
+        third = await controller.acquire()
+        controller.release(first)
+        return first, await second, third
+
+    first, second, third = asyncio.run(main())
+    assert (first, second, third) == (ADMITTED, ADMITTED, REJECTED)
+    assert controller.in_flight == 1 and controller.queued == 0
+    assert metrics.get_counter("admission.queued") == 1
+    assert metrics.get_counter("admission.rejected") == 1
+
+
+def test_queue_timeout_degrades_up_to_the_limit():
+    controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.01,
+                                     overload="degrade", max_degraded=1)
+
+    async def main():
+        held = await controller.acquire()
+        degraded = await controller.acquire()
+        rejected = await controller.acquire()
+        controller.release(degraded)
+        controller.release(held)
+        return held, degraded, rejected
+
+    assert asyncio.run(main()) == (ADMITTED, DEGRADED, REJECTED)
+    assert controller.in_flight == 0 and controller.degraded_in_flight == 0 and controller.queued == 0
+
+
+def _app(controller):
+    app = FastAPI()
+
+    @app.post("/api/v1/recommend/")
+    async def recommend(request: Request):
+        return {"degraded": request.state.admission_degraded}
+
+    @app.post("/other")
+    async def other():
+        return {"ok": True}
+
+    app.add_middleware(AdmissionMiddleware, controller=controller, paths=["/api/v1/recommend/"], retry_after=7)
+    return app
+
+
+def test_middleware_rejects_with_retry_after():
+    controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=0.0, overload="reject")
+    controller.in_flight = 1  # saturated
+    client = TestClient(_app(controller))
+
+    response = client.post("/api/v1/recommend/")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    # Other paths are not admission controlled
+    assert client.post("/other").status_code == 200
+
+
+def test_middleware_marks_degraded_requests():
+    controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=0.0, overload="degrade", max_degraded=4)
+    client = TestClient(_app(controller))
+    assert client.post("/api/v1/recommend/").json() == {"degraded": False}
+
+    controller.in_flight = 1  # saturated
+    assert client.post("/api/v1/recommend/").json() == {"degraded": True}
+    assert controller.degraded_in_flight == 0
@@ -0,0 +1,35 @@
+import pytest
+
+from app.core.layer2_macro_optimization import (
+    MacroTargets, bundle_overlap, optimize_macro_combination, select_alternatives
+)
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+
+def test_bundle_overlap_counts_shared_products(random_products):
+    a, b, c = random_products(3, seed=5)
+    assert bundle_overlap([a, b], [b, c]) == 0.5
+    assert bundle_overlap([a], [a, b, c]) == 1.0
+    assert bundle_overlap([a, a], [a, b]) == 0.5
+    assert bundle_overlap([], [a]) == 0.0
+
+
+@pytest.mark.parametrize("max_overlap", [0.0, 0.5])
+def test_alternatives_come_from_one_search_and_respect_the_overlap(max_overlap, random_products):
+    result = optimize_macro_combination(random_products(14, seed=5), MacroTargets(30, 60, 15, 200), max_snacks=4,
+                                        max_candidates=5, parallelism=1, alternatives=3)
+    assert len(result.top_candidates) == 5
+    assert len(result.candidate_pool) > len(result.top_candidates)
+    assert any(result.products is c["combination"] for c in result.top_candidates)
+
+    alternatives = select_alternatives(result, 3, max_overlap)
+    assert alternatives
+    bundles = [result.products] + [c["combination"] for c in alternatives]
+    for i, first in enumerate(bundles):
+        for second in bundles[i + 1:]:
+            assert bundle_overlap(first, second) <= max_overlap
+    scores = [c["score"] for c in alternatives]
+    assert scores == sorted(scores)
@@ -0,0 +1,112 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.api.v1.endpoints import macro_target
+from app.db.async_session import create_async_database_engine, get_async_read_db, save_rows_async, to_async_url
+from app.db.catalog_index import NUTRIENT_COLUMNS, CatalogGeneration
+from app.db.models import MacroTarget, Product, UserInput
+from app.db.session import Base, create_database_engine
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    engine = create_database_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+
+def _sessions(url, read_only=False):
+    engine = create_async_database_engine(url, read_only=read_only)
+    return engine, async_sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def test_async_urls():
+    assert to_async_url("sqlite:///./data/products_and_kds.db") == "sqlite+aiosqlite:///./data/products_and_kds.db"
+    assert to_async_url("postgresql://app:secret@db/nutrition") == "postgresql+asyncpg://app:secret@db/nutrition"
+    with pytest.raises(ValueError):
+        to_async_url("mysql://db/nutrition")
+
+
+def test_save_rows_and_read_back(url):
+    async def main():
+        writer, sessions = _sessions(url)
+        reader, read_sessions = _sessions(url, read_only=True)
+        try:
+            user_input = UserInput(user_query="snack for a long run", age=30)
+            target = MacroTarget(target_protein=20.0, user_input=user_input)
+            async with sessions() as db:
+                await save_rows_async(db, user_input, target)
+            async with read_sessions() as db:
+                mode = (await db.execute(text("PRAGMA journal_mode"))).scalar()
+                stored = (await db.execute(text("SELECT user_input_id FROM macro_targets"))).scalar()
+                with pytest.raises(OperationalError):
+                    await db.execute(text("DELETE FROM macro_targets"))
+            return user_input, target, mode, stored
+        finally:
+            await writer.dispose()
+            await reader.dispose()
+
+    user_input, target, mode, stored = asyncio.run(main())
+    assert user_input.id is not None and target.created_at is not None
+    assert stored == user_input.id
+    assert mode == "wal"
+
+
+def test_snapshot_async_reads_generation_rows(url):
+    async def main():
+        writer, sessions = _sessions(url)
+        try:
+            async with sessions() as db:
+                await save_rows_async(db, Product(name="bar", protein=10.0), Product(name="gel", carbs=25.0))
+            generation = CatalogGeneration("gen-a", None, np.array([2], dtype=np.int64),
+                                           np.ones((1, len(NUTRIENT_COLUMNS)), dtype=np.float32),
+                                           np.eye(1, 4, dtype=np.float32), {"dietary": {}, "allergens": {}})
+            async with sessions() as db:
+                first = await generation.snapshot_async(db)
+            return first, await generation.snapshot_async(None)
+        finally:
+            await writer.dispose()
+
+    first, cached = asyncio.run(main())
+    assert [view.name for view in first.views] == ["gel"]
+    assert cached is first
+
+
+def test_history_endpoint_reads_through_async_session(url):
+    async def seed():
+        writer, sessions = _sessions(url)
+        try:
+            user_input = UserInput(user_query="recovery after lifting")
+            target = MacroTarget(target_protein=30.0, reasoning="", rag_context="", user_input=user_input)
+            async with sessions() as db:
+                await save_rows_async(db, user_input, target)
+            return user_input.id
+        finally:
+            await writer.dispose()
+
+    user_input_id = asyncio.run(seed())
+    app = FastAPI()
+    app.include_router(macro_target.router)
+    _, read_sessions = _sessions(url, read_only=True)
+
+    async def override():
+        async with read_sessions() as db:
+            yield db
+
+    app.dependency_overrides[get_async_read_db] = override
+    client = TestClient(app)
+    response = client.get(f"/history/{user_input_id}")
+    assert response.status_code == 200 and response.json()["target_protein"] == 30.0
+    assert client.get(f"/history/{user_input_id + 1}").status_code == 404
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from app.core import bundle_library
+from app.core.bundle_library import (
+    BundleLibrary, ProfileCell, build_bundle_library, enumerate_cells, lookup_precomputed_bundles, profile_cell
+)
+from app.db.catalog_index import CatalogGeneration
+from app.db.models import MacroTarget, UserInput
+from app.db.product_view import CatalogSnapshot, ProductView
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+class StubMacroService:
+    """Macro targets proportional to weight and duration, without the RAG store."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _get_age_group_from_age(self, age):
+        return "6-11" if age <= 11 else "12-18" if age <= 18 else "19-59"
+
+    def _get_exercise_type(self, exercise_type):
+        return "strength" if "lift" in exercise_type or exercise_type == "strength" else \
+            "cardio" if exercise_type in ("cardio", "running") else exercise_type
+
+    def generate_macro_targets(self, user_input):
+        self.calls += 1
+        scale = user_input.weight_kg / 70.0 * user_input.exercise_duration_minutes / 60.0
+        return MacroTarget(target_protein=20.0 * scale, target_carbs=40.0 * scale,
+                           target_fat=8.0 * scale, target_electrolytes=0.0)
+
+
+def _catalog():
+    views = [
+        ProductView(id=1, name="Bar", protein=10.0, carbs=20.0, fat=4.0, calories=160.0, dietary_flags=("vegan",)),
+        ProductView(id=2, name="Gel", protein=0.0, carbs=25.0, fat=0.0, calories=100.0, dietary_flags=("vegan",)),
+        ProductView(id=3, name="Jerky", protein=12.0, carbs=3.0, fat=2.0, calories=80.0),
+        ProductView(id=4, name="Nuts", protein=6.0, carbs=6.0, fat=14.0, calories=170.0, allergens=("tree nuts",)),
+    ]
+    ids = np.array([v.id for v in views], dtype=np.int64)
+    nutrients = np.array([[v.calories, v.protein, v.carbs, v.fat] for v in views], dtype=np.float32)
+    filter_index = {"dietary": {"vegan": [1, 2]}, "allergens": {"tree nuts": [4]}}
+    catalog = CatalogGeneration("test", None, ids, nutrients, np.zeros((4, 2), dtype=np.float32), filter_index)
+    return catalog, CatalogSnapshot("test", views)
+
+
+def test_profile_cell_buckets_request_fields():
+    service = StubMacroService()
+    user_input = UserInput(age=34, weight_kg=71.9, exercise_type="running", exercise_duration_minutes=52)
+    cell = profile_cell(service, user_input, {"dietary_requirements": ["Vegan"], "allergen_restrictions": []}, 437)
+    assert cell == ProfileCell("19-59", "cardio", 70.0, 45.0, ("vegan",), (), 400.0)
+    assert cell.key == "19-59|cardio|70|45|vegan||400"
+    assert profile_cell(service, UserInput(exercise_type="yoga"), {}) is None
+    assert len(enumerate_cells(["19-59"], ["cardio"], [69, 71], [60], [()], [(), ("milk",)])) == 2
+
+
+def test_build_reuses_unchanged_cells_and_lookup_serves_them(tmp_path, monkeypatch):
+    catalog, snapshot = _catalog()
+    service = StubMacroService()
+    cells = enumerate_cells(["19-59"], ["cardio"], [70], [60], [(), ("vegan",)], [()])
+
+    library, stats = build_bundle_library(catalog, snapshot, service, cells, workers=1)
+    assert stats == {"computed": 2, "reused": 0, "empty": 0}
+    vegan = library.cells["19-59|cardio|70|60|vegan||-"]
+    assert all(set(bundle["ids"]) <= {1, 2} for bundle in vegan["bundles"])
+
+    path = tmp_path / "library.json.gz"
+    library.save(path)
+    previous = BundleLibrary.load(path)
+    _, stats = build_bundle_library(catalog, snapshot, service, cells, workers=1, previous=previous)
+    assert stats["reused"] == 2 and stats["computed"] == 0
+
+    monkeypatch.setattr(bundle_library, "BUNDLE_LIBRARY_PATH", path)
+    user_input = UserInput(age=25, weight_kg=68, exercise_type="cardio", exercise_duration_minutes=60)
+    macro_target = service.generate_macro_targets(user_input)
+    result = lookup_precomputed_bundles(catalog, snapshot, service, user_input,
+                                        {"dietary_requirements": ["vegan"]}, None, macro_target)
+    assert result is not None and result.algorithm_used == "bundle_library"
+    assert {p.id for p in result.products} <= {1, 2}
+
+    # A profile outside the library falls back to the pipeline
+    assert lookup_precomputed_bundles(catalog, snapshot, service, user_input,
+                                      {"allergen_restrictions": ["milk"]}, None, macro_target) is None
+
+
+def test_lookup_ignores_library_of_another_catalog(tmp_path, monkeypatch):
+    catalog, snapshot = _catalog()
+    service = StubMacroService()
+    cells = enumerate_cells(["19-59"], ["cardio"], [70], [60], [()], [()])
+    library, _ = build_bundle_library(catalog, snapshot, service, cells, workers=1)
+    library.catalog_fingerprint = "stale"
+    path = tmp_path / "library.json.gz"
+    library.save(path)
+    monkeypatch.setattr(bundle_library, "BUNDLE_LIBRARY_PATH", path)
+
+    user_input = UserInput(age=25, weight_kg=70, exercise_type="cardio", exercise_duration_minutes=60)
+    assert lookup_precomputed_bundles(catalog, snapshot, service, user_input, {}, None,
+                                      service.generate_macro_targets(user_input)) is None
@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.core.bundle_sessions import BundleSession, get_bundle_session, reoptimize_bundle, start_bundle_session
+from app.core.layer2_macro_optimization import MacroOptimizer, MacroTargets
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def _session(products, calorie_cap=None):
+    return BundleSession(generation="g1", candidates=products, targets=MacroTargets(40, 90, 20, 300),
+                         calorie_cap=calorie_cap,
+                         settings={"min_snacks": 1, "max_snacks": 5, "max_candidates": 1, "score_threshold": 1.5})
+
+
+def test_swap_keeps_pinned_products_and_drops_excluded_ones(random_products):
+    session = _session(random_products(12, seed=11), calorie_cap=700.0)
+    bundle = [0, 1, 2]
+    result = reoptimize_bundle(session, bundle, exclude_ids=[2])
+    ids = [p.id for p in result.products]
+    assert ids[:2] == [0, 1]
+    assert 2 not in ids
+    assert result.total_calories <= 700.0
+    # The score covers the whole bundle, pinned products included
+    score, _ = MacroOptimizer(min_snacks=1, max_snacks=5).calculate_combination_score(result.products, session.targets)
+    assert result.score == pytest.approx(score)
+
+    # Exclusions accumulate over the session
+    again = reoptimize_bundle(session, ids, exclude_ids=[ids[-1]], pin_ids=[0])
+    assert not {2, ids[-1]} & {p.id for p in again.products}
+
+
+def test_unknown_products_are_rejected(random_products):
+    with pytest.raises(KeyError):
+        reoptimize_bundle(_session(random_products(12, seed=11)), [0, 1], exclude_ids=[99])
+
+
+def test_every_token_gets_its_own_exclusions(random_products):
+    template = _session(random_products(12, seed=11))
+    first, second = start_bundle_session(template), start_bundle_session(template)
+    assert first != second
+    reoptimize_bundle(get_bundle_session(first, "g1"), [0, 1], exclude_ids=[1])
+    assert get_bundle_session(first, "g1").excluded == {1}
+    assert get_bundle_session(second, "g1").excluded == set()
+    assert get_bundle_session(first, "g2") is None
+
+
+def test_swaps_replay_with_the_session_seed(random_products):
+    template = _session(random_products(12, seed=11))
+    template.settings = dict(template.settings, max_candidates=5)
+
+    def swaps(seed):
+        session = get_bundle_session(start_bundle_session(template, seed), "g1")
+        first = reoptimize_bundle(session, [0, 1, 2], exclude_ids=[2])
+        second = reoptimize_bundle(session, [p.id for p in first.products], exclude_ids=[first.products[-1].id])
+        return [p.id for p in first.products], [p.id for p in second.products]
+
+    assert swaps(42) == swaps(42)
+
+
+def test_concurrent_swaps_keep_every_exclusion_and_seed(random_products):
+    template = _session(random_products(12, seed=11))
+    session = get_bundle_session(start_bundle_session(template, 7), "g1")
+    assert session.lock is not template.lock
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda pid: reoptimize_bundle(session, [0, 1], exclude_ids=[pid]), range(2, 10)))
+    assert session.excluded == set(range(2, 10))
+    assert session.swaps == 8
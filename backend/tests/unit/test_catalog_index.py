@@ -0,0 +1,156 @@
+import json
+
+import numpy as np
+import pytest
+
+from app.core import enhanced_embedding
+from app.core.enhanced_embedding import encode_catalog_vectors, enhanced_product_vectors
+from app.db import catalog_index
+from app.db.catalog_index import (
+    CatalogGeneration,
+    CatalogValidationError,
+    NUTRIENT_COLUMNS,
+    _catalog_arrays,
+    preload_catalog_generation,
+    publish_generation,
+    prune_generations,
+    reload_if_changed,
+    swap_generation,
+    validate_generation,
+)
+from app.db.product_view import ProductView
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def _write_generation(root, name, product_ids, filter_index=None, **enhanced):
+    path = root / name
+    path.mkdir(parents=True)
+    n = len(product_ids)
+    np.savez(path / "catalog.npz",
+             product_ids=np.array(product_ids, dtype=np.int64),
+             nutrients=np.ones((n, len(NUTRIENT_COLUMNS)), dtype=np.float32),
+             embeddings=np.eye(n, 4, dtype=np.float32),
+             **enhanced)
+    with open(path / "filters.json", "w") as f:
+        json.dump(filter_index or {"dietary": {}, "allergens": {}}, f)
+    return path
+
+
+def test_ids_matching_applies_dietary_and_allergen_indexes(tmp_path):
+    path = _write_generation(tmp_path, "gen-a", [1, 2, 3, 4], {
+        "dietary": {"vegan": [1, 2, 3], "gluten-free": [2, 3, 4]},
+        "allergens": {"milk": [3]}
+    })
+    generation = CatalogGeneration.load(path, open_vector_store=False)
+    assert generation.ids_matching(["vegan", "gluten-free"], ["milk"]) == {2}
+    assert generation.ids_matching() == {1, 2, 3, 4}
+    assert generation.row_of[3] == 2
+
+
+def test_publish_replaces_pointer_and_prunes_old_generations(tmp_path):
+    for i in range(5):
+        _write_generation(tmp_path, f"gen-{i}", [1])
+    publish_generation(tmp_path / "gen-4", root=tmp_path)
+    assert (tmp_path / "CURRENT").read_text() == "gen-4"
+    assert not list(tmp_path.glob("CURRENT.*.tmp"))
+
+    prune_generations(tmp_path, keep=2)
+    assert sorted(p.name for p in tmp_path.glob("gen-*")) == ["gen-3", "gen-4"]
+
+
+def test_validation_rejects_row_count_mismatch(tmp_path):
+    path = _write_generation(tmp_path, "gen-a", [1, 2])
+    validate_generation(path, expected_count=2)
+    with pytest.raises(CatalogValidationError):
+        validate_generation(path, expected_count=3)
+
+
+def test_reload_swaps_only_when_pointer_changes(tmp_path, monkeypatch):
+    _write_generation(tmp_path, "gen-a", [1])
+    _write_generation(tmp_path, "gen-b", [1, 2])
+    monkeypatch.setattr(catalog_index, "_current_generation", None)
+    monkeypatch.setattr(CatalogGeneration, "load",
+                        classmethod(lambda cls, path, open_vector_store=True:
+                                    cls(path.name, path, np.array([1]), np.zeros((1, 5)), np.zeros((1, 4)), {})))
+
+    publish_generation(tmp_path / "gen-a", root=tmp_path)
+    assert reload_if_changed(tmp_path)
+    assert catalog_index.get_catalog_generation().generation == "gen-a"
+    assert not reload_if_changed(tmp_path)
+
+    held = catalog_index.get_catalog_generation()
+    publish_generation(tmp_path / "gen-b", root=tmp_path)
+    assert reload_if_changed(tmp_path)
+    assert catalog_index.get_catalog_generation().generation == "gen-b"
+    # A request that grabbed the old generation keeps a consistent view
+    assert held.generation == "gen-a"
+
+
+def test_preload_makes_generation_live_without_vector_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog_index, "_current_generation", None)
+    monkeypatch.setattr(CatalogGeneration, "snapshot", lambda self, db: None)
+    assert preload_catalog_generation(tmp_path) is None
+
+    _write_generation(tmp_path, "gen-a", [1, 2])
+    publish_generation(tmp_path / "gen-a", root=tmp_path)
+    generation = preload_catalog_generation(tmp_path)
+    assert generation.vector_store is None
+    assert catalog_index.get_catalog_generation() is generation
+    assert generation.product_count == 2
+
+
+def test_swap_returns_previous_generation(monkeypatch):
+    monkeypatch.setattr(catalog_index, "_current_generation", None)
+    first = CatalogGeneration("one", None, np.array([]), np.zeros((0, 5)), np.zeros((0, 4)), {})
+    second = CatalogGeneration("two", None, np.array([]), np.zeros((0, 5)), np.zeros((0, 4)), {})
+    assert swap_generation(first) is None
+    assert swap_generation(second) is first
+
+
+def test_catalog_arrays_match_products_table(db):
+    product_ids, nutrients, filter_index = _catalog_arrays(db)
+    assert nutrients.shape == (len(product_ids), len(NUTRIENT_COLUMNS))
+    assert list(product_ids) == sorted(product_ids)
+    assert set(filter_index) == {"dietary", "allergens"}
+
+
+class FakeModel:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), 1.0, 0.0] for text in texts], dtype=np.float32)
+
+
+def test_enhanced_vectors_are_encoded_once_per_edited_product(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(enhanced_embedding, "get_embedding_model", lambda: model)
+    views = [ProductView(id=1, name="bar", protein=10.0), ProductView(id=2, name="gel", carbs=25.0)]
+    keys, vectors = encode_catalog_vectors(views)
+    assert len(model.encoded) == 2 and vectors.shape == (2, 3) and vectors.dtype == np.float32
+
+    edited = [views[0], ProductView(id=2, name="gel", carbs=30.0), ProductView(id=3, name="chips")]
+    new_keys, new_vectors = encode_catalog_vectors(edited, dict(zip(keys, vectors)))
+    assert len(model.encoded) == 4
+    assert new_keys[0] == keys[0] and new_keys[1] != keys[1]
+    np.testing.assert_array_equal(new_vectors[0], vectors[0])
+
+
+def test_enhanced_vectors_are_served_from_the_live_generation(tmp_path, monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(enhanced_embedding, "get_embedding_model", lambda: model)
+    views = [ProductView(id=1, name="bar", protein=10.0), ProductView(id=2, name="gel", carbs=25.0)]
+    keys, vectors = encode_catalog_vectors(views)
+    path = _write_generation(tmp_path, "gen-a", [1, 2], enhanced_keys=keys, enhanced_embeddings=vectors)
+    validate_generation(path, expected_count=2)
+    monkeypatch.setattr(catalog_index, "_current_generation", CatalogGeneration.load(path, open_vector_store=False))
+    model.encoded.clear()
+
+    np.testing.assert_array_equal(enhanced_product_vectors(views[::-1]), vectors[::-1])
+    assert model.encoded == []
+    # Products the generation does not hold are still encoded on demand
+    enhanced_product_vectors([ProductView(id=3, name="chips")])
+    assert model.encoded == ["chips"]
@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.db import session
+from app.db.session import create_database_engine, engine_options
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def engines(tmp_path):
+    url = f"sqlite:///{tmp_path / 'tuning.db'}"
+    writer = create_database_engine(url)
+    reader = create_database_engine(url, read_only=True)
+    with writer.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("INSERT INTO items (name) VALUES ('bar')"))
+    yield writer, reader
+    writer.dispose()
+    reader.dispose()
+
+
+def test_sqlite_connections_get_tuning_pragmas(engines):
+    writer, reader = engines
+    for engine in (writer, reader):
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == session.SQLITE_BUSY_TIMEOUT_MS
+            assert conn.execute(text("PRAGMA cache_size")).scalar() == -session.SQLITE_CACHE_SIZE_MB * 1024
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+    with writer.connect() as conn:
+        assert conn.execute(text("PRAGMA query_only")).scalar() == 0
+    with reader.connect() as conn:
+        assert conn.execute(text("PRAGMA query_only")).scalar() == 1
+
+
+def test_reader_rejects_writes_and_reads_during_a_write(engines):
+    writer, reader = engines
+    with reader.connect() as conn, pytest.raises(OperationalError):
+        conn.execute(text("INSERT INTO items (name) VALUES ('gel')"))
+
+    # WAL: a read is not blocked by an open write transaction and sees the last commit
+    with writer.begin() as write_conn:
+        write_conn.execute(text("INSERT INTO items (name) VALUES ('gel')"))
+        with reader.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM items")).scalar() == 1
+    with reader.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM items")).scalar() == 2
+
+
+def test_pool_settings_per_backend():
+    writer = engine_options("sqlite:///./data/x.db")
+    assert writer["pool_size"] == 1 and writer["max_overflow"] == 0
+    reader = engine_options("sqlite:///./data/x.db", read_only=True)
+    assert reader["pool_size"] == session.SQLITE_READ_POOL_SIZE
+
+    # In-memory SQLite keeps SQLAlchemy's own pool (each connection is its own database)
+    assert "pool_size" not in engine_options("sqlite://")
+    assert "pool_size" not in engine_options("sqlite:///:memory:")
+
+    postgres = engine_options("postgresql://user@db/nutrition", read_only=True)
+    assert postgres["pool_pre_ping"] and postgres["pool_size"] == session.DB_POOL_SIZE
+    assert postgres["pool_recycle"] == session.DB_POOL_RECYCLE_SECONDS
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from app.core import layer2_macro_optimization, metrics
+from app.core.deadline import Deadline, call_before
+from app.core.layer2_macro_optimization import MacroTargets, optimize_macro_combination
+from app.db.product_view import ProductView
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def _products(n):
+    return [ProductView(id=i, name=f"Snack {i}", protein=float(i % 7 + 2), carbs=float(i % 11 * 3 + 5),
+                        fat=float(i % 5 + 1), electrolytes_mg=0.0, calories=float(100 + i % 13 * 10))
+            for i in range(1, n + 1)]
+
+
+def test_deadline_records_each_degradation_once():
+    deadline = Deadline.after(10)
+    assert not deadline.expired() and deadline.allows(5) and not deadline.allows(60)
+    before = metrics.get_counter("deadline.degraded.extraction")
+    deadline.degrade("extraction", "used the rule-based extractor")
+    deadline.degrade("extraction", "used the rule-based extractor")
+    assert metrics.get_counter("deadline.degraded.extraction") == before + 1
+    assert deadline.reasoning() == ["Time budget: used the rule-based extractor."]
+
+    expired = Deadline.after(-1)
+    assert expired.expired() and expired.remaining() == 0.0
+    # A late stage still gets its minimum time slice
+    assert expired.stop_time(0.5) > time.time()
+
+
+def test_call_before_raises_when_the_call_runs_past_the_deadline():
+    assert call_before(Deadline.after(5), lambda x: x * 2, 21) == 42
+    with pytest.raises(TimeoutError):
+        call_before(Deadline.after(0.05), time.sleep, 1)
+
+
+@pytest.mark.parametrize("algorithm", ["exhaustive", "dp"])
+def test_expired_deadline_still_returns_a_bundle(monkeypatch, algorithm):
+    monkeypatch.setattr(layer2_macro_optimization, "DEADLINE_LAYER2_MIN_SECONDS", 0.0)
+    products = _products(40)
+    targets = MacroTargets(20, 60, 10, 0)
+    deadline = Deadline.after(-1)
+    result = optimize_macro_combination(products, targets, max_snacks=4, algorithm=algorithm,
+                                        reduce_candidates=False, deadline=deadline)
+    assert result is not None and result.products
+    assert [stage for stage, _ in deadline.degradations] == ["layer2"]
+
+
+def test_search_within_the_deadline_is_not_degraded():
+    products = _products(12)
+    targets = MacroTargets(20, 60, 10, 0)
+    deadline = Deadline.after(30)
+    result = optimize_macro_combination(products, targets, max_snacks=3, deadline=deadline)
+    unbounded = optimize_macro_combination(products, targets, max_snacks=3)
+    assert deadline.degradations == []
+    assert [c['score'] for c in result.top_candidates] == [c['score'] for c in unbounded.top_candidates]
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from app.core.diversity import mmr_rerank, normalize_rows
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def _naive_mmr(relevance, embeddings, lambda_param, k):
+    """Reference MMR with explicit loops."""
+    selected, remaining = [], list(range(len(relevance)))
+    while remaining and len(selected) < k:
+        def score(i):
+            if not selected:
+                return relevance[i]  # First pick is the most relevant
+            redundancy = max(float(embeddings[i] @ embeddings[j]) for j in selected)
+            return lambda_param * relevance[i] - (1 - lambda_param) * redundancy
+        best = max(remaining, key=score)
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def test_lambda_one_is_relevance_order():
+    relevance = np.array([0.2, 0.9, 0.5, 0.7])
+    embeddings = normalize_rows(np.eye(4))
+    assert mmr_rerank(relevance, embeddings, lambda_param=1.0) == [1, 3, 2, 0]
+
+
+def test_near_duplicates_are_pushed_down():
+    # 0 and 1 are the same product twice, 2 is different but slightly less relevant
+    embeddings = normalize_rows(np.array([[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]]))
+    relevance = np.array([0.9, 0.89, 0.8])
+    assert mmr_rerank(relevance, embeddings, lambda_param=0.5) == [0, 2, 1]
+
+
+def test_matches_reference_implementation():
+    rng = np.random.default_rng(3)
+    embeddings = normalize_rows(rng.standard_normal((40, 16)))
+    relevance = rng.uniform(-1, 1, 40).astype(np.float32)
+    for lambda_param in (0.0, 0.3, 0.7):
+        assert mmr_rerank(relevance, embeddings, lambda_param, k=10) == _naive_mmr(relevance, embeddings, lambda_param, 10)
+
+
+def test_k_bounds():
+    embeddings = normalize_rows(np.eye(3))
+    relevance = np.array([0.1, 0.2, 0.3])
+    assert mmr_rerank(relevance, embeddings, 0.5, k=0) == []
+    assert sorted(mmr_rerank(relevance, embeddings, 0.5, k=10)) == [0, 1, 2]
@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from app.db.models import Base, Product
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture()
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    db = sessionmaker(bind=engine)()
+    db.statements = statements
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def test_embedding_round_trips_as_float32_blob(session):
+    vector = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+    session.add(Product(id=1, name="bar", embedding=vector))
+    session.commit()
+
+    raw = session.execute(text("SELECT embedding FROM products WHERE id = 1")).scalar()
+    assert isinstance(raw, bytes) and len(raw) == 384 * 4
+
+    session.expunge_all()
+    assert np.array_equal(session.get(Product, 1).embedding, vector)
+
+
+def test_legacy_json_embeddings_are_still_readable(session):
+    session.execute(text("INSERT INTO products (id, name, embedding) VALUES (1, 'bar', :e)"),
+                    {"e": json.dumps([0.5, -0.25, 1.0])})
+    session.commit()
+    assert session.get(Product, 1).embedding.tolist() == [0.5, -0.25, 1.0]
+
+
+def test_catalog_queries_do_not_load_embeddings(session):
+    session.add(Product(id=1, name="bar", protein=10.0, embedding=np.ones(384)))
+    session.commit()
+    session.expunge_all()
+    session.statements.clear()
+
+    product = session.query(Product).filter(Product.id == 1).one()
+    assert product.protein == 10.0
+    assert "embedding" not in session.statements[-1]
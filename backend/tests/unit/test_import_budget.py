@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+BACKEND = Path(__file__).resolve().parents[2]
+
+# Loaded only when an endpoint that needs them first runs, or by the startup warmup
+HEAVY_PACKAGES = {
+    "torch", "transformers", "sentence_transformers", "chromadb", "langchain", "langchain_core",
+    "langchain_community", "langchain_chroma", "langchain_openai", "openai", "tiktoken",
+}
+
+# Seconds `import app.main` may take (cumulative, from -X importtime); ~0.8s without the ML stacks
+APP_IMPORT_BUDGET_SECONDS = float(os.getenv("APP_IMPORT_BUDGET_SECONDS", "3.0"))
+
+
+def _importtime(module: str):
+    """{module name: cumulative seconds} of a fresh interpreter importing `module`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=BACKEND, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, total_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if total_us.isdigit():
+            cumulative[name] = int(total_us) / 1e6
+    return cumulative
+
+
+def test_app_main_imports_no_ml_stack_within_budget():
+    cumulative = _importtime("app.main")
+    heavy = sorted({name.split(".")[0] for name in cumulative} & HEAVY_PACKAGES)
+    assert heavy == [], f"app.main imports {heavy} at import time"
+    assert cumulative["app.main"] <= APP_IMPORT_BUDGET_SECONDS, (
+        f"import app.main took {cumulative['app.main']:.2f}s (budget {APP_IMPORT_BUDGET_SECONDS}s)"
+    )
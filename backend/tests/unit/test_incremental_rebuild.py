@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+pytest.importorskip("langchain_chroma")
+
+from app.db import vector_store as vector_store_module
+from app.db.vector_store import ProductVectorStore
+from app.db.models import Product
+
+
+class FakeCollection:
+    def __init__(self, store):
+        self.store = store
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for doc_id, metadata in zip(ids, metadatas):
+            self.store.docs[doc_id] = metadata
+        self.store.upsert_calls.append(list(ids))
+
+
+class FakeChroma:
+    def __init__(self):
+        self.docs = {}
+        self.upsert_calls = []
+        self._collection = FakeCollection(self)
+
+    def get(self, include=None, where=None):
+        items = [(i, m) for i, m in self.docs.items()
+                 if where is None or m['product_id'] == where['product_id']]
+        return {'ids': [i for i, _ in items], 'metadatas': [m for _, m in items]}
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self.docs.pop(doc_id, None)
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size=32):
+        self.calls.append(len(texts))
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+class FakeQuery:
+    def __init__(self, products):
+        self.products = products
+        self.last_id = 0
+        self.limit_n = None
+
+    def filter(self, condition):
+        self.last_id = condition.right.value
+        return self
+
+    def order_by(self, _):
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def all(self):
+        rows = [(p, p.embedding is not None) for p in self.products if p.id > self.last_id]
+        return rows[:self.limit_n]
+
+
+class FakeSession:
+    def __init__(self, products):
+        self.products = products
+        self.commits = 0
+
+    def query(self, *_):
+        return FakeQuery(self.products)
+
+    def commit(self):
+        self.commits += 1
+
+    def expunge(self, _):
+        pass
+
+
+@pytest.fixture()
+def store(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(vector_store_module, "get_embedding_model", lambda: model)
+    instance = ProductVectorStore.__new__(ProductVectorStore)
+    instance.vectorstore = FakeChroma()
+    instance.model = model
+    return instance
+
+
+def _products(n):
+    return [Product(id=i, name=f"Bar {i}", protein=10.0 + i, carbs=20.0, form="bar") for i in range(1, n + 1)]
+
+
+def test_rebuild_encodes_in_chunks(store):
+    products = _products(5)
+    stats = store.rebuild_from_database(FakeSession(products), chunk_size=2)
+    assert stats == {'scanned': 5, 'indexed': 5, 'skipped': 0, 'failed': 0, 'removed': 0}
+    assert store.model.calls == [2, 2, 1]
+    assert set(store.vectorstore.docs) == {f"product-{i}" for i in range(1, 6)}
+
+
+def test_incremental_rebuild_only_touches_changed_rows(store):
+    products = _products(4)
+    store.rebuild_from_database(FakeSession(products))
+    store.model.calls.clear()
+
+    products[1].protein = 99.0
+    products.append(Product(id=5, name="Gel 5", carbs=25.0, form="gel"))
+    stats = store.rebuild_from_database(FakeSession(products))
+
+    assert stats['indexed'] == 2
+    assert stats['skipped'] == 3
+    assert store.vectorstore.upsert_calls[-1] == ["product-2", "product-5"]
+
+
+def test_incremental_rebuild_removes_deleted_products(store):
+    products = _products(3)
+    store.rebuild_from_database(FakeSession(products))
+    stats = store.rebuild_from_database(FakeSession(products[:2]))
+    assert stats['removed'] == 1
+    assert "product-3" not in store.vectorstore.docs
+
+
+def test_rebuild_counts_chunks_that_fail_to_index(store, monkeypatch):
+    products = _products(4)
+    store.rebuild_from_database(FakeSession(products))
+
+    def broken(texts, batch_size=32):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(store.model, "encode", broken)
+    products[0].protein = 50.0
+    products[3].protein = 60.0
+    stats = store.rebuild_from_database(FakeSession(products), chunk_size=2)
+    assert stats['failed'] == 2 and stats['indexed'] == 0 and stats['skipped'] == 2
@@ -0,0 +1,45 @@
+import pytest
+
+from app.core.layer2_knapsack import DPGrid
+from app.core.layer2_macro_optimization import MacroOptimizer, MacroTargets, optimize_macro_combination
+from app.db.product_view import ProductView
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+
+@pytest.mark.parametrize("calorie_cap", [None, 450.0])
+def test_fine_grid_matches_exhaustive_search(calorie_cap, random_products):
+    products = random_products(12, seed=3)
+    targets = MacroTargets(30, 60, 15, 200)
+    optimizer = MacroOptimizer(min_snacks=1, max_snacks=5)
+    exhaustive = optimizer.dynamic_programming_algorithm(products, targets, max_candidates=10, score_threshold=1.5,
+                                                         calorie_cap=calorie_cap, parallelism=1)
+    exact_grid = DPGrid(calories=1e-6, protein=1e-6, carbs=1e-6, fat=1e-6, electrolytes=1e-6)
+    knapsack = optimizer.knapsack_algorithm(products, targets, max_candidates=10, score_threshold=1.5,
+                                            calorie_cap=calorie_cap, grid=exact_grid)
+    assert [round(c["score"], 9) for c in knapsack.top_candidates] == \
+        [round(c["score"], 9) for c in exhaustive.top_candidates]
+    assert knapsack.algorithm_used == "knapsack_dp_random"
+
+
+def test_multiple_servings_of_one_product():
+    half = ProductView(id=1, name="Half", protein=15.0, carbs=30.0, fat=5.0, calories=225.0)
+    filler = ProductView(id=2, name="Filler", protein=2.0, carbs=50.0, fat=0.0, calories=210.0)
+    targets = MacroTargets(30, 60, 10, 0)
+    single = optimize_macro_combination([half, filler], targets, max_candidates=1, max_servings=1)
+    double = optimize_macro_combination([half, filler], targets, max_candidates=1, max_servings=2)
+    assert [p.id for p in single.products] != [1, 1]
+    assert [p.id for p in double.products] == [1, 1]
+    assert double.score == pytest.approx(0.0)
+
+
+def test_hundreds_of_candidates_respect_the_calorie_cap(random_products):
+    products = random_products(200, seed=3)
+    result = optimize_macro_combination(products, MacroTargets(40, 80, 20, 300), min_snacks=1, max_snacks=8,
+                                        score_threshold=1.5, calorie_cap=600)
+    assert result.algorithm_used.startswith("knapsack_dp")
+    assert result.total_calories <= 600
+    assert all(c["totals"]["calories"] <= 600 for c in result.top_candidates)
+    assert result.score < 0.1
@@ -0,0 +1,71 @@
+import itertools
+import math
+
+import pytest
+
+from app.core import layer2_parallel
+from app.core.layer2_macro_optimization import (
+    MacroOptimizer, MacroTargets, combination_prefixes, nutrient_rows, search_combinations
+)
+from app.core.layer2_parallel import count_combinations, parallel_search_combinations, partition_prefixes
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+
+def test_partitions_cover_every_combination_once():
+    shards = partition_prefixes(12, 1, 5, 3)
+    assert len(shards) == 3
+    assert sorted(p for shard in shards for p in shard) == combination_prefixes(12, 1, 5)
+    covered = [sum(math.comb(12 - first - 1, size - 1) for size, first in shard) for shard in shards]
+    assert sum(covered) == count_combinations(12, 1, 5)
+    assert max(covered) < 2 * min(covered)
+
+
+def test_prefix_search_matches_itertools_order(random_products):
+    products = random_products(9, seed=7)
+    optimizer = MacroOptimizer(min_snacks=1, max_snacks=4)
+    targets = MacroTargets(30, 60, 15, 250)
+    rows = nutrient_rows(products)
+    settings = ({"protein": 30, "carbs": 60, "fat": 15, "electrolytes": 250}, optimizer.weights, 4, 10, 1.0, 500.0)
+    top, _ = search_combinations(rows, combination_prefixes(9, 1, 4), *settings)
+
+    # Reference: stable sort by score of the itertools enumeration
+    reference = []
+    for size in range(1, 5):
+        for combination in itertools.combinations(products, size):
+            score, totals = optimizer.calculate_combination_score(list(combination), targets)
+            if totals["calories"] <= 500.0 and score <= 1.0:
+                reference.append((score, [p.id for p in combination]))
+    reference.sort(key=lambda c: c[0])
+    assert [(score, list(indices)) for score, _, indices, _ in top] == reference[:10]
+
+
+def test_parallel_top_k_equals_serial(monkeypatch, random_products):
+    monkeypatch.setattr(layer2_parallel, "LAYER2_WORKERS", 2)
+    monkeypatch.setattr(layer2_parallel, "LAYER2_PARALLEL_MIN_COMBINATIONS", 0)
+    products = random_products(14, seed=7)
+    optimizer = MacroOptimizer(min_snacks=1, max_snacks=5)
+    targets = MacroTargets(35, 70, 20, 300)
+    try:
+        serial = optimizer.dynamic_programming_algorithm(products, targets, max_candidates=10,
+                                                         score_threshold=1.5, calorie_cap=700, parallelism=1)
+        rows = nutrient_rows(products)
+        settings = ({"protein": 35, "carbs": 70, "fat": 20, "electrolytes": 300}, optimizer.weights, 5, 10, 1.5, 700)
+        parallel = parallel_search_combinations(rows, 1, 5, settings, parallelism=2)
+        assert parallel is not None
+        top, best = parallel
+        assert [(c["score"], [p.id for p in c["combination"]]) for c in serial.top_candidates] == \
+            [(score, list(indices)) for score, _, indices, _ in top]
+        assert best == search_combinations(rows, combination_prefixes(14, 1, 5), *settings)[1]
+    finally:
+        layer2_parallel.shutdown_layer2_pool()
+
+
+@pytest.mark.parametrize("total, workers, each", [(8, 8, 1), (8, 2, 4), (3, 4, 1)])
+def test_prefork_workers_split_the_search_processes(monkeypatch, total, workers, each):
+    from app.prefork import share_layer2_workers
+    monkeypatch.setattr(layer2_parallel, "LAYER2_WORKERS", total)
+    assert share_layer2_workers(workers) == each
+    assert layer2_parallel.LAYER2_WORKERS == each
@@ -0,0 +1,71 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from app.core.layer2_knapsack import DPGrid, _score_arrays
+from app.core.layer2_macro_optimization import MacroOptimizer, MacroTargets, _target_values, optimize_macro_combination
+from app.core.layer2_pareto import pareto_indices, pareto_search
+from app.db.product_view import ProductView
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+# Fine enough that no two bundles share a cell: the search is exact
+EXACT_GRID = DPGrid(calories=1e-6, protein=1e-6, carbs=1e-6, fat=1e-6, electrolytes=1e-6)
+
+
+def _product(id, protein, carbs, fat, calories, price):
+    return ProductView(id=id, name=f"Snack {id}", protein=protein, carbs=carbs, fat=fat,
+                       electrolytes_mg=0.0, calories=calories, price_usd=price)
+
+
+def _brute_force_front(rows, prices, max_size, target_values, weights, count_objective):
+    points = []
+    for size in range(1, max_size + 1):
+        for combination in itertools.combinations(range(len(rows)), size):
+            totals = np.sum([rows[i] for i in combination], axis=0)
+            score, _ = _score_arrays(totals[None, :], target_values, weights)
+            points.append((float(score[0]), sum(prices[i] for i in combination), size))
+    scores, costs, sizes = (np.array(column) for column in zip(*points))
+    kept = pareto_indices(scores, costs, sizes if count_objective else None)
+    return sorted((round(scores[i], 6), round(costs[i], 6)) + ((int(sizes[i]),) if count_objective else ()) for i in kept)
+
+
+@pytest.mark.parametrize("count_objective", [False, True])
+def test_front_matches_brute_force(count_objective):
+    rng = random.Random(3)
+    weights = MacroOptimizer().weights
+    target_values = _target_values(MacroTargets(20, 50, 8, 0))
+    for _ in range(10):
+        rows = [(float(rng.randint(0, 15)), float(rng.randint(0, 40)), float(rng.randint(0, 8)), 0.0,
+                 float(rng.randint(50, 250))) for _ in range(7)]
+        prices = [round(rng.uniform(0.5, 4.0), 2) for _ in range(7)]
+        front = pareto_search(rows, prices, 1, 3, target_values, weights, None, count_objective=count_objective,
+                              grid=EXACT_GRID, price_step=1e-6)
+        found = sorted((round(score, 6), round(price, 6)) + ((size,) if count_objective else ())
+                       for score, size, _, _, price in front)
+        assert found == _brute_force_front(rows, prices, 3, target_values, weights, count_objective)
+
+
+def test_budget_selects_best_bundle_within_it():
+    products = [
+        _product(1, 20.0, 40.0, 8.0, 320.0, 6.0),  # matches the targets alone, but expensive
+        _product(2, 9.0, 20.0, 4.0, 160.0, 1.5),
+        _product(3, 10.0, 20.0, 4.0, 170.0, 1.0),
+        _product(4, 5.0, 10.0, 2.0, 80.0, 0.5),
+    ]
+    targets = MacroTargets(20, 40, 8, 0)
+    unlimited = optimize_macro_combination(products, targets, max_snacks=3, price_objective=True)
+    assert [p.id for p in unlimited.products] == [1]
+
+    result = optimize_macro_combination(products, targets, max_snacks=3, price_objective=True, budget=3.0)
+    assert result.algorithm_used == "pareto_price"
+    assert sorted(p.id for p in result.products) == [2, 3]
+    assert sum(p.price_usd for p in result.products) <= 3.0
+    prices = [c["price"] for c in result.pareto_front]
+    assert prices == sorted(prices) and prices[-1] == pytest.approx(6.0)
+    # Nothing fits the budget: the cheapest bundle
+    cheapest = optimize_macro_combination(products, targets, max_snacks=3, price_objective=True, budget=0.1)
+    assert [p.id for p in cheapest.products] == [4]
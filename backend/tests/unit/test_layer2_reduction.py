@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from app.core.layer2_macro_optimization import MacroOptimizer, MacroTargets, optimize_macro_combination
+from app.core.layer2_reduction import reduce_candidates
+from app.db.product_view import ProductView
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def _product(id, protein, carbs, fat=0.0, electrolytes_mg=0.0, calories=100.0):
+    return ProductView(id=id, name=f"Snack {id}", protein=protein, carbs=carbs, fat=fat,
+                       electrolytes_mg=electrolytes_mg, calories=calories)
+
+
+def test_flavor_variants_collapse_and_map_back_to_members():
+    variants = [_product(i, 10.0, 20.0, 5.0) for i in range(1, 4)]
+    other = _product(4, 2.0, 30.0, 1.0, calories=140.0)
+    result = optimize_macro_combination(variants + [other], MacroTargets(20, 40, 10, 0), max_snacks=3,
+                                        max_servings=2, algorithm="dp")
+    assert result.pruning["equivalence_classes"] == 2
+    assert result.pruning["duplicates_collapsed"] == 2
+    assert result.pruning["searched"] == 2
+    # Two servings of the class are two different flavors
+    best = min(result.top_candidates, key=lambda c: c["score"])
+    assert sorted(p.id for p in best["combination"]) in ([1, 2], [1, 3], [2, 3])
+    for candidate in result.top_candidates:
+        assert all(p in variants + [other] for p in candidate["combination"])
+
+
+def test_dominated_products_and_products_over_the_cap_are_dropped():
+    lean = _product(1, 10.0, 20.0, electrolytes_mg=0.0, calories=120.0)
+    heavier = [_product(i, 10.0, 20.0, electrolytes_mg=50.0, calories=150.0 + i) for i in range(2, 5)]
+    huge = _product(5, 40.0, 80.0, calories=900.0)
+    alternatives = [_product(i, 5.0 + i, 10.0, calories=80.0) for i in range(6, 9)]
+    reduction = reduce_candidates([lean, huge] + heavier + alternatives, MacroTargets(20, 40, 0, 0),
+                                  MacroOptimizer().weights, max_snacks=2, max_size=2, calorie_cap=500)
+    assert reduction.stats["over_calorie_cap"] == 1
+    assert huge not in reduction.representatives
+    # Same macros with more calories and electrolytes nobody asked for
+    assert reduction.stats["dominated"] >= 1
+    assert lean in reduction.representatives
+
+
+@pytest.mark.parametrize("calorie_cap", [None, 400.0])
+def test_reduction_keeps_the_best_score(calorie_cap):
+    rng = random.Random(7)
+    rows = []
+    for _ in range(5):
+        base = (float(rng.randint(0, 8)), float(rng.randint(0, 20)), float(rng.randint(0, 5)),
+                rng.choice([0.0, 100.0]), float(rng.randint(60, 160)))
+        # Variants with the same macros and more calories or electrolytes
+        rows += [base[:3] + (base[3] + rng.choice([0.0, 50.0]), base[4] + extra) for extra in (0.0, 10.0, 20.0, 30.0)]
+    products = [_product(i, *row) for i, row in enumerate(rows)]
+    targets = MacroTargets(15, 40, 6, 0)
+    settings = dict(min_snacks=1, max_snacks=3, score_threshold=1.5, calorie_cap=calorie_cap, parallelism=1)
+    full = optimize_macro_combination(products, targets, reduce_candidates=False, **settings)
+    reduced = optimize_macro_combination(products, targets, reduce_candidates=True, **settings)
+    assert reduced.pruning["searched"] < len(products)
+    assert min(c["score"] for c in reduced.top_candidates) == pytest.approx(
+        min(c["score"] for c in full.top_candidates))
+
+
+@pytest.mark.parametrize("algorithm", ["exhaustive", "dp"])
+def test_flavor_variants_still_form_a_bundle_at_one_serving(algorithm):
+    bars = [_product(i, 10.0, 20.0, 5.0) for i in range(1, 4)]
+    gel = _product(9, 2.0, 30.0, 1.0, calories=140.0)
+    settings = dict(max_snacks=3, max_servings=1, algorithm=algorithm, parallelism=1, rng=random.Random(1))
+    full = optimize_macro_combination(bars + [gel], MacroTargets(20, 40, 10, 0), reduce_candidates=False, **settings)
+    reduced = optimize_macro_combination(bars + [gel], MacroTargets(20, 40, 10, 0), reduce_candidates=True, **settings)
+    assert reduced.pruning["searched"] == 2
+    best = min(reduced.top_candidates, key=lambda c: c["score"])
+    assert best["score"] == pytest.approx(min(c["score"] for c in full.top_candidates)) == pytest.approx(0.0)
+    # Two different flavors, never one bar twice
+    assert len({p.id for p in best["combination"]}) == 2 and all(p in bars for p in best["combination"])
@@ -0,0 +1,62 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.layer2_macro_optimization import MacroOptimizer, MacroTargets, optimize_macro_combination
+from app.core.layer2_timing import SLOTS, best_slot_assignment, eligible_slots, slot_targets_from_macro_target
+from app.db.product_view import ProductView
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+MACRO_TARGET = SimpleNamespace(
+    pre_workout_macros={"carbs": 30.0, "protein": 10.0, "fat": 5.0, "calories": 205.0},
+    during_workout_macros={"carbs": 20.0, "protein": 5.0, "fat": 2.0, "electrolytes": 200.0, "calories": 118.0},
+    post_workout_macros={"carbs": 25.0, "protein": 15.0, "fat": 10.0, "calories": 250.0},
+)
+
+
+def _product(id, protein, carbs, fat, electrolytes_mg=0.0, timing=()):
+    return ProductView(id=id, name=f"Snack {id}", protein=protein, carbs=carbs, fat=fat,
+                       electrolytes_mg=electrolytes_mg, calories=4 * (protein + carbs) + 9 * fat,
+                       timing_suitability=tuple(timing))
+
+
+def test_eligible_slots_follow_timing_suitability():
+    assert eligible_slots(_product(1, 1, 1, 1, timing=["pre-workout"])) == (True, False, False)
+    assert eligible_slots(_product(2, 1, 1, 1, timing=["Post-Workout", "snack"])) == (False, False, True)
+    assert eligible_slots(_product(3, 1, 1, 1, timing=["post-workout", "anytime"])) == (True, True, True)
+    assert eligible_slots(_product(4, 1, 1, 1, timing=["breakfast"])) == (True, True, True)
+
+
+def test_best_assignment_matches_every_slot():
+    slot_targets = slot_targets_from_macro_target(MACRO_TARGET)
+    post = _product(1, 15.0, 25.0, 10.0)
+    pre = _product(2, 10.0, 30.0, 5.0)
+    during = _product(3, 5.0, 20.0, 2.0, electrolytes_mg=200.0)
+    score, assignment = best_slot_assignment([post, pre, during], slot_targets, MacroOptimizer().weights)
+    assert score == pytest.approx(0.0)
+    assert [SLOTS[s] for s in assignment] == ["post_workout", "pre_workout", "during_workout"]
+
+    # A post-workout-only product is never placed before the workout
+    _, assignment = best_slot_assignment([_product(4, 10.0, 30.0, 5.0, timing=["post-workout"])], slot_targets,
+                                         MacroOptimizer().weights)
+    assert SLOTS[assignment[0]] == "post_workout"
+
+
+def test_timing_aware_optimization_splits_the_selected_bundle():
+    rng = random.Random(4)
+    tags = [(), ("pre-workout",), ("post-workout",), ("during-workout",), ("anytime",)]
+    products = [
+        _product(i, float(rng.randint(0, 20)), float(rng.randint(0, 40)), float(rng.randint(0, 15)),
+                 float(rng.choice([0, 100, 250])), timing=rng.choice(tags))
+        for i in range(14)
+    ]
+    result = optimize_macro_combination(products, MacroTargets(30, 75, 17, 200), max_snacks=5, parallelism=1,
+                                        slot_targets=slot_targets_from_macro_target(MACRO_TARGET))
+    assert sorted(p.id for ps in result.timing_slots.values() for p in ps) == sorted(p.id for p in result.products)
+    for index, slot in enumerate(SLOTS):
+        assert all(eligible_slots(p)[index] for p in result.timing_slots[slot])
+    scores = [c["timing_score"] for c in result.top_candidates]
+    assert scores == sorted(scores)
@@ -0,0 +1,64 @@
+import gc
+
+import pytest
+
+from app.core.memory_policy import MemoryPolicy, current_rss_mb
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def test_periodic_policy_collects_every_n_checkpoints():
+    policy = MemoryPolicy(policy="periodic", gc_every_n=5, freeze_after_warmup=False)
+    for _ in range(12):
+        policy.checkpoint()
+    assert policy.stats.checkpoints == 12
+    assert policy.stats.collections == 2
+
+
+def test_none_policy_never_collects():
+    policy = MemoryPolicy(policy="none", freeze_after_warmup=False)
+    for _ in range(50):
+        policy.checkpoint()
+    assert policy.stats.collections == 0
+
+
+def test_threshold_policy_sets_and_restores_gc_thresholds():
+    original = gc.get_threshold()
+    policy = MemoryPolicy(policy="threshold", gc_thresholds=(12345, 11, 13), freeze_after_warmup=False)
+    try:
+        assert gc.get_threshold() == (12345, 11, 13)
+        policy.checkpoint()
+        assert policy.stats.collections == 0
+    finally:
+        policy.reset()
+    assert gc.get_threshold() == original
+
+
+def test_rss_policy_trims_only_above_limit():
+    below = MemoryPolicy(policy="rss", rss_limit_mb=10**9, rss_check_seconds=0, freeze_after_warmup=False)
+    below.checkpoint()
+    assert below.stats.collections == 0
+
+    above = MemoryPolicy(policy="rss", rss_limit_mb=0, rss_check_seconds=0, freeze_after_warmup=False)
+    above.checkpoint()
+    assert above.stats.trims == 1
+
+
+def test_freeze_after_warmup_moves_objects_to_permanent_generation():
+    policy = MemoryPolicy(policy="none", freeze_after_warmup=True)
+    try:
+        policy.freeze_after_warmup()
+        assert gc.get_freeze_count() > 0
+    finally:
+        policy.reset()
+    assert gc.get_freeze_count() == 0
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        MemoryPolicy(policy="aggressive")
+
+
+def test_current_rss_is_positive():
+    assert current_rss_mb() > 0
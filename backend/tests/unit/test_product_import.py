@@ -0,0 +1,118 @@
+import io
+import json
+
+import pytest
+from sqlalchemy import inspect, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app.db.models import Product
+from app.db.product_import import ImportStats, ProductRecord, import_products, read_products
+from app.db.session import Base, create_database_engine
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+TEMPLATE = """# Product Entry Template
+# Line 1: product name (string)
+
+# PRODUCT 1
+Trail Mix
+Acme
+Nuts and raisins
+1 cup
+N
+6
+30
+12
+3
+N
+N
+salty
+crunchy
+mix
+3.5
+nuts,trail mix
+high-protein
+snack
+N
+nuts
+N
+
+# PRODUCT 2
+# comment inside a product
+Energy Gel
+GoFast
+"""
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'import.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _names(db):
+    return {p.name: p for p in db.scalars(select(Product))}
+
+
+def test_template_feed_is_parsed_per_product():
+    stats = ImportStats()
+    records = list(read_products(io.StringIO(TEMPLATE), "template", stats))
+    assert [r.name for r in records] == ["Trail Mix", "Energy Gel"]
+    mix = records[0]
+    assert mix.calories == 0.0 and mix.protein == 6.0 and mix.price_usd == 3.5
+    assert mix.categories == ["nuts", "trail mix"] and mix.tags is None and mix.verified is False
+    assert records[1].brand == "GoFast" and records[1].description is None
+    assert stats.read == 2 and stats.invalid == 0
+
+
+def test_csv_and_jsonl_feeds_validate_and_skip_invalid_rows():
+    feed = "name,protein,dietary_flags,verified\nBar,20,\"vegan, gluten-free\",t\n,5,,f\nShake,lots,,f\n"
+    stats = ImportStats()
+    records = list(read_products(io.StringIO(feed), "csv", stats))
+    assert [(r.name, r.protein, r.dietary_flags, r.verified) for r in records] == [
+        ("Bar", 20.0, ["vegan", "gluten-free"], True)
+    ]
+    assert stats.read == 3 and stats.invalid == 2
+    assert "name is missing" in stats.errors[0] and "not a number" in stats.errors[1]
+
+    lines = [json.dumps({"name": "Gel", "carbs": 25, "allergens": ["none"]}), "", "{broken", "[1, 2]"]
+    stats = ImportStats()
+    records = list(read_products(io.StringIO("\n".join(lines)), "jsonl", stats))
+    assert records == [ProductRecord(name="Gel", carbs=25.0, allergens=["none"])]
+    assert stats.invalid == 2 and stats.errors[0].startswith("line 3: invalid JSON")
+
+
+def test_upsert_inserts_then_updates_by_name(db):
+    stats = import_products(db, [ProductRecord(name="Bar", protein=10.0), ProductRecord(name="Gel", carbs=20.0),
+                                 ProductRecord(name="Chips", fat=9.0)], chunk_size=2)
+    assert (stats.inserted, stats.updated) == (3, 0)
+    ids = {name: p.id for name, p in _names(db).items()}
+
+    stats = import_products(db, [ProductRecord(name="Bar", protein=12.0), ProductRecord(name="Bar", protein=15.0),
+                                 ProductRecord(name="Jerky", protein=9.0)])
+    assert (stats.inserted, stats.updated) == (1, 2)
+    db.expire_all()
+    products = _names(db)
+    assert len(products) == 4
+    assert products["Bar"].protein == 15.0 and products["Bar"].id == ids["Bar"]
+    assert products["Bar"].updated_at is not None and products["Gel"].updated_at is None
+
+    stats = import_products(db, [ProductRecord(name="Gel", carbs=99.0)], skip_existing=True)
+    assert stats.skipped == 1 and stats.changed == 0
+    db.expire_all()
+    assert _names(db)["Gel"].carbs == 20.0
+
+
+def test_unique_name_index_is_added_to_older_databases(db):
+    db.execute(text("DROP INDEX ux_products_name"))
+    db.commit()
+    import_products(db, [ProductRecord(name="Bar")])
+    import_products(db, [ProductRecord(name="Bar", protein=3.0)])
+    indexes = {index["name"]: index["unique"] for index in inspect(db.get_bind()).get_indexes("products")}
+    assert indexes["ux_products_name"]
+    assert db.scalar(select(Product.protein)) == 3.0
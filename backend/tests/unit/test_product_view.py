@@ -0,0 +1,47 @@
+import dataclasses
+
+import numpy as np
+import pytest
+
+from app.db.catalog_index import CatalogGeneration, NUTRIENT_COLUMNS, _catalog_arrays
+from app.db.models import Product
+from app.db.product_view import CatalogSnapshot, ProductView
+from app.schemas.product import Product as ProductSchema
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+def test_view_copies_columns_and_is_immutable():
+    product = Product(id=7, name="Bar", protein=12.0, dietary_flags=["vegan"], diet="keto",
+                      allergens=None, verified=None)
+    view = ProductView.from_orm(product)
+    assert (view.id, view.name, view.protein) == (7, "Bar", 12.0)
+    assert view.dietary_flags == ("vegan",)
+    assert view.diet == ("keto",)
+    assert view.allergens == ()
+    assert view.verified is False
+    assert not hasattr(view, "__dict__")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        view.protein = 1.0
+
+
+def test_view_serializes_like_the_orm_row():
+    view = ProductView(id=1, name="Bar", calories=100.0, protein=10.0, carbs=12.0, fat=3.0,
+                       categories=("protein bar",), dietary_flags=(), timing_suitability=("post-workout",))
+    schema = ProductSchema.model_validate(view, from_attributes=True)
+    assert schema.categories == ["protein bar"]
+    assert schema.timing_suitability == ["post-workout"]
+
+
+def test_generation_snapshot_is_built_once_and_restricted_to_its_rows(db):
+    product_ids, nutrients, filter_index = _catalog_arrays(db)
+    kept = product_ids[:3]
+    generation = CatalogGeneration("test", None, kept, nutrients[:3],
+                                   np.zeros((3, 4), dtype=np.float32), filter_index)
+    snapshot = generation.snapshot(db)
+    assert isinstance(snapshot, CatalogSnapshot)
+    assert [view.id for view in snapshot.views] == [int(pid) for pid in kept]
+    assert generation.snapshot(db) is snapshot
+    assert snapshot.get_many([int(kept[2]), -1, int(kept[0])]) == [snapshot.views[2], snapshot.views[0]]
+    assert snapshot.views[0].protein == pytest.approx(nutrients[0][NUTRIENT_COLUMNS.index("protein")])
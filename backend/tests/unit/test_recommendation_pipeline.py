@@ -0,0 +1,78 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.core import recommendation
+from app.core.bundle_sessions import start_bundle_session
+from app.core.recommendation import _compute_recommendations, swap_bundle_products
+from app.db.catalog_index import NUTRIENT_COLUMNS, CatalogGeneration
+from app.db.models import MacroTarget
+from app.db.product_view import CatalogSnapshot
+from app.schemas.recommendation import BundleSwapRequest, RecommendationRequest
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+class FakeMacroService:
+    def __init__(self):
+        self.user_inputs = []
+
+    def get_context_and_macro_targets(self, user_input, deadline=None):
+        self.user_inputs.append(user_input)
+        return "Favor fast-digesting carbs.", MacroTarget(
+            target_protein=30.0, target_carbs=60.0, target_fat=15.0, target_electrolytes=200.0,
+            target_calories=500.0, pre_workout_macros={"carbs": 20.0, "protein": 5.0, "fat": 3.0},
+            during_workout_macros={"carbs": 20.0, "protein": 0.0, "electrolytes": 200.0},
+            post_workout_macros={"carbs": 20.0, "protein": 25.0, "fat": 12.0}, rag_context="", reasoning="")
+
+    def extract_key_principles(self, context, num_principles=2, rng=None):
+        return []
+
+
+@pytest.fixture
+def pipeline(monkeypatch, random_products):
+    products = random_products(14, seed=5)
+    service = FakeMacroService()
+    monkeypatch.setattr(recommendation, "get_macro_service", lambda: service)
+    monkeypatch.setattr(recommendation, "lookup_precomputed_bundles", lambda *args, **kwargs: None)
+    monkeypatch.setattr(recommendation, "_layer1_candidates", lambda *args, **kwargs: list(products))
+    n = len(products)
+    catalog = CatalogGeneration("g1", None, np.array([p.id for p in products], dtype=np.int64),
+                                np.zeros((n, len(NUTRIENT_COLUMNS)), dtype=np.float32), np.zeros((n, 4), dtype=np.float32),
+                                {"dietary": {}, "allergens": {}})
+    return service, catalog, CatalogSnapshot("g1", products)
+
+
+def _timing_request():
+    return RecommendationRequest(user_query="snacks for my long run", age=30, weight_kg=65.0,
+                                 exercise_type="running", exercise_duration_minutes=90,
+                                 preferences={"calorie_cap": 700}, num_alternatives=2,
+                                 max_alternative_overlap=0.5, timing_aware=True, seed=3)
+
+
+def test_activity_fields_build_the_user_input_from_its_columns(pipeline):
+    service, catalog, snapshot = pipeline
+    request = _timing_request()
+    result, unsaved = _compute_recommendations(request, catalog, snapshot, seed=3)
+
+    user_input = service.user_inputs[0]
+    assert (user_input.age, user_input.exercise_type, user_input.preferences) == (30, "running", {"calorie_cap": 700})
+    assert result.response.recommended_products and result.response.seed == 3
+    assert result.bundle_session is not None
+    assert unsaved == []
+
+
+def test_swaps_keep_the_timing_slots(monkeypatch, pipeline):
+    _, catalog, snapshot = pipeline
+    monkeypatch.setattr(recommendation, "get_catalog_generation", lambda: catalog)
+    result, _ = _compute_recommendations(_timing_request(), catalog, snapshot, seed=3)
+    assert result.bundle_session.settings["slot_targets"]
+    bundle = [p.id for p in result.response.recommended_products]
+    swap = asyncio.run(swap_bundle_products(BundleSwapRequest(
+        bundle_session_token=start_bundle_session(result.bundle_session, 3), product_ids=bundle,
+        exclude_product_ids=bundle[-1:])))
+    slots = swap.timing_breakdown
+    slot_ids = [p.id for p in slots.pre_workout_products + slots.during_workout_products + slots.post_workout_products]
+    assert sorted(slot_ids) == sorted(p.id for p in swap.recommended_products)
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from app.core import metrics
+from app.core.singleflight import SingleFlight
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_concurrent_duplicates_share_one_computation():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"bundle": [1, 2]}
+
+    async def main():
+        return await asyncio.gather(*(flight.do("same", compute) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    assert metrics.get_counter("singleflight.test.coalesced") == 4
+    assert flight.coalescing_rate() == pytest.approx(0.8)
+    assert flight.in_flight == 0
+
+
+def test_different_keys_and_later_calls_run_separately():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0)
+        return value
+
+    async def main():
+        first = await asyncio.gather(flight.do("a", lambda: compute("a")), flight.do("b", lambda: compute("b")))
+        second = await flight.do("a", lambda: compute("a"))
+        return first, second
+
+    assert asyncio.run(main()) == (["a", "b"], "a")
+    assert calls == ["a", "b", "a"]
+    assert metrics.get_counter("singleflight.test.coalesced") == 0
+
+
+def test_followers_receive_the_leaders_exception():
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("LLM unavailable")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.in_flight == 0
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"bundle": [1, 2]}
+
+    async def main():
+        leader = asyncio.create_task(flight.do("k", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", compute))
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == {"bundle": [1, 2]}
+    assert len(calls) == 1
+    assert flight.in_flight == 0
@@ -0,0 +1,60 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.v1.endpoints import health
+from app.core import metrics, startup
+from app.core.startup import Startup
+
+# Mark all tests in this file as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_ready_after_every_step_ran_in_order(monkeypatch):
+    monkeypatch.setattr(startup, "process_uptime", lambda: 1.5)
+    calls = []
+    tracker = Startup(steps=[("first", lambda: calls.append("first")), ("second", lambda: calls.append("second"))],
+                      budget_seconds=10)
+    assert not tracker.ready
+    report = tracker.run()
+    assert calls == ["first", "second"]
+    assert tracker.ready and not report.failed and not report.over_budget
+    assert [step.name for step in report.steps] == ["process start until warmup", "first", "second"]
+    assert report.total_seconds >= 1.5
+
+
+def test_failed_step_keeps_worker_not_ready(monkeypatch):
+    monkeypatch.setattr(startup, "process_uptime", lambda: 5.0)
+
+    def broken():
+        raise RuntimeError("vector store missing")
+
+    tracker = Startup(steps=[("catalog", broken), ("never", lambda: None)], budget_seconds=1)
+    report = tracker.run()
+    assert not tracker.ready and report.failed and report.over_budget
+    assert report.steps[-1].name == "catalog" and report.steps[-1].error == "vector store missing"
+    assert metrics.get_counter("startup.failed") == 1
+    assert metrics.get_counter("startup.over_budget") == 1
+
+
+def test_ready_endpoint_flips_after_startup(monkeypatch):
+    tracker = Startup(steps=[])
+    monkeypatch.setattr(health, "get_startup", lambda: tracker)
+    app = FastAPI()
+    app.include_router(health.router)
+    client = TestClient(app)
+
+    response = client.get("/ready")
+    assert response.status_code == 503 and response.json()["status"] == "starting"
+    assert client.get("/health").status_code == 200
+
+    tracker.run()
+    response = client.get("/ready")
+    assert response.status_code == 200 and response.json()["status"] == "ready"
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Compare the async database path with the sync one under concurrency.
+
+Runs the database work of the macro-target endpoints (history lookups plus a
+share of user input / macro target inserts) from --concurrency coroutines on
+one event loop, against a copy of the SQLite database:
+
+- sync:  a Session inside the coroutine, as the endpoints did before
+         (every round-trip blocks the event loop)
+- async: an AsyncSession over aiosqlite (app.db.async_session)
+
+Both use the tuned engines of app.db.session (WAL, single writer, read
+pool). It reports throughput, p50/p95 latency and the event loop lag: how
+late a 10 ms timer fires while the run is going on, i.e. what every other
+request on the worker waits.
+
+Usage:
+    python tests/utils/benchmark_async_db.py [--operations 2000] [--concurrency 32] [--write-ratio 0.1]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, BACKEND)
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.db.async_session import create_async_database_engine, save_rows_async
+from app.db.models import MacroTarget, UserInput
+from app.db.session import Base, create_database_engine, save_rows
+
+
+def _rows(i: int):
+    user_input = UserInput(user_query=f"benchmark query {i}", age=30, weight_kg=70.0, exercise_type="running")
+    return user_input, MacroTarget(target_protein=20.0, target_carbs=40.0, user_input=user_input)
+
+
+class SyncPath:
+    def __init__(self, url: str):
+        self.writer = create_database_engine(url)
+        self.reader = create_database_engine(url, read_only=True)
+        self.sessions = sessionmaker(bind=self.writer, expire_on_commit=False)
+        self.read_sessions = sessionmaker(bind=self.reader)
+
+    async def lookup(self, user_input_id: int):
+        db = self.read_sessions()
+        try:
+            return db.query(MacroTarget).filter(MacroTarget.user_input_id == user_input_id).first()
+        finally:
+            db.close()
+
+    async def save(self, i: int):
+        db = self.sessions()
+        try:
+            save_rows(db, *_rows(i))
+        finally:
+            db.close()
+
+    async def close(self):
+        self.writer.dispose()
+        self.reader.dispose()
+
+
+class AsyncPath:
+    def __init__(self, url: str):
+        self.writer = create_async_database_engine(url)
+        self.reader = create_async_database_engine(url, read_only=True)
+        self.sessions = async_sessionmaker(bind=self.writer, expire_on_commit=False)
+        self.read_sessions = async_sessionmaker(bind=self.reader)
+
+    async def lookup(self, user_input_id: int):
+        async with self.read_sessions() as db:
+            result = await db.execute(select(MacroTarget).filter(MacroTarget.user_input_id == user_input_id).limit(1))
+            return result.scalars().first()
+
+    async def save(self, i: int):
+        async with self.sessions() as db:
+            await save_rows_async(db, *_rows(i))
+
+    async def close(self):
+        await self.writer.dispose()
+        await self.reader.dispose()
+
+
+async def _loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+
+async def run(path, ids, args):
+    rng = random.Random(0)
+    operations = [("save", i) if rng.random() < args.write_ratio else ("lookup", rng.choice(ids))
+                  for i in range(args.operations)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, lags = [], []
+
+    async def one(kind, value):
+        async with semaphore:
+            start = time.perf_counter()
+            await (path.save(value) if kind == "save" else path.lookup(value))
+            latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_loop_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(kind, value) for kind, value in operations))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    await path.close()
+    return elapsed, latencies, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the async vs sync database path")
+    parser.add_argument("--database", default=os.path.join(BACKEND, "data", "products_and_kds.db"),
+                        help="SQLite database to copy (left untouched)")
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(f"{'path':<6}  {'ops/s':>8}  {'p50 ms':>7}  {'p95 ms':>7}  {'max loop lag ms':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, path_class in (("sync", SyncPath), ("async", AsyncPath)):
+            copy = os.path.join(tmp, f"{name}.db")
+            shutil.copy(args.database, copy)
+            url = f"sqlite:///{copy}"
+            setup = create_database_engine(url)
+            Base.metadata.create_all(setup)
+            setup.dispose()
+            seed_path = SyncPath(url)
+            for i in range(100):
+                asyncio.run(seed_path.save(-i))
+            ids = [row.id for row in seed_path.read_sessions().query(UserInput.id).all()]
+            asyncio.run(seed_path.close())
+
+            elapsed, latencies, lags = asyncio.run(run(path_class(url), ids, args))
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"{name:<6}  {len(latencies) / elapsed:8.0f}  {statistics.median(latencies) * 1000:7.2f}  "
+                  f"{p95 * 1000:7.2f}  {max(lags, default=0.0) * 1000:15.1f}")
+
+
+if __name__ == "__main__":
+    main()
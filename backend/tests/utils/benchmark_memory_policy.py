@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark the latency impact of each memory policy option.
+
+Builds a large, long-lived object graph to stand in for the heap of a worker
+with torch, chromadb and langchain loaded, then times a simulated request
+(a little garbage plus one or more checkpoints) under:
+
+- legacy: gc.collect() on every call, as the embedding wrappers used to do
+- none / periodic / threshold / rss policies from app.core.memory_policy
+- each of the above with gc.freeze() applied after warmup
+
+If torch and sentence-transformers are installed, --real loads the embedding
+model first so the heap is the real one.
+
+Usage:
+    python tests/utils/benchmark_memory_policy.py [--requests 500] [--heap-objects 2000000] [--real]
+"""
+
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app.core.memory_policy import MemoryPolicy, current_rss_mb
+
+CHECKPOINTS_PER_REQUEST = 4  # embed_query, retrieval, vector search, encode
+
+
+def build_heap(num_objects: int):
+    """Allocate a long-lived graph of container objects tracked by the GC."""
+    return [{"id": i, "tags": [i, str(i)]} for i in range(num_objects // 3)]
+
+
+def simulated_request(checkpoint):
+    """Create some short-lived garbage and hit the checkpoints a request would."""
+    for _ in range(CHECKPOINTS_PER_REQUEST):
+        scratch = [{"score": i, "metadata": {"form": "bar"}} for i in range(200)]
+        del scratch
+        checkpoint()
+
+
+def run_case(name: str, checkpoint, requests: int):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        simulated_request(checkpoint)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p50 = statistics.median(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<24} mean={statistics.mean(timings):8.3f}ms  p50={p50:8.3f}ms  p99={p99:8.3f}ms  max={timings[-1]:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory policies")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--heap-objects", type=int, default=2_000_000)
+    parser.add_argument("--real", action="store_true", help="Load the real embedding model first")
+    args = parser.parse_args()
+
+    if args.real:
+        from app.core.global_embeddings import get_embedding_model
+        get_embedding_model()
+    heap = build_heap(args.heap_objects)
+    print(f"Heap ready: {len(gc.get_objects())} tracked objects, RSS {current_rss_mb():.0f} MB\n")
+
+    # Policies are created lazily: the threshold policy changes global GC settings
+    cases = [
+        ("legacy gc.collect()", None),
+        ("none", lambda: MemoryPolicy(policy="none")),
+        ("periodic (every 200)", lambda: MemoryPolicy(policy="periodic", gc_every_n=200)),
+        ("threshold", lambda: MemoryPolicy(policy="threshold")),
+        ("rss (limit 1500MB)", lambda: MemoryPolicy(policy="rss", rss_check_seconds=1.0)),
+    ]
+
+    for frozen in (False, True):
+        print("--- with gc.freeze() after warmup ---" if frozen else "--- without freeze ---")
+        for name, make_policy in cases:
+            if frozen:
+                gc.collect()
+                gc.freeze()
+            policy = make_policy() if make_policy else None
+            checkpoint = policy.checkpoint if policy else gc.collect
+            run_case(name, checkpoint, args.requests)
+            if policy is not None:
+                policy.reset()
+                print(f"{'':<24} collections={policy.stats.collections} pause_total={policy.stats.total_pause_ms:.1f}ms")
+            if frozen:
+                gc.unfreeze()
+        print()
+
+    del heap
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Measure per-worker memory and throughput scaling of the pre-fork launcher.
+
+For each worker count from 1 to --max-workers, and both with and without
+preloading (python -m app.prefork [--no-preload]), this starts the server,
+sends one warmup request per worker, then drives it with
+tests/utils/load_recommend.py's client. It reports:
+
+- RSS per worker: resident memory, counting shared pages in full
+- PSS per worker: shared pages divided among the processes sharing them, so
+  the sum over workers is the real footprint
+- USS per worker: pages only that worker has (what each extra worker costs)
+- throughput and p50 latency of the load run
+
+Linux only (reads /proc/<pid>/smaps_rollup).
+
+Usage:
+    python tests/utils/benchmark_prefork.py [--max-workers 4] [--requests 100] [--port 8100]
+"""
+
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_recommend import send
+
+
+def memory_mb(pid: int):
+    """(rss, pss, uss) of a process in MB."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    uss = values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0)
+    return values.get("Rss", 0.0), values.get("Pss", 0.0), uss
+
+
+def worker_pids(master: int):
+    with open(f"/proc/{master}/task/{master}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def wait_ready(base_url: str, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/api/v1/health", timeout=2):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not come up within {timeout}s")
+
+
+def run_case(workers: int, preload: bool, args):
+    command = [sys.executable, "-m", "app.prefork", "--workers", str(workers), "--port", str(args.port),
+               "--log-level", "warning"]
+    if not preload:
+        command.append("--no-preload")
+    server = subprocess.Popen(command, cwd=BACKEND, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{args.port}"
+    url = base_url + "/api/v1/recommend/"
+    try:
+        wait_ready(base_url, args.startup_timeout)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda i: send(url, 100000 + i, args.timeout), range(workers * 2)))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda i: send(url, i, args.timeout), range(args.requests)))
+        elapsed = time.perf_counter() - start
+        memory = [memory_mb(pid) for pid in worker_pids(server.pid)]
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    ok = [latency for outcome, latency, _ in results if outcome in ("full", "degraded")]
+    rss, pss, uss = (statistics.mean(column) for column in zip(*memory))
+    print(f"{workers:>7}  {'yes' if preload else 'no':<7}  {rss:8.0f}  {pss:8.0f}  {uss:8.0f}  "
+          f"{sum(m[1] for m in memory):9.0f}  {len(ok) / elapsed:8.2f}  "
+          f"{statistics.median(ok) * 1000 if ok else float('nan'):9.0f}  {len(results) - len(ok):6d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pre-fork memory sharing and throughput")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7}  {'preload':<7}  {'RSS MB':>8}  {'PSS MB':>8}  {'USS MB':>8}  "
+          f"{'total PSS':>9}  {'req/s':>8}  {'p50 ms':>9}  {'failed':>6}")
+    for workers in range(1, args.max_workers + 1):
+        for preload in (True, False):
+            run_case(workers, preload, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of the streaming product importer.
+
+Writes a synthetic feed of --products products (JSON Lines or CSV) and
+imports it twice into a fresh SQLite database with the tuned writer engine:
+the first run inserts every product, the second updates every product
+(upsert by name). Reports products per minute and the peak resident memory
+of the process after each run (it stays flat as the feed grows).
+
+Usage:
+    python tests/utils/benchmark_product_import.py [--products 50000] [--format jsonl] [--chunk-size 1000]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import resource
+import tempfile
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, BACKEND)
+
+from sqlalchemy.orm import sessionmaker
+
+from app.db.product_import import FIELD_ORDER, ImportStats, import_products, read_products
+from app.db.session import Base, create_database_engine
+
+FLAVORS = ["chocolate", "vanilla", "berry", "salty", "peanut butter"]
+FORMS = ["bar", "gel", "drink", "powder", "chips"]
+
+
+def synthetic_product(i: int, rng: random.Random):
+    return {
+        "name": f"Benchmark Snack {i}", "brand": f"Brand {i % 97}", "description": "Synthetic product",
+        "serving_size": "1 bar", "calories": rng.uniform(80, 400), "protein": rng.uniform(0, 30),
+        "carbs": rng.uniform(0, 60), "fat": rng.uniform(0, 20), "fiber": rng.uniform(0, 8),
+        "sugar": rng.uniform(0, 25), "electrolytes_mg": rng.uniform(0, 500), "flavor": rng.choice(FLAVORS),
+        "texture": "chewy", "form": rng.choice(FORMS), "price_usd": rng.uniform(1, 5),
+        "categories": ["snack"], "dietary_flags": rng.sample(["vegan", "gluten-free", "keto"], 1),
+        "timing_suitability": ["pre-workout"], "tags": ["energy"], "allergens": ["none"], "diet": ["vegetarian"],
+        "link": None, "image_url": None, "source": "benchmark", "verified": False,
+    }
+
+
+def write_feed(path: str, feed_format: str, count: int, seed: int):
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        if feed_format == "csv":
+            writer = csv.DictWriter(f, fieldnames=FIELD_ORDER)
+            writer.writeheader()
+            for i in range(count):
+                row = synthetic_product(i, rng)
+                writer.writerow({k: ",".join(v) if isinstance(v, list) else v for k, v in row.items()})
+        else:
+            for i in range(count):
+                f.write(json.dumps(synthetic_product(i, rng)) + "\n")
+
+
+def run(sessions, path: str, feed_format: str, chunk_size: int):
+    db = sessions()
+    stats = ImportStats()
+    start = time.perf_counter()
+    try:
+        with open(path, newline="") as f:
+            import_products(db, read_products(f, feed_format, stats), chunk_size=chunk_size, stats=stats)
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - start
+    return stats, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming product importer")
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_database_engine(f"sqlite:///{os.path.join(tmp, 'import.db')}")
+        Base.metadata.create_all(engine)
+        sessions = sessionmaker(bind=engine)
+        print(f"{'run':<8}  {'products':>8}  {'seconds':>7}  {'per minute':>10}  {'peak RSS MB':>11}")
+        for label, seed in (("insert", 0), ("update", 1)):
+            feed = os.path.join(tmp, f"{label}.{args.format}")
+            write_feed(feed, args.format, args.products, seed)
+            stats, elapsed, peak = run(sessions, feed, args.format, args.chunk_size)
+            print(f"{label:<8}  {stats.changed:>8}  {elapsed:7.1f}  {stats.changed / elapsed * 60:10.0f}  "
+                  f"{peak:11.0f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
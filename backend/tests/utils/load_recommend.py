@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Load generator for POST /api/v1/recommend, to check admission control.
+
+Sends --requests requests from --concurrency concurrent clients to a running
+server and reports, per outcome, how many requests got it and their latency:
+
+- full: 200 with the full pipeline
+- degraded: 200 with the degraded path (its reasoning mentions the busy server)
+- rejected: 503 (with the Retry-After values seen)
+- other status codes and connection errors
+
+Each request gets a distinct query suffix and seed so the result cache does not
+answer everything. Compare runs with different ADMISSION_* settings on the
+server, and GET /api/v1/metrics for the admission counters.
+
+Usage:
+    python tests/utils/load_recommend.py [--url http://localhost:8000] [--concurrency 32] [--requests 200]
+"""
+
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+QUERIES = [
+    "I'm 25, 70kg, going for a 90 minute run tomorrow morning",
+    "Strength training for an hour, I weigh 82kg, high protein snacks please",
+    "Cycling 2 hours, 30 years old, 65kg, no nuts",
+    "45 minute HIIT session, 60kg, something chewy and not too sweet",
+]
+
+BUSY_REASONING = "the server was busy"
+
+
+def send(url: str, index: int, timeout: float):
+    body = json.dumps({
+        "user_query": f"{QUERIES[index % len(QUERIES)]} (load test {index})",
+        "seed": index,
+    }).encode("utf-8")
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = json.loads(response.read())
+            outcome = "degraded" if BUSY_REASONING in (payload.get("reasoning") or "") else "full"
+            return outcome, time.perf_counter() - start, None
+    except urllib.error.HTTPError as e:
+        if e.code == 503:
+            return "rejected", time.perf_counter() - start, e.headers.get("Retry-After")
+        return f"http_{e.code}", time.perf_counter() - start, None
+    except (urllib.error.URLError, TimeoutError) as e:
+        return f"error ({type(e).__name__})", time.perf_counter() - start, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the recommendation endpoint")
+    parser.add_argument("--url", default="http://localhost:8000", help="Server base URL")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Client timeout in seconds")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + "/api/v1/recommend/"
+    print(f"Sending {args.requests} requests to {url} with {args.concurrency} concurrent clients")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda i: send(url, i, args.timeout), range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = defaultdict(list)
+    retry_after = Counter()
+    for outcome, latency, retry in results:
+        latencies[outcome].append(latency * 1000)
+        if retry is not None:
+            retry_after[retry] += 1
+
+    print(f"Done in {elapsed:.1f}s ({len(results) / elapsed:.1f} requests/s)")
+    for outcome, timings in sorted(latencies.items()):
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(f"{outcome:<20} count={len(timings):5d}  p50={statistics.median(timings):9.1f}ms  "
+              f"p99={p99:9.1f}ms  max={timings[-1]:9.1f}ms")
+    if retry_after:
+        print(f"Retry-After values: {dict(retry_after)}")
+
+
+if __name__ == "__main__":
+    main()
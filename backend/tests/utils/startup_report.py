@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Break down the startup cost of a worker by import and initialization step.
+
+1. Runs `python -X importtime -c "import app.main"` in a fresh interpreter and
+   sums the import time of every module per top-level package.
+2. Runs the startup steps of app.core.startup in this process (imports, model,
+   catalog, guideline store, enhanced vectors, warmup inference) and prints
+   each step's time against STARTUP_BUDGET_SECONDS.
+
+Usage:
+    python tests/utils/startup_report.py [--top 15]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, BACKEND)
+
+
+def import_times(module: str = "app.main"):
+    """Import seconds per top-level package (sum of its modules' self time) when importing `module`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=BACKEND, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    totals = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        self_us, _, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if self_us.isdigit():  # skips the header line
+            totals[name.split(".")[0]] += int(self_us) / 1e6
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup cost report")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    args = parser.parse_args()
+
+    print("== Imports (python -X importtime -c 'import app.main') ==")
+    try:
+        totals = import_times()
+        for name, seconds in sorted(totals.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {name:<28} {seconds:7.2f}s")
+        print(f"  {'total':<28} {sum(totals.values()):7.2f}s")
+    except RuntimeError as e:
+        print(f"  import failed: {e}")
+
+    os.chdir(BACKEND)
+    from app.core.startup import Startup
+    print("\n== Startup steps (app.core.startup) ==")
+    report = Startup().run()
+    for step in report.steps:
+        print(f"  {step.name:<28} {step.seconds:7.2f}s" + (f"  FAILED: {step.error}" if step.error else ""))
+    print(f"  {'total':<28} {report.total_seconds:7.2f}s  (budget {report.budget_seconds:.0f}s"
+          f"{', OVER BUDGET' if report.over_budget else ''})")
+    print(f"  ready: {report.ready}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,7 @@ from app.core.recommendation import _build_hard_filters_from_llm_extraction, _pr
 from app.schemas.recommendation import RecommendationRequest
 from app.db.session import SessionLocal
 from app.db.models import Product
+from app.db.catalog_index import get_catalog_generation
 
 load_dotenv()
 
@@ -90,6 +91,7 @@ def test_hard_filter_application():
     
     # Create database session
     db = SessionLocal()
+    catalog = get_catalog_generation()
     
     try:
         # Get total product count
@@ -101,7 +103,7 @@ def test_hard_filter_application():
             "dietary_requirements": ["vegan"]
         }
         
-        filtered_products_1 = _pre_filter_products_by_hard_constraints(db, hard_filters_1)
+        filtered_products_1 = _pre_filter_products_by_hard_constraints(catalog, catalog.snapshot(db), hard_filters_1)
         print(f"Test Case 1 - Vegan filter:")
         print(f"Hard filters: {hard_filters_1}")
         print(f"Products after filtering: {len(filtered_products_1)}")
@@ -119,7 +121,7 @@ def test_hard_filter_application():
             "dietary_requirements": ["gluten-free"]
         }
         
-        filtered_products_2 = _pre_filter_products_by_hard_constraints(db, hard_filters_2)
+        filtered_products_2 = _pre_filter_products_by_hard_constraints(catalog, catalog.snapshot(db), hard_filters_2)
         print(f"Test Case 2 - Gluten-free filter:")
         print(f"Hard filters: {hard_filters_2}")
         print(f"Products after filtering: {len(filtered_products_2)}")
@@ -137,7 +139,7 @@ def test_hard_filter_application():
             "allergen_restrictions": ["milk"]
         }
         
-        filtered_products_3 = _pre_filter_products_by_hard_constraints(db, hard_filters_3)
+        filtered_products_3 = _pre_filter_products_by_hard_constraints(catalog, catalog.snapshot(db), hard_filters_3)
         print(f"Test Case 3 - Exclude milk allergen:")
         print(f"Hard filters: {hard_filters_3}")
         print(f"Products after filtering: {len(filtered_products_3)}")
@@ -156,7 +158,7 @@ def test_hard_filter_application():
             "allergen_restrictions": ["tree-nuts"]
         }
         
-        filtered_products_4 = _pre_filter_products_by_hard_constraints(db, hard_filters_4)
+        filtered_products_4 = _pre_filter_products_by_hard_constraints(catalog, catalog.snapshot(db), hard_filters_4)
         print(f"Test Case 4 - Vegan + no tree nuts:")
         print(f"Hard filters: {hard_filters_4}")
         print(f"Products after filtering: {len(filtered_products_4)}")
@@ -217,8 +219,9 @@ def test_full_recommendation_flow():
     
     # Apply hard filters to products
     db = SessionLocal()
+    catalog = get_catalog_generation()
     try:
-        pre_filtered_products = _pre_filter_products_by_hard_constraints(db, hard_filters)
+        pre_filtered_products = _pre_filter_products_by_hard_constraints(catalog, catalog.snapshot(db), hard_filters)
         print(f"Pre-filtered products: {len(pre_filtered_products)} out of {db.query(Product).count()} total")
         
         if pre_filtered_products: